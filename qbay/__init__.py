@@ -23,4 +23,37 @@ else:
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../db.sqlite'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = '69cae04b04756f65eabcd2c5a11c8c24'
+# seconds a replayed checkout/product creation returns the recorded result
+app.config['IDEMPOTENCY_TTL'] = 600
+app.config['IDEMPOTENCY_MAX_KEYS'] = 10000
+# seconds stock stays held for a buyer after opening the checkout page
+app.config['RESERVATION_TTL'] = 300
+# ledger entries a balance read may sum before the ledger is compacted
+# at the end of the request
+app.config['LEDGER_SNAPSHOT_EVERY'] = 100
+# users kept by the authenticate decorator, and seconds each is kept
+app.config['AUTH_CACHE_SIZE'] = 1024
+app.config['AUTH_CACHE_TTL'] = 60
+# failed login attempts allowed in a burst, and refilled per second, for
+# each client IP address and each email
+app.config['LOGIN_IP_BURST'] = 50
+app.config['LOGIN_IP_RATE'] = 1
+app.config['LOGIN_EMAIL_BURST'] = 10
+app.config['LOGIN_EMAIL_RATE'] = 0.1
+app.config['LOGIN_THROTTLE_MAX_KEYS'] = 100000
+# PBKDF2 iterations for new password hashes (existing hashes are
+# upgraded on login), and threads hashing passwords at once
+app.config['PASSWORD_HASH_ITERATIONS'] = 260000
+app.config['PASSWORD_HASH_WORKERS'] = 4
+# product titles the R4-8 title filter is first sized for
+app.config['PRODUCT_TITLE_FILTER_CAPACITY'] = 100000
+# products per page of shop search results
+app.config['SEARCH_PAGE_SIZE'] = 20
+# most titles returned by /api/products/suggest
+app.config['SUGGESTION_LIMIT'] = 10
+# share of a misspelled search's trigrams a title must contain, titles
+# scored per search at most, and results a fuzzy search returns
+app.config['FUZZY_SEARCH_THRESHOLD'] = 0.3
+app.config['FUZZY_SEARCH_MAX_CANDIDATES'] = 2000
+app.config['FUZZY_SEARCH_RESULTS'] = 100
 db = SQLAlchemy(app)
@@ -1,6 +1,9 @@
 from qbay import app
 from qbay.models import *
 from qbay.controllers import *
+from qbay.migrations import migrate
+from qbay.suggestions import product_suggestions
+from qbay.trigrams import product_trigrams
 
 """
 This file runs the server at a given port
@@ -9,4 +12,7 @@ This file runs the server at a given port
 FLASK_PORT = 8081
 
 if __name__ == "__main__":
+    migrate()
+    product_suggestions.load()
+    product_trigrams.load()
     app.run(debug=True, port=FLASK_PORT, host='0.0.0.0')
@@ -0,0 +1,74 @@
+"""
+File contains functionality relating to a buyer's cart
+"""
+
+from qbay.models import CartItem, Product, User
+from qbay import db
+
+
+def add_to_cart(buyer_email, product_id, quantity=1):
+    """
+    Adds a product to a buyer's cart. Adding a product that is
+    already in the cart increases its quantity.
+      Parameters:
+        buyer_email (string):   email of buyer
+        product_id (int):       id of the product
+        quantity (int):         quantity to add
+      Returns:
+        True if the product was added to the cart, otherwise False
+    """
+    if (quantity <= 0):
+        return False
+
+    buyer_id = db.session.query(User.id).filter_by(
+        email=buyer_email).scalar()
+    owner_email = db.session.query(Product.owner_email).filter_by(
+        id=product_id).scalar()
+    if (buyer_id is None or owner_email is None):
+        return False
+
+    # Requirement: A user cannot place an order for their own products.
+    if (owner_email == buyer_email):
+        return False
+
+    updated = db.session.query(CartItem).filter_by(
+        buyer=buyer_id, product_id=product_id).update(
+        {CartItem.quantity: CartItem.quantity + quantity},
+        synchronize_session=False)
+    if (updated == 0):
+        db.session.add(CartItem(buyer=buyer_id, product_id=product_id,
+                                quantity=quantity))
+    db.session.commit()
+    return True
+
+
+def remove_from_cart(buyer_email, product_id):
+    """
+    Removes a product from a buyer's cart
+      Parameters:
+        buyer_email (string):   email of buyer
+        product_id (int):       id of the product
+      Returns:
+        True if the product was in the cart, otherwise False
+    """
+    buyer_id = db.session.query(User.id).filter_by(
+        email=buyer_email).scalar()
+    removed = db.session.query(CartItem).filter_by(
+        buyer=buyer_id, product_id=product_id).delete(
+        synchronize_session=False)
+    db.session.commit()
+    return removed > 0
+
+
+def get_cart(buyer_email):
+    """
+    Returns the lines of a buyer's cart
+      Parameters:
+        buyer_email (string):   email of buyer
+      Returns:
+        A list of (Product, quantity) pairs
+    """
+    return db.session.query(Product, CartItem.quantity).join(
+        CartItem, CartItem.product_id == Product.id).join(
+        User, User.id == CartItem.buyer).filter(
+        User.email == buyer_email).order_by(CartItem.id).all()
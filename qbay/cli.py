@@ -0,0 +1,100 @@
+"""
+Maintenance commands, run from the repository root with
+    python -m qbay.cli <command>
+"""
+
+import argparse
+import csv
+from qbay.migrations import MigrationError, current_version, migrate
+from qbay.products import import_products
+from qbay.users import register_many
+from qbay.sales import rebuild_sales_rollups
+from qbay.search import rebuild_search_index
+from qbay.ledger import compact_all
+from qbay.suggestions import product_suggestions
+from qbay.trigrams import product_trigrams
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m qbay.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate",
+                        help="apply pending schema migrations")
+    commands.add_parser("rebuild-sales-rollups",
+                        help="recompute seller sales rollups from the "
+                             "transaction table")
+    commands.add_parser("rebuild-search-index",
+                        help="rebuild the product search index from the "
+                             "product table")
+    commands.add_parser("search-stats",
+                        help="build the in-memory title indexes from the "
+                             "product table and report their sizes")
+    commands.add_parser("compact-ledgers",
+                        help="fold recent ledger entries into every "
+                             "user's balance snapshot")
+    register = commands.add_parser(
+        "register-users",
+        help="register users from a CSV file of user_name,email,password "
+             "rows")
+    register.add_argument("path", help="CSV file to read")
+    products = commands.add_parser(
+        "import-products",
+        help="create products from a CSV or JSON Lines file")
+    products.add_argument("owner_email", help="owner of the products")
+    products.add_argument("path", help="file to read")
+    products.add_argument("--format", choices=["csv", "jsonl"],
+                          help="file format, guessed if omitted")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        try:
+            applied = migrate()
+        except MigrationError as error:
+            parser.exit(1, "Migration failed: {}.\n".format(error))
+        print("Applied {} migrations, schema version {}.".format(
+            len(applied), current_version()))
+    elif args.command == "rebuild-sales-rollups":
+        rows = rebuild_sales_rollups()
+        print("Rebuilt {} sales rollup rows.".format(rows))
+    elif args.command == "rebuild-search-index":
+        products = rebuild_search_index()
+        print("Indexed {} products.".format(products))
+    elif args.command == "search-stats":
+        # the indexes of this process, built as the server builds them at
+        # startup
+        product_suggestions.load()
+        product_trigrams.load()
+        suggestions = product_suggestions.stats()
+        fuzzy = product_trigrams.stats()
+        print("Suggestions: {} titles, {:.1f} MiB.".format(
+            suggestions.titles, suggestions.bytes / 2 ** 20))
+        print("Fuzzy search: {} titles, {} trigrams, {} postings, "
+              "{:.1f} MiB.".format(fuzzy.titles, fuzzy.trigrams,
+                                   fuzzy.postings, fuzzy.bytes / 2 ** 20))
+    elif args.command == "compact-ledgers":
+        entries = compact_all()
+        print("Compacted {} ledger entries.".format(entries))
+    elif args.command == "register-users":
+        with open(args.path, newline="") as csv_file:
+            results = register_many(tuple(row) for row in
+                                    csv.reader(csv_file) if len(row) == 3)
+        for result in results:
+            if (not result.success):
+                print("{}: {}".format(result.email, result.reason))
+        print("Registered {} of {} users.".format(
+            sum(result.success for result in results), len(results)))
+    elif args.command == "import-products":
+        imported = rows = 0
+        with open(args.path, newline="") as product_file:
+            for result in import_products(product_file, args.owner_email,
+                                          args.format):
+                rows += 1
+                imported += result.success
+                if (not result.success):
+                    print("row {} ({}): {}".format(result.row, result.title,
+                                                   result.reason))
+        print("Imported {} of {} products.".format(imported, rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,63 @@
 from os import name
-from flask import render_template, request, session, redirect
+from flask import render_template, request, session, redirect, jsonify, \
+    Response, stream_with_context
 
-from qbay.models import Product, Transaction, User
-from qbay.products import (create_product, update_product_description,
-                           update_product_price, update_product_quantity,
-                           update_product_title)
+from qbay.models import Product, Transaction
+from qbay.products import (create_product, get_product, import_products,
+                           update_product)
 from qbay.users import login, register, update_user_name, \
-    update_shipping_address, update_postal_code, get_userid
-from qbay.transactions import order_product
+    update_shipping_address, update_postal_code, get_userid, get_balance, \
+    get_user_profile, update_profile
+from qbay.transactions import (place_order, order_cart,
+                               get_order_history, get_sales_history,
+                               start_flash_sale, stop_flash_sale,
+                               ORDER_PENDING)
+from qbay.cart import add_to_cart, get_cart, remove_from_cart
+from qbay.sales import get_seller_sales
+from qbay.search import fuzzy_search_products, search_products
+from qbay.suggestions import product_suggestions
+from qbay.idempotency import IdempotencyStore
+from qbay.reservations import stock_holds
+from qbay.flash_sale import get_flash_sale
+from qbay.lookups import lookup_stats
+from qbay.ledger import compact_due
+from qbay.user_cache import authenticated_users
 from qbay import app, db
 from functools import wraps
+import csv
+import io
+import uuid
+
+
+# profile fields views read from the logged in user; the balance changes
+# with every order, so views read it with get_balance instead
+AUTH_FIELDS = ("id", "email", "user_name", "shipping_address",
+               "postal_code")
+
+idempotency_store = IdempotencyStore(app.config['IDEMPOTENCY_TTL'],
+                                     app.config['IDEMPOTENCY_MAX_KEYS'])
+
+
+@app.after_request
+def report_lookups(response):
+    """
+    Reports the request's user and product lookup cache hits and misses
+    in the X-Lookup-Cache response header.
+    """
+    stats = lookup_stats()
+    response.headers['X-Lookup-Cache'] = "hits={}; misses={}".format(
+        stats.hits, stats.misses)
+    return response
+
+
+@app.teardown_request
+def compact_ledgers(exception):
+    """
+    Compacts the ledgers whose long tails were read during the request,
+    once the request's own work is done.
+    """
+    if exception is None:
+        compact_due()
 
 
 def authenticate(inner_function):
@@ -17,7 +65,8 @@ def authenticate(inner_function):
     :param inner_function: any python function that accepts a user object
     Wrap any python function and check the current session to see if
     the user has logged in. If login, it will call the inner_function
-    with the logged in user object.
+    with the logged in user's profile (a UserProfile with AUTH_FIELDS),
+    served from the authenticated user cache when possible.
     To wrap a function, we can put a decoration on that function.
     Example:
     @authenticate
@@ -31,8 +80,8 @@ def authenticate(inner_function):
         if 'logged_in' in session:
             email = session['logged_in']
             try:
-                user = db.session.query(User).filter_by(
-                    email=email).one_or_none()
+                user = authenticated_users.get(
+                    email, lambda: get_user_profile(email, AUTH_FIELDS))
                 if user:
                     # if the user exists, call the inner_function
                     # with user as parameter
@@ -47,6 +96,57 @@ def authenticate(inner_function):
     return wrapped_inner
 
 
+def idempotent(inner_function):
+    """
+    :param inner_function: a view function that accepts a user object
+    Wrap a POST view so that a request repeating an idempotency key
+    (sent as the Idempotency-Key header or the idempotency_key form
+    field) gets the response recorded for the first request with that
+    key, instead of running the view again.
+    Example:
+    @authenticate
+    @idempotent
+    def checkout_post(user):
+        pass
+    """
+    @wraps(inner_function)
+    def wrapped_inner(user):
+        key = (request.headers.get('Idempotency-Key') or
+               request.form.get('idempotency_key'))
+        if not key:
+            return inner_function(user)
+
+        # keys are only ever replayed for the same page and user
+        scoped_key = (request.path, user.email, key)
+        earlier = idempotency_store.begin(scoped_key)
+        if earlier is not None:
+            recorded = idempotency_store.wait(earlier, timeout=30)
+            if recorded is None:
+                return "Request already in progress, please retry.", 409
+            body, status, headers = recorded
+            return app.response_class(body, status=status, headers=headers)
+
+        try:
+            response = app.make_response(inner_function(user))
+        except Exception:
+            idempotency_store.abandon(scoped_key)
+            raise
+        idempotency_store.finish(scoped_key, (response.get_data(),
+                                              response.status_code,
+                                              list(response.headers)))
+        return response
+
+    return wrapped_inner
+
+
+@app.template_global()
+def idempotency_key():
+    """
+    Returns a new idempotency key for a form
+    """
+    return uuid.uuid4().hex
+
+
 @app.route('/login', methods=['GET'])
 def login_get():
     """
@@ -65,7 +165,7 @@ def login_post():
 
     email = request.form.get('email')
     password = request.form.get('password')
-    user = login(email, password)
+    user = login(email, password, request.remote_addr)
     if user:
         session['logged_in'] = user.email
         """
@@ -200,8 +300,17 @@ def update_profile_post(user):
     postal_code = request.form.get('postal_code')
     error_message = None
 
-    # each update gets their own button for now
-    if request.form["submit-button"] == "Update Username":
+    # "Update Profile" saves every filled in field at once; the other
+    # buttons save a single field
+    if request.form["submit-button"] == "Update Profile":
+        fields = {'user_name': user_name,
+                  'shipping_address': shipping_address,
+                  'postal_code': postal_code}
+        success = update_profile(user.email, **{
+            field: value for field, value in fields.items() if value})
+        if not success:
+            error_message = "Failed to Update Profile"
+    elif request.form["submit-button"] == "Update Username":
         success = update_user_name(user.email, user_name)
         if not success:
             error_message = "Failed to Update Username"
@@ -237,6 +346,7 @@ def product_creation_get(user):
 
 @app.route('/product-creation', methods=['POST'])
 @authenticate
+@idempotent
 def product_creation_post(user):
     """
     Post request for the product creation page. Adds a product to the database
@@ -270,6 +380,39 @@ def product_creation_post(user):
         return redirect('/')
 
 
+@app.route('/product-import', methods=['POST'])
+@authenticate
+def product_import_post(user):
+    """
+    Post request for importing products from an uploaded CSV or JSON
+    Lines file (see products.import_products).
+      Parameters:
+        user (User) : a User object representing the user currently logged in
+      Returns:
+        A CSV report with one line per row of the file, streamed as the
+        rows are imported.
+    """
+    upload = request.files.get('file')
+    if upload is None:
+        return render_template('product-creation.html', user=user,
+                               message="Choose a file to import.")
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8',
+                              newline='')
+
+    def report():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["row", "title", "success", "reason"])
+        for result in import_products(stream, user.email):
+            writer.writerow(result)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(report()), mimetype='text/csv')
+
+
 @app.route('/update-product', methods=['GET'])
 @authenticate
 def update_product_get(user):
@@ -281,9 +424,7 @@ def update_product_get(user):
         The update product HTML page (if the user is logged in).
     """
     print("Attempting to GET update-product page.")
-    product = db.session.query(Product).filter_by(owner_email=user.email,
-                                                  title=session
-                                                  ["product_title"]).first()
+    product = get_product(session["product_title"], user.email)
     print("Found product, return HTML page. Product title: ", product.title)
 
     return render_template('update-product.html', user=user, product=product)
@@ -310,30 +451,19 @@ def update_product_post(user):
     new_quantity = request.form.get('quantity')
     error_message = None
 
-    product = db.session.query(Product).filter_by(owner_email=user.email,
-                                                  title=session
-                                                  ["product_title"]).first()
-
-    success = True
-    if (not(new_title == "")):
-        success = success and update_product_title(product.title,
-                                                   session['logged_in'],
-                                                   new_title)
-
-    if (not(new_description == "")):
-        success = success and update_product_description(product.title,
-                                                         session['logged_in'],
-                                                         new_description)
+    product = get_product(session["product_title"], user.email)
 
-    if (not(new_price == "")):
-        success = success and update_product_price(product.title,
-                                                   session['logged_in'],
-                                                   int(new_price) * 100)
-
-    if (not(new_quantity == "")):
-        success = success and update_product_quantity(product.title,
-                                                      session['logged_in'],
-                                                      int(new_quantity))
+    # every filled in field is validated and saved together
+    changes = {}
+    if new_title != "":
+        changes['title'] = new_title
+    if new_description != "":
+        changes['description'] = new_description
+    if new_price != "":
+        changes['price'] = int(new_price) * 100
+    if new_quantity != "":
+        changes['quantity'] = int(new_quantity)
+    success = not changes or update_product(product.id, **changes)
 
     if not success:
         error_message = "Update failed."
@@ -350,21 +480,52 @@ def update_product_post(user):
         return redirect('/')
 
 
+@app.route('/flash-sale', methods=['POST'])
+@authenticate
+def flash_sale_post(user):
+    """
+    Post request starting or stopping flash-sale mode for the product
+    being updated.
+      Parameters:
+        user (User) : a User object representing the user currently logged in
+      Returns:
+        The main HTML page (if the user is logged in).
+    """
+    title = session["product_title"]
+    if request.form.get('action') == 'start':
+        start_flash_sale(title, user.email)
+    else:
+        stop_flash_sale(title, user.email)
+    return redirect('/')
+
+
 @app.route('/shop', methods=['GET'])
 @authenticate
 def shop_get(user):
     """
-    Get request for the shop page.
+    Get request for the shop page. Shows one page of the products
+    matching the search in the q parameter, or of every product if there
+    is no search. With mode=fuzzy the search tolerates misspelled titles.
       Parameters:
         user (User) : a User object representing the user currently logged in
       Returns:
         The shop HTML page (if the user is logged in).
     """
+    query = request.args.get('q', default='')
+    page = request.args.get('page', default=1, type=int)
+    mode = request.args.get('mode', default='')
     # Only display products that the current user is not selling
-    products = [p for p in db.session.query(Product).all()
-                if (p.owner_email != user.email) and (p.quantity > 0)]
-    return render_template('shop.html', user=user, products=products,
-                           message="")
+    if mode == 'fuzzy' and query:
+        results = fuzzy_search_products(query, page,
+                                        exclude_owner=user.email)
+    else:
+        results = search_products(query, page, exclude_owner=user.email)
+    message = ""
+    if query and results.total == 0:
+        message = "No products match your search."
+    return render_template('shop.html', user=user, products=results.products,
+                           results=results, query=query, mode=mode,
+                           balance=get_balance(user.email), message=message)
 
 
 @app.route('/shop', methods=["POST"])
@@ -396,12 +557,23 @@ def checkout_get(user):
     product = db.session.query(Product).filter_by(title=session
                                                   ["product_title"]).first()
 
+    # hold one unit while the buyer decides; flash sales admit orders
+    # through their own queue instead
+    message = "Checkout"
+    if get_flash_sale(product.title, product.owner_email) is None:
+        if stock_holds.reserve(product.id, user.id, 1, product.quantity):
+            message = "One unit is held for you for {} minutes".format(
+                stock_holds.ttl // 60)
+    available = (product.quantity -
+                 stock_holds.held_by_others(product.id, user.id))
+
     return render_template('checkout.html', user=user, product=product,
-                           message="Checkout")
+                           available=available, message=message)
 
 
 @app.route('/checkout', methods=['POST'])
 @authenticate
+@idempotent
 def checkout_post(user):
     """
     Post request for the checkout page
@@ -415,17 +587,168 @@ def checkout_post(user):
 
     error_message = None
     new_quantity = request.form.get('quantity')
-    success = False
+    result = None
     if new_quantity != "":
-        success = order_product(product.title, int(new_quantity), user.email,
-                                product.owner_email)
-    if not success:
+        result = place_order(product.title, int(new_quantity), user.email,
+                             product.owner_email)
+    if result is not None and result.reason == ORDER_PENDING:
+        error_message = ("Your order is still being processed. Check your "
+                         "order history before ordering again.")
+    elif result is None or not result.success:
         error_message = "Unable to purchase product."
 
     if error_message:
+        available = (product.quantity -
+                     stock_holds.held_by_others(product.id, user.id))
         return render_template('checkout.html',
                                product=product,
+                               available=available,
                                user=user,
                                error=error_message)
     else:
         return redirect('/shop')
+
+
+@app.route('/cart', methods=['GET'])
+@authenticate
+def cart_get(user):
+    """
+    Get request for the cart page
+      Parameters:
+        user (User) : a User object representing the user currently logged in
+      Returns:
+        The cart HTML page (if the user is logged in).
+    """
+    return render_cart(user, message="Cart")
+
+
+@app.route('/cart', methods=['POST'])
+@authenticate
+def cart_post(user):
+    """
+    Post request for the cart page. Purchases every product in the cart.
+      Parameters:
+        user (User) : a User object representing the user currently logged in
+      Returns:
+        The shop HTML page if the order is successful, otherwise the cart
+        HTML page (if the user is logged in).
+    """
+    result = order_cart(user.email)
+    if not result.success:
+        return render_cart(user, error="Unable to purchase cart: " +
+                           result.reason)
+    return redirect('/shop')
+
+
+@app.route('/cart/add', methods=['POST'])
+@authenticate
+def cart_add_post(user):
+    """
+    Post request adding a product to the cart
+      Parameters:
+        user (User) : a User object representing the user currently logged in
+      Returns:
+        The cart HTML page (if the user is logged in).
+    """
+    product_id = request.form.get('product_id', type=int)
+    quantity = request.form.get('quantity', default=1, type=int)
+    if not add_to_cart(user.email, product_id, quantity):
+        return render_cart(user, error="Unable to add product to cart.")
+    return redirect('/cart')
+
+
+@app.route('/cart/remove', methods=['POST'])
+@authenticate
+def cart_remove_post(user):
+    """
+    Post request removing a product from the cart
+      Parameters:
+        user (User) : a User object representing the user currently logged in
+      Returns:
+        The cart HTML page (if the user is logged in).
+    """
+    remove_from_cart(user.email, request.form.get('product_id', type=int))
+    return redirect('/cart')
+
+
+def render_cart(user, message="", error=""):
+    """
+    Renders the cart page for a user
+      Parameters:
+        user (User) :       the user currently logged in
+        message (string):   message to display
+        error (string):     error to display
+    """
+    lines = get_cart(user.email)
+    total = sum(product.price * quantity for product, quantity in lines)
+    return render_template('cart.html', user=user, lines=lines, total=total,
+                           message=message, error=error)
+
+
+@app.route('/order-history', methods=['GET'])
+@authenticate
+def order_history_get(user):
+    """
+    Get request for the order history page. Shows purchases, or sales
+    when the view argument is "sales", one page at a time.
+      Parameters:
+        user (User) : a User object representing the user currently logged in
+      Returns:
+        The order history HTML page (if the user is logged in).
+    """
+    view = request.args.get('view', 'purchases')
+    cursor = request.args.get('cursor')
+    if view == 'sales':
+        page = get_sales_history(user.email, cursor)
+    else:
+        page = get_order_history(user.email, cursor)
+    return render_template('order-history.html', user=user, view=view,
+                           entries=page.entries, next_cursor=page.next_cursor)
+
+
+@app.route('/sales', methods=['GET'])
+@authenticate
+def sales_get(user):
+    """
+    Get request for the seller sales dashboard
+      Parameters:
+        user (User) : a User object representing the user currently logged in
+      Returns:
+        The sales HTML page (if the user is logged in).
+    """
+    days = request.args.get('days', default=30, type=int)
+    rows = get_seller_sales(user.email, days)
+    return render_template('sales.html', user=user, rows=rows, days=days,
+                           units=sum(row.units for row in rows),
+                           revenue=sum(row.revenue for row in rows))
+
+
+@app.route('/api/sales', methods=['GET'])
+@authenticate
+def sales_api_get(user):
+    """
+    Get request for the seller sales rollups as JSON
+      Parameters:
+        user (User) : a User object representing the user currently logged in
+      Returns:
+        The units sold and revenue (in cents) per product per day.
+    """
+    days = request.args.get('days', default=30, type=int)
+    return jsonify([{"day": row.day.isoformat(),
+                     "product": row.title,
+                     "units": row.units,
+                     "revenue": row.revenue}
+                    for row in get_seller_sales(user.email, days)])
+
+
+@app.route('/api/products/suggest', methods=['GET'])
+def suggest_api_get():
+    """
+    Get request for the product titles starting with a prefix, for
+    search-as-you-type. Answered from memory, without a database query.
+      Returns:
+        A JSON list of titles in alphabetical order.
+    """
+    prefix = request.args.get('prefix', default='')
+    limit = request.args.get('limit', type=int)
+    return jsonify(product_suggestions.suggest(prefix, limit))
@@ -0,0 +1,174 @@
+"""
+File contains the flash-sale admission queue. While a product is in
+flash-sale mode its stock is counted in memory: purchase requests take
+their units from that count as they are admitted and are queued for a
+single drainer thread, which applies them to the database in batches.
+Once the count reaches zero requests are refused without touching the
+database. Orders placed around the sale (order_cart, a seller editing
+the quantity) are not counted; a batch that finds less stock in the
+database than counted applies what fits and resets the count from the
+database. Sales are found by product title, so update_product refuses to
+change the title or price of a product while its sale runs.
+"""
+
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+
+FlashRequest = namedtuple("FlashRequest", ["buyer_email", "quantity",
+                                           "future"])
+
+# registered sales, keyed by (title, owner_email)
+_sales = {}
+_sales_lock = threading.Lock()
+
+
+class FlashSale:
+    """
+    Admission queue and drainer for one product
+    """
+
+    def __init__(self, product_id, title, owner_email, seller_id, price,
+                 stock, apply_batch, batch_size=50):
+        """
+          Parameters:
+            product_id (int):       id of the product
+            title (string):         product title
+            owner_email (string):   product owner email
+            seller_id (int):        id of the product owner
+            price (int):            product price
+            stock (int):            quantity available when the sale starts
+            apply_batch (function): called by the drainer with the sale and
+                                    a list of FlashRequest; applies them in
+                                    one database transaction and returns
+                                    one OrderResult per request, and the
+                                    stock left in the database if the
+                                    count had to be corrected (else None)
+            batch_size (int):       maximum requests applied per batch
+        """
+        self.product_id = product_id
+        self.title = title
+        self.owner_email = owner_email
+        self.seller_id = seller_id
+        self.price = price
+        self.remaining = stock
+        self.apply_batch = apply_batch
+        self.batch_size = batch_size
+        self.batches = 0
+        # units admitted but not yet applied by the drainer
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._drainer = threading.Thread(target=self._drain, daemon=True)
+        self._drainer.start()
+
+    def admit(self, buyer_email, quantity):
+        """
+        Takes units from the in-memory stock and queues the request
+          Parameters:
+            buyer_email (string):   email of buyer
+            quantity (int):         quantity requested by the buyer
+          Returns:
+            A Future resolved with the OrderResult of the request, or
+            None if the sale cannot cover the quantity
+        """
+        with self._lock:
+            if quantity > self.remaining:
+                return None
+            self.remaining -= quantity
+            self._queued += quantity
+        request = FlashRequest(buyer_email, quantity, Future())
+        self._queue.put(request)
+        return request.future
+
+    def sold_out(self):
+        return self.remaining <= 0
+
+    def stop(self):
+        """
+        Stops the drainer once every queued request has been applied
+        """
+        self._queue.put(None)
+        self._drainer.join()
+
+    def _drain(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            batch = [request]
+            while len(batch) < self.batch_size:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._queue.put(None)
+                    break
+                batch.append(request)
+            self._apply(batch)
+
+    def _apply(self, batch):
+        try:
+            results, stock = self.apply_batch(self, batch)
+        except Exception as error:
+            self._settle(batch, batch, None)
+            for request in batch:
+                request.future.set_exception(error)
+            return
+
+        self.batches += 1
+        self._settle(batch, [request for request, result in
+                             zip(batch, results) if not result.success],
+                     stock)
+        for request, result in zip(batch, results):
+            request.future.set_result(result)
+
+    def _settle(self, batch, refused, stock):
+        """
+        Updates the count once a batch is applied: the units of refused
+        requests are returned, or if the database stock is known the
+        count is reset to it, less the units still queued
+        """
+        with self._lock:
+            self._queued -= sum(r.quantity for r in batch)
+            if stock is None:
+                self.remaining += sum(r.quantity for r in refused)
+            else:
+                self.remaining = max(stock - self._queued, 0)
+
+
+def add_flash_sale(sale):
+    """
+    Registers a sale so orders for its product go through its queue
+      Returns:
+        True if the product had no sale running, otherwise False
+    """
+    with _sales_lock:
+        key = (sale.title, sale.owner_email)
+        if key in _sales:
+            return False
+        _sales[key] = sale
+        return True
+
+
+def get_flash_sale(title, owner_email):
+    """
+    Returns the running sale of a product, or None
+    """
+    return _sales.get((title, owner_email))
+
+
+def remove_flash_sale(title, owner_email):
+    """
+    Unregisters and stops the sale of a product
+      Returns:
+        True if the product had a sale running, otherwise False
+    """
+    with _sales_lock:
+        sale = _sales.pop((title, owner_email), None)
+    if sale is None:
+        return False
+    sale.stop()
+    return True
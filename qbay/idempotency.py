@@ -0,0 +1,111 @@
+"""
+File contains an in-process store of idempotency keys. The first request
+carrying a key runs normally and its result is recorded; replays of the
+same key within the TTL get the recorded result back without running
+the write path again.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Entry:
+    """A key that is being processed or has a recorded result"""
+    __slots__ = ("expires", "done", "result")
+
+    def __init__(self, expires):
+        self.expires = expires
+        self.done = threading.Event()
+        self.result = None
+
+
+class IdempotencyStore:
+    """
+    TTL-bounded store of request results keyed by idempotency key.
+    Keys expire in the order they were created, so expiry only ever
+    looks at the oldest keys.
+    """
+
+    def __init__(self, ttl=600, max_keys=10000, clock=time.monotonic):
+        """
+          Parameters:
+            ttl (float):        seconds a recorded result is kept
+            max_keys (int):     maximum number of keys kept; the oldest
+                                keys are dropped first
+            clock (function):   returns the current time in seconds
+        """
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def begin(self, key):
+        """
+        Claims a key for a new request
+          Parameters:
+            key (hashable): the idempotency key
+          Returns:
+            None if the caller should process the request (and then call
+            finish or abandon), otherwise the entry of the earlier
+            request to pass to wait
+        """
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+            self._entries[key] = _Entry(now + self.ttl)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+            return None
+
+    def finish(self, key, result):
+        """
+        Records the result of a processed request
+          Parameters:
+            key (hashable): the idempotency key
+            result:         the value returned to replays of the key
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            entry.result = result
+            entry.done.set()
+
+    def abandon(self, key):
+        """
+        Forgets a key whose request failed, so that a retry runs again
+          Parameters:
+            key (hashable): the idempotency key
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+    @staticmethod
+    def wait(entry, timeout=None):
+        """
+        Waits for the earlier request of a key to finish
+          Parameters:
+            entry:              value returned by begin
+            timeout (float):    seconds to wait at most
+          Returns:
+            The recorded result, or None if the earlier request did not
+            finish or was abandoned
+        """
+        entry.done.wait(timeout)
+        return entry.result
+
+    def _expire(self, now):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires > now:
+                break
+            del self._entries[key]
@@ -0,0 +1,224 @@
+"""
+File contains the balance ledger. Every balance movement is inserted as
+a LedgerEntry instead of updating the User row. A user's balance is the
+User.balance snapshot plus the entries posted after the snapshot's
+watermark; compaction periodically folds those entries into the
+snapshot so reading a balance only ever sums a short tail.
+
+Reading a balance never writes: a read finding a long tail marks the
+user, and compact_due folds the marked ledgers after the request (or
+the compact-ledgers command folds every ledger).
+"""
+
+import datetime
+import threading
+from sqlalchemy.exc import IntegrityError
+from qbay.models import BalanceSnapshot, LedgerEntry, User
+from qbay import app, db
+
+# users whose ledger tail a balance read found long, for compact_due
+_due = set()
+_due_lock = threading.Lock()
+
+
+def post(user, delta, floor=None):
+    """
+    Inserts a balance movement with a single statement. Does not commit.
+      Parameters:
+        user (int or string):   id or email of the user
+        delta (int):            amount added to the balance (negative to
+                                remove)
+        floor (int):            if given, the entry is only inserted when
+                                the resulting balance is at least floor
+      Returns:
+        True if the entry was inserted, otherwise False
+    """
+    return post_many([(user, delta)], floor) == 1
+
+
+def post_many(entries, floor=None):
+    """
+    Inserts many balance movements with one statement, executed once per
+    entry. Does not commit.
+      Parameters:
+        entries (list): (user id or email, delta) pairs
+        floor (int):    if given, each entry is only inserted when the
+                        resulting balance of its user is at least floor
+      Returns:
+        The number of entries inserted
+    """
+    if (not entries):
+        return 0
+    date = datetime.datetime.now()
+
+    if (floor is None and all(isinstance(user, int) for user, _ in entries)):
+        # plain inserts: crediting a user never reads or locks their row
+        db.session.execute(LedgerEntry.__table__.insert(),
+                           [{"user_id": user, "delta": delta, "date": date}
+                            for user, delta in entries])
+        return len(entries)
+
+    rows = [{"user_id": user if isinstance(user, int) else None,
+             "email": None if isinstance(user, int) else user,
+             "delta": delta, "date": date} for user, delta in entries]
+    result = db.session.execute(_guarded_insert(floor), rows)
+    return result.rowcount
+
+
+def _guarded_insert(floor):
+    """
+    Builds the INSERT ... SELECT posting one entry for the user matching
+    the user_id or email parameter. The balance check and the insert are
+    one statement, so they cannot interleave with another movement of the
+    same balance.
+    """
+    delta = db.bindparam("delta", type_=db.Integer)
+    guarded = db.select(User.id, delta,
+                        db.bindparam("date", type_=db.DateTime)).where(
+        db.or_(User.id == db.bindparam("user_id", type_=db.Integer),
+               User.email == db.bindparam("email", type_=db.String)))
+    if (floor is not None):
+        guarded = guarded.where(
+            User.balance + _tail(User.id, db.func.sum(LedgerEntry.delta)) +
+            delta >= floor)
+    return LedgerEntry.__table__.insert().from_select(
+        ["user_id", "delta", "date"], guarded)
+
+
+def balance_expression(user_id):
+    """
+    Returns a SQL expression for the current balance of a user
+      Parameters:
+        user_id (int or expression): id of the user
+    """
+    snapshot = db.select(User.balance).where(
+        User.id == user_id).scalar_subquery()
+    return snapshot + _tail(user_id, db.func.sum(LedgerEntry.delta))
+
+
+def row_balance():
+    """
+    Returns SQL expressions for the current balance and the ledger tail
+    length of the User row being selected, for queries over the user
+    table. Pass both results to settle().
+    """
+    return (User.balance + _tail(User.id, db.func.sum(LedgerEntry.delta)),
+            _tail(User.id, db.func.count(LedgerEntry.id)))
+
+
+def settle(user_id, current, tail_length):
+    """
+    Returns a balance read together with its tail length, marking the
+    user's ledger for compact_due if its tail has grown past
+    LEDGER_SNAPSHOT_EVERY entries. Does not touch the session.
+      Parameters:
+        user_id (int):          id of the user
+        current (int):          balance read, None if the user does not
+                                exist
+        tail_length (int):      number of entries since the last snapshot
+      Returns:
+        The balance
+    """
+    if (current is not None and
+            tail_length >= app.config['LEDGER_SNAPSHOT_EVERY']):
+        with _due_lock:
+            _due.add(user_id)
+    return current
+
+
+def _tail(user_id, aggregate):
+    """
+    Returns a SQL expression aggregating the entries posted since the
+    user's last snapshot
+    """
+    # correlated explicitly: when user_id is User.id of an outer query,
+    # auto-correlation would only look one level up and add its own
+    # user table instead
+    watermark = db.select(BalanceSnapshot.last_entry_id).where(
+        BalanceSnapshot.user_id == user_id).correlate_except(
+        BalanceSnapshot).scalar_subquery()
+    return db.select(db.func.coalesce(aggregate, 0)).where(
+        LedgerEntry.user_id == user_id,
+        LedgerEntry.id > db.func.coalesce(watermark, 0)).scalar_subquery()
+
+
+def compact(user_id):
+    """
+    Folds the entries posted since the user's last snapshot into
+    User.balance and moves the snapshot watermark past them. Commits.
+      Parameters:
+        user_id (int):  id of the user
+      Returns:
+        The number of entries folded
+    """
+    watermark = db.session.query(BalanceSnapshot.last_entry_id).filter_by(
+        user_id=user_id).scalar()
+
+    # a locking read, so that on databases with row locks an entry that
+    # is still being inserted is waited for rather than skipped
+    last_entry_id, total, count = db.session.query(
+        db.func.max(LedgerEntry.id),
+        db.func.coalesce(db.func.sum(LedgerEntry.delta), 0),
+        db.func.count(LedgerEntry.id)
+    ).filter(LedgerEntry.user_id == user_id,
+             LedgerEntry.id > (watermark or 0)).with_for_update().one()
+    if (count == 0):
+        return 0
+
+    # moving the watermark is conditional, so two concurrent compactions
+    # of the same user cannot both fold the same entries
+    date = datetime.datetime.now()
+    try:
+        if (watermark is None):
+            db.session.add(BalanceSnapshot(user_id=user_id,
+                                           last_entry_id=last_entry_id,
+                                           date=date))
+            db.session.flush()
+            moved = 1
+        else:
+            moved = db.session.query(BalanceSnapshot).filter_by(
+                user_id=user_id, last_entry_id=watermark).update(
+                {BalanceSnapshot.last_entry_id: last_entry_id,
+                 BalanceSnapshot.date: date}, synchronize_session=False)
+    except IntegrityError:
+        moved = 0
+    if (moved != 1):
+        db.session.rollback()
+        return 0
+
+    db.session.query(User).filter(User.id == user_id).update(
+        {User.balance: User.balance + total}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def compact_due():
+    """
+    Compacts the ledgers that balance reads found long. Rolls back the
+    session first and commits, so it is called once the caller's own
+    work is done, e.g. at the end of a request.
+      Returns:
+        The number of entries folded
+    """
+    with _due_lock:
+        user_ids = list(_due)
+        _due.clear()
+    if (not user_ids):
+        return 0
+    db.session.rollback()
+    return sum(compact(user_id) for user_id in user_ids)
+
+
+def compact_all():
+    """
+    Compacts the ledger of every user with entries since their last
+    snapshot
+      Returns:
+        The number of entries folded
+    """
+    user_ids = [user_id for user_id, in db.session.query(
+        LedgerEntry.user_id).outerjoin(
+        BalanceSnapshot, BalanceSnapshot.user_id == LedgerEntry.user_id
+    ).filter(LedgerEntry.id > db.func.coalesce(
+        BalanceSnapshot.last_entry_id, 0)).distinct()]
+    return sum(compact(user_id) for user_id in user_ids)
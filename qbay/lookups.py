@@ -0,0 +1,73 @@
+"""
+File contains a request-scoped cache of user and product lookups, so a
+request resolving the same email or product title several times only
+queries the database once. Outside a request nothing is cached.
+
+The cache lives on the request object rather than flask.g, since g
+belongs to the app context, which outlives the request when an app
+context was pushed beforehand (as the test suite does).
+"""
+
+from collections import namedtuple
+from flask import has_request_context, request
+
+LookupStats = namedtuple("LookupStats", ["hits", "misses"])
+
+
+def remember(namespace, key, name, load):
+    """
+    Returns a looked up value, loading it at most once per request
+      Parameters:
+        namespace (string):     kind of record, e.g. "user"
+        key (hashable):         identifies the record, e.g. its email
+        name (string):          which value of the record is looked up
+        load (function):        loads the value from the database
+      Returns:
+        The cached or loaded value
+    """
+    if (not has_request_context()):
+        return load()
+    records = _lookups().setdefault(namespace, {}).setdefault(key, {})
+    if (name in records):
+        request.lookup_hits += 1
+        return records[name]
+    request.lookup_misses += 1
+    records[name] = load()
+    return records[name]
+
+
+def forget(namespace, key=None):
+    """
+    Drops cached lookups after a write
+      Parameters:
+        namespace (string):     kind of record, e.g. "user"
+        key (hashable):         the record to drop, or None to drop every
+                                record of the namespace
+    """
+    if (not has_request_context()):
+        return
+    if (key is None):
+        _lookups().pop(namespace, None)
+    else:
+        _lookups().get(namespace, {}).pop(key, None)
+
+
+def lookup_stats():
+    """
+    Returns the cache hits and misses of the current request
+    """
+    if (not has_request_context() or
+            not hasattr(request, "lookups")):
+        return LookupStats(0, 0)
+    return LookupStats(request.lookup_hits, request.lookup_misses)
+
+
+def _lookups():
+    """
+    Returns the cache of the current request, creating it on first use
+    """
+    if (not hasattr(request, "lookups")):
+        request.lookups = {}
+        request.lookup_hits = 0
+        request.lookup_misses = 0
+    return request.lookups
@@ -0,0 +1,129 @@
+"""
+File contains the versioned schema migrations. Each migration runs once
+per database, in order, and is recorded in the schema_version table.
+Migrations only create what is missing, so they are safe on databases
+created before migrations existed (by the old import-time create_all).
+
+Version 1 is db.create_all(), so on a new database it creates the tables
+as the current models define them, indexes included, rather than a
+fixed schema; the later migrations then find their indexes in place.
+A migration that cannot be applied raises MigrationError; the versions
+before it stay applied and migrate resumes from it once the data is
+fixed.
+
+Run from the repository root:
+    python -m qbay.cli migrate
+The server (python -m qbay) and the test suite migrate on startup.
+"""
+
+import datetime
+from sqlalchemy.exc import IntegrityError
+from qbay import db
+from qbay.models import Product, SchemaVersion, Transaction
+from qbay.search import create_search_index
+
+# duplicate titles listed by the unique title migration's error
+DUPLICATES_SHOWN = 10
+
+
+class MigrationError(Exception):
+    """
+    A migration cannot be applied to the data in the database
+    """
+
+
+def _create_tables():
+    """
+    Creates every table missing from the database
+    """
+    db.create_all()
+
+
+def _create_indexes(table, *names):
+    """
+    Returns a migration creating the named indexes of a table, skipping
+    any that already exist
+    """
+    def apply():
+        for index in table.indexes:
+            if (index.name in names):
+                index.create(db.engine, checkfirst=True)
+    return apply
+
+
+def _unique_product_titles():
+    """
+    Replaces the plain index on Product.title with a unique one. Stops
+    with a MigrationError if products share a title, since the index
+    cannot be built until they are renamed.
+    """
+    duplicates = db.session.query(Product.title).group_by(
+        Product.title).having(db.func.count(Product.id) > 1).order_by(
+        Product.title).limit(DUPLICATES_SHOWN + 1).all()
+    db.session.commit()
+    if (duplicates):
+        titles = [title for title, in duplicates[:DUPLICATES_SHOWN]]
+        raise MigrationError(
+            "cannot make product titles unique: rename the products "
+            "sharing the title{} {}{} and migrate again".format(
+                "s" if len(duplicates) > 1 else "",
+                ", ".join(repr(title) for title in titles),
+                " and others" if len(duplicates) > DUPLICATES_SHOWN
+                else ""))
+    _create_indexes(Product.__table__, "uq_product_title")()
+    reflected = db.Table("product", db.MetaData(), autoload_with=db.engine)
+    for index in reflected.indexes:
+        if (index.name == "ix_product_title"):
+            index.drop(db.engine)
+
+
+# (version, description, migration), in the order they are applied.
+# Applied migrations are never edited; an index that a later migration
+# replaces is simply skipped by the earlier one on new databases.
+MIGRATIONS = [
+    (1, "create tables", _create_tables),
+    (2, "order history indexes",
+     _create_indexes(Transaction.__table__, "ix_transaction_buyer_date",
+                     "ix_transaction_seller_date")),
+    (3, "product and transaction access path indexes",
+     _create_indexes(Product.__table__, "ix_product_title",
+                     "ix_product_owner_email", "ix_product_quantity")),
+    (4, "transaction product index",
+     _create_indexes(Transaction.__table__, "ix_transaction_product_id")),
+    (5, "unique product titles", _unique_product_titles),
+    (6, "product search index", create_search_index),
+]
+
+
+def current_version():
+    """
+    Returns the version of the last migration applied, 0 if none
+    """
+    return db.session.query(db.func.coalesce(
+        db.func.max(SchemaVersion.version), 0)).scalar()
+
+
+def migrate():
+    """
+    Applies every migration the database has not had yet
+      Returns:
+        The versions applied
+    """
+    SchemaVersion.__table__.create(db.engine, checkfirst=True)
+    applied = []
+    current = current_version()
+    for version, description, apply in MIGRATIONS:
+        if (version <= current):
+            continue
+        apply()
+        db.session.add(SchemaVersion(version=version,
+                                     description=description,
+                                     applied=datetime.datetime.now()))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another process applied it first; migrations are idempotent
+            db.session.rollback()
+            continue
+        applied.append(version)
+    return applied
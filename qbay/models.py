@@ -13,17 +13,17 @@ class User(db.Model):
     password = db.Column(db.String(80), nullable=False)
     shipping_address = db.Column(db.String(120), unique=False, nullable=False)
     postal_code = db.Column(db.String(6), unique=False, nullable=False)
+    # balance as of the user's last ledger snapshot; the current balance
+    # also counts the LedgerEntry rows posted since (see qbay/ledger.py)
     balance = db.Column(db.Integer, nullable=False)
-    order_history = []  # this will be populated by a DB search of transactions
 
     def __repr__(self):
         return '<User %r>' % self.user_name
 
 
 class Buyer(User):
-    """Represent the Buyer
+    """Represent the Buyer. The buyer's cart is stored as CartItem rows.
     """
-    cart = []  # this will be populated later by a function
 
 
 class Seller(User):
@@ -37,6 +37,13 @@ class Product(db.Model):
     Keyword arguments:
     db.Model -- the database storing all relevant Product information
     """
+    # R4-8 title checks, the home page (owner) and the shop (in stock).
+    # Titles are unique (R4-8), which also backs up the in-process title
+    # filter of qbay/titles.py.
+    __table_args__ = (db.Index('uq_product_title', 'title', unique=True),
+                      db.Index('ix_product_owner_email', 'owner_email'),
+                      db.Index('ix_product_quantity', 'quantity'))
+
     id = db.Column(db.Integer, primary_key=True, unique=True, nullable=False)
     title = db.Column(db.String(80), nullable=False)
     description = db.Column(db.String(500), nullable=False)
@@ -56,6 +63,12 @@ class Transaction(db.Model):
     Keyword arguments:
     db.Model -- the database storing all relevant transaction information
     """
+    # order history pages are read newest first per buyer and per seller
+    __table_args__ = (db.Index('ix_transaction_buyer_date', 'buyer', 'date'),
+                      db.Index('ix_transaction_seller_date', 'seller',
+                               'date'),
+                      db.Index('ix_transaction_product_id', 'product_id'))
+
     id = db.Column(db.Integer, unique=True, primary_key=True, nullable=False)
     buyer = db.Column(db.Integer, nullable=False)
     seller = db.Column(db.Integer, nullable=False)
@@ -70,6 +83,76 @@ class Transaction(db.Model):
         return '<ID %r>' % self.id
 
 
+class LedgerEntry(db.Model):
+    """Represent one movement of a user's balance. Entries are only ever
+    inserted, so crediting a busy seller never waits on a row lock.
+
+    Keyword arguments:
+    db.Model -- the database storing all relevant balance information
+    """
+    __table_args__ = (db.Index('ix_ledger_entry_user_id', 'user_id', 'id'),)
+
+    id = db.Column(db.Integer, unique=True, primary_key=True, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<ID %r>' % self.id
+
+
+class BalanceSnapshot(db.Model):
+    """Represent the last ledger entry folded into a user's balance.
+
+    Keyword arguments:
+    db.Model -- the database storing all relevant balance information
+    """
+    user_id = db.Column(db.Integer, primary_key=True, nullable=False)
+    last_entry_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<User %r>' % self.user_id
+
+
+class SalesRollup(db.Model):
+    """Represent the units sold and revenue of a product on one day.
+    Maintained as orders are placed so seller reports never scan the
+    Transaction table.
+
+    Keyword arguments:
+    db.Model -- the database storing all relevant sales information
+    """
+    __table_args__ = (db.UniqueConstraint('seller', 'day', 'product_id'),)
+
+    id = db.Column(db.Integer, unique=True, primary_key=True, nullable=False)
+    seller = db.Column(db.Integer, nullable=False)  # user id
+    day = db.Column(db.Date, nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    units = db.Column(db.Integer, nullable=False)
+    revenue = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<ID %r>' % self.id
+
+
+class CartItem(db.Model):
+    """Represent a line in a buyer's cart.
+
+    Keyword arguments:
+    db.Model -- the database storing all relevant cart information
+    """
+    __table_args__ = (db.UniqueConstraint('buyer', 'product_id'),)
+
+    id = db.Column(db.Integer, unique=True, primary_key=True, nullable=False)
+    buyer = db.Column(db.Integer, nullable=False)   # user id
+    product_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<ID %r>' % self.id
+
+
 class Review(db.Model):
     """Represent a review from a buyer for a specific item.
 
@@ -85,5 +168,16 @@ class Review(db.Model):
         return '<ID %r>' % self.id
 
 
-# create all tables
-db.create_all()
+class SchemaVersion(db.Model):
+    """Represent a schema migration applied to the database
+    (see qbay/migrations.py).
+
+    Keyword arguments:
+    db.Model -- the database storing all relevant schema information
+    """
+    version = db.Column(db.Integer, primary_key=True, nullable=False)
+    description = db.Column(db.String(120), nullable=False)
+    applied = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<Version %r>' % self.version
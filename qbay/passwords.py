@@ -0,0 +1,103 @@
+"""
+File contains password hashing. Passwords are stored as salted
+PBKDF2-SHA256 hashes in the format
+
+    pbkdf2$<iterations>$<salt>$<hash>
+
+with the salt and hash base64 encoded without padding, which keeps the
+result under the 80 characters of User.password.
+
+Hashing is deliberately slow, so it runs in a bounded pool of worker
+threads (hashlib releases the GIL while hashing): a burst of logins or
+registrations queues for the pool instead of occupying every request
+thread with CPU work.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from qbay import app
+
+PREFIX = "pbkdf2"
+SALT_BYTES = 12
+
+_pool = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                           thread_name_prefix="password-hash")
+
+
+def hash_password(password, iterations=None):
+    """
+    Hashes a password with a new random salt
+      Parameters:
+        password (string):  the password
+        iterations (int):   PBKDF2 iterations, PASSWORD_HASH_ITERATIONS by
+                            default
+      Returns:
+        The encoded hash to store
+    """
+    return _pool.submit(_hash, password, iterations).result()
+
+
+def hash_passwords(passwords, iterations=None):
+    """
+    Hashes many passwords, spread across the hashing pool
+      Parameters:
+        passwords (list):   the passwords
+        iterations (int):   PBKDF2 iterations, PASSWORD_HASH_ITERATIONS by
+                            default
+      Returns:
+        The encoded hashes, in the order of passwords
+    """
+    return list(_pool.map(_hash, passwords,
+                          [iterations] * len(passwords)))
+
+
+def verify_password(password, stored):
+    """
+    Checks a password against a stored value
+      Parameters:
+        password (string):  the password supplied
+        stored (string):    the stored hash, or a plain text password
+                            stored before hashing was introduced
+      Returns:
+        A (matches, needs_rehash) pair. needs_rehash is True when the
+        password matches but the stored value is plain text or was hashed
+        with a different number of iterations.
+    """
+    parts = stored.split("$")
+    if (len(parts) != 4 or parts[0] != PREFIX):
+        matches = hmac.compare_digest(password.encode(), stored.encode())
+        return matches, matches
+
+    iterations = int(parts[1])
+    expected = _pool.submit(_derive, password, _decode(parts[2]),
+                            iterations).result()
+    matches = hmac.compare_digest(expected, _decode(parts[3]))
+    return matches, (matches and iterations !=
+                     app.config['PASSWORD_HASH_ITERATIONS'])
+
+
+def _hash(password, iterations):
+    """
+    Hashes a password on the calling thread
+    """
+    if (iterations is None):
+        iterations = app.config['PASSWORD_HASH_ITERATIONS']
+    salt = os.urandom(SALT_BYTES)
+    return "$".join([PREFIX, str(iterations), _encode(salt),
+                     _encode(_derive(password, salt, iterations))])
+
+
+def _derive(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt,
+                               iterations)
+
+
+def _encode(raw):
+    return base64.b64encode(raw).decode().rstrip("=")
+
+
+def _decode(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
@@ -3,11 +3,105 @@ File contains functionality relating to product creation and
 modification.
 """
 
+import csv
 import datetime
+import decimal
+import itertools
+import json
 import re
+from collections import namedtuple
+from sqlalchemy.exc import IntegrityError
 from qbay.models import Product
 from qbay.users import find_user
 from qbay import db
+from qbay import lookups
+from qbay.flash_sale import get_flash_sale
+from qbay.search import index_products
+from qbay.suggestions import product_suggestions
+from qbay.titles import product_titles
+from qbay.trigrams import product_trigrams
+from qbay.validation import DATABASE, PATTERN, Rule, Validator
+
+# R4-1: The title of the product has to be alphanumeric-only, and
+# space allowed only if it is not as prefix and suffix.
+# ^[a-zA-Z0-9]$| = any single alphanumeric OR
+# ^[a-zA-Z0-9] = begins with an alphanumeric
+# [a-zA-Z0-9\s]* = some number (or 0) alphanumerics or spaces
+# [a-zA-Z0-9]$ = ends with an alphanumeric
+TITLE_PATTERN = re.compile("^[a-zA-Z0-9]$|"
+                           "^[a-zA-Z0-9][a-zA-Z0-9 ]*[a-zA-Z0-9]$")
+R4_1 = Rule("R4-1", lambda values: TITLE_PATTERN.match(values["title"]),
+            PATTERN)
+
+# R4-2: The title of the product is no longer than 80 characters.
+R4_2 = Rule("R4-2", lambda values: len(values["title"]) <= 80)
+
+# R4-3: The description of the product can be arbitrary
+# characters, with a minimum length of 20 characters and a
+# maximum of 2000 characters.
+R4_3 = Rule("R4-3", lambda values: 20 <= len(values["description"]) <= 2000)
+
+# R4-4: Description has to be longer than the product's title.
+R4_4 = Rule("R4-4", lambda values: (len(values["description"]) >
+                                    len(values["title"])))
+
+# R4-5: Price has to be of range [10, 10000].
+R4_5 = Rule("R4-5", lambda values: 1000 <= values["price"] <= 1000000)
+
+# R4-6: last_modified_date must be after 2021-01-02 and before
+# 2025-01-02.
+EARLY_BOUND = datetime.datetime(2021, 1, 2)
+LATE_BOUND = datetime.datetime(2025, 1, 2)
+R4_6 = Rule("R4-6", lambda values: (EARLY_BOUND <= values["date"] <=
+                                    LATE_BOUND))
+
+# R4-7: owner_email cannot be empty. The owner of the
+# corresponding product must exist in the database.
+R4_7_EMPTY = Rule("R4-7 empty", lambda values: values["owner_email"])
+R4_7 = Rule("R4-7", lambda values: find_user(values["owner_email"]),
+            DATABASE)
+
+# R4-8: A user cannot create products that have the same title.
+# The title filter answers for unused titles without a query.
+R4_8 = Rule("R4-8", lambda values: not product_titles.is_used(
+    values["title"], lambda: db.session.query(Product.id).filter_by(
+        title=values["title"]).first() is not None), DATABASE)
+
+TITLE_RULES = Validator(R4_1, R4_2, R4_4, R4_8)
+DESCRIPTION_RULES = Validator(R4_3, R4_4)
+PRODUCT_RULES = Validator(TITLE_RULES, DESCRIPTION_RULES, R4_5, R4_6,
+                          R4_7_EMPTY, R4_7)
+# the rules checked per row by import_products, which checks the owner
+# once and titles per chunk
+PRODUCT_FORMAT_RULES = Validator(R4_1, R4_2, R4_3, R4_4, R4_5, R4_6)
+
+# R5-2: Price can be only increased but cannot be decreased.
+R5_2 = Rule("R5-2", lambda values: values["price"] > values["old_price"])
+
+# Quantities cannot be negative.
+QUANTITY_RULE = Rule("quantity", lambda values: values["quantity"] >= 0)
+
+# the rules checked by update_product for each field it can change
+# (R4-8 is only checked when the title actually changes)
+PRODUCT_CHANGES = {
+    "title": Validator(R4_1, R4_2, R4_4),
+    "description": DESCRIPTION_RULES,
+    "price": Validator(R4_5, R5_2),
+    "quantity": QUANTITY_RULE,
+}
+
+# reasons reported by import_products
+IMPORTED = "imported"
+UNREADABLE_ROW = "unreadable row"
+INVALID_PRODUCT = "invalid product"
+TITLE_IN_USE = "title in use"
+UNKNOWN_OWNER = "unknown owner"
+
+IMPORT_CHUNK_SIZE = 500
+IMPORT_FIELDS = ["title", "description", "price", "quantity"]
+
+ImportResult = namedtuple("ImportResult", ["row", "title", "success",
+                                           "reason"])
 
 
 def create_product(title, description, price, owner_email, quantity=1):
@@ -22,42 +116,63 @@ def create_product(title, description, price, owner_email, quantity=1):
         True if the product was successfully created, otherwise False
     """
 
-    # Validate title and description (R4-1, R4-2, R4-3, R4-4, R4-8 check)
-    if (not(valid_title(title, description) and
-            valid_description(title, description))):
-        return False
-
-    # Validate price (R4-5)
-    if (not(valid_price(price))):
-        return False
-
-    # R4-6: last_modified_date must be after 2021-01-02 and before
-    # 2025-01-02.
+    # R4-1 to R4-8, the database is only queried once every other
+    # requirement is met
     last_modified_date = datetime.datetime.now()
-    if (not(valid_date(last_modified_date))):
+    if (not PRODUCT_RULES(title=title, description=description, price=price,
+                          date=last_modified_date, owner_email=owner_email)):
         return False
 
-    # R4-7: owner_email cannot be empty. The owner of the
-    # corresponding product must exist in the database.
-    if (owner_email is None or owner_email == "" or
-            not(find_user(owner_email))):
+    # Add product to the database
+    product = Product(title=title, description=description, price=price,
+                      last_modified_date=last_modified_date,
+                      owner_email=owner_email, quantity=quantity, reviews=[])
+    db.session.add(product)
+
+    if (not _commit_product(product, None, True)):
         return False
+    lookups.forget("product", (title, owner_email))
 
-    # Add product to the database
-    db.session.add(Product(title=title, description=description,
-                           price=price,
-                           last_modified_date=last_modified_date,
-                           owner_email=owner_email,
-                           quantity=quantity, reviews=[]))
+    return True
 
-    db.session.commit()
 
+def _commit_product(product, old_title, new_text):
+    """
+    Commits a product created or changed, writing its text to the search
+    index in the same transaction, and records a new title in the title
+    filter and title suggestions
+      Parameters:
+        product (Product):  the product
+        old_title (string): the title before the change, None for a new
+                            product
+        new_text (bool):    the title or description changed, so is
+                            written to the search index
+      Returns:
+        True if committed, False if another process took the title first
+    """
+    title = product.title
+    try:
+        if (new_text):
+            db.session.flush()
+            product_id = product.id
+            index_products(Product.id == product_id)
+        db.session.commit()
+    except IntegrityError:
+        # R4-8: the unique index caught a title the filter had not seen
+        db.session.rollback()
+        return False
+    if (title != old_title):
+        # a new title is new text, so product_id was read before the
+        # commit expired the product
+        product_titles.add(title)
+        product_suggestions.add(title, old_title)
+        product_trigrams.add(product_id, title, old_title)
     return True
 
 
 def get_product(title, owner_email):
     """
-    Returns an existing product
+    Returns an existing product, loaded at most once per request
       Parameters:
         title (string):         product title
         owner_email (string) : product owner email
@@ -65,8 +180,10 @@ def get_product(title, owner_email):
         A Product object if the product exists in the database,
         otherwise None
     """
-    return db.session.query(Product).filter_by(title=title,
-                                               owner_email=owner_email).first()
+    return lookups.remember(
+        "product", (title, owner_email), "product",
+        lambda: db.session.query(Product).filter_by(
+            title=title, owner_email=owner_email).first())
 
 
 def get_productid(title, owner_email):
@@ -77,76 +194,94 @@ def get_productid(title, owner_email):
       Returns:
         The id of the product
     """
-    return db.session.query(Product).filter_by(
-        title=title,
-        owner_email=owner_email).first().id
+    return get_product(title, owner_email).id
 
 
-def update_product_description(title, owner_email, description):
+def update_product(product_id, **changes):
     """
-    Updates a given product's description
+    Updates any of a product's title, description, price and quantity.
+    The product is loaded once, every change is validated against the
+    others, and all are written with one UPDATE and one commit.
       Parameters:
-        title (string):       product title
-        owner_email (string): product owner email
-        description (string): new product description
+        product_id (int):   product id
+        changes:            new values, keyed by field name
+      Returns:
+        True if the product was updated, False if a change is invalid,
+        the product does not exist, or it changes the title or price of
+        a product in flash-sale mode
     """
-    # Get access to the product
-    product = get_product(title, owner_email)
+    # R5-1: One can update all attributes of the product, except
+    # owner_email and last_modified_date.
+    if (not changes or not set(changes) <= set(PRODUCT_CHANGES)):
+        return False
+    product = db.session.get(Product, product_id)
     if (product is None):
         return False
+    # a running flash sale is found by title and charges the price it
+    # started with
+    if (get_flash_sale(product.title, product.owner_email) is not None and
+            any(field in changes and changes[field] != getattr(product, field)
+                for field in ("title", "price"))):
+        return False
 
-    # Validate description (R4-3, R4-4 check)
-    if (not(valid_description(title, description))):
+    # R5-4: When updating an attribute, one has to make sure that it
+    # follows the same requirements as above. Title and description are
+    # checked against each other's new values.
+    values = {"title": product.title, "description": product.description,
+              "old_price": product.price, "date": datetime.datetime.now()}
+    values.update(changes)
+    rules = [PRODUCT_CHANGES[field] for field in PRODUCT_CHANGES
+             if field in changes]
+    if ("title" in changes and changes["title"] != product.title):
+        rules.append(R4_8)
+    # R5-3: last_modified_date should be updated when the update operation
+    # is successful.
+    rules.append(R4_6)
+    if (not Validator(*rules)(**values)):
         return False
 
-    product.description = description
+    old_title = product.title
+    for field, value in changes.items():
+        setattr(product, field, value)
+    product.last_modified_date = values["date"]
 
-    # R4-6: last_modified_date must be after 2021-01-02 and before
-    # 2025-01-02
-    #
-    # R5-3: last_modified_date should be updated when the update operation is
-    # successful.
-    last_modified_date = datetime.datetime.now()
-    if (not(valid_date(last_modified_date))):
+    if (not _commit_product(product, old_title,
+                            "title" in changes or
+                            "description" in changes)):
         return False
-    product.last_modified_date = last_modified_date
-
-    db.session.commit()
+    lookups.forget("product", (old_title, product.owner_email))
+    lookups.forget("product", (product.title, product.owner_email))
     return True
 
 
-def update_product_price(title, owner_email, price):
+def update_product_description(title, owner_email, description):
     """
-    Updates a given product's price
+    Updates a given product's description
       Parameters:
         title (string):       product title
         owner_email (string): product owner email
-        price (int):          new product price
+        description (string): new product description
     """
-    # Get access to the product
     product = get_product(title, owner_email)
     if (product is None):
         return False
+    # R4-3, R4-4
+    return update_product(product.id, description=description)
 
-    # R4-5: Price has to be of range [10, 10000].
-    # R5-2: Price can be only increased but cannot be decreased.
-    if (not(valid_price(price)) or price <= product.price):
-        return False
 
-    product.price = price
-
-    # R4-6: last_modified_date must be after 2021-01-02 and before
-    # 2025-01-02
-    #
-    # R5-3: last_modified_date should be updated when the update operation is
-    # successful.
-    last_modified_date = datetime.datetime.now()
-    if (not(valid_date(last_modified_date))):
+def update_product_price(title, owner_email, price):
+    """
+    Updates a given product's price
+      Parameters:
+        title (string):       product title
+        owner_email (string): product owner email
+        price (int):          new product price
+    """
+    product = get_product(title, owner_email)
+    if (product is None):
         return False
-    product.last_modified_date = last_modified_date
-
-    db.session.commit()
-    return True
+    # R4-5, R5-2
+    return update_product(product.id, price=price)
 
 
 def update_product_title(title, owner_email, new_title):
@@ -157,28 +292,11 @@ def update_product_title(title, owner_email, new_title):
         owner_email (string): product owner email
         new_title (string):   new product title
     """
-    # Get access to the product
     product = get_product(title, owner_email)
     if (product is None):
         return False
-
-    # Validate title (R4-1, R4-2, R4-4, R4-8 check)
-    if (not(valid_title(new_title, product.description))):
-        return False
-
-    product.title = new_title
-
-    # R4-6: last_modified_date must be after 2021-01-02 and before
-    # 2025-01-02
-    # R5-3: last_modified_date should be updated when the update operation is
-    # successful.
-    last_modified_date = datetime.datetime.now()
-    if (not(valid_date(last_modified_date))):
-        return False
-    product.last_modified_date = last_modified_date
-
-    db.session.commit()
-    return True
+    # R4-1, R4-2, R4-4, R4-8
+    return update_product(product.id, title=new_title)
 
 
 def update_product_quantity(title, owner_email, quantity):
@@ -189,29 +307,10 @@ def update_product_quantity(title, owner_email, quantity):
         owner_email (string): product owner email
         quantity (int):       new product quantity
     """
-    # Get access to the product
     product = get_product(title, owner_email)
     if (product is None):
         return False
-
-    # Check for valid quantities.
-    if (quantity < 0):
-        return False
-
-    product.quantity = quantity
-
-    # R4-6: last_modified_date must be after 2021-01-02 and before
-    # 2025-01-02
-    #
-    # R5-3: last_modified_date should be updated when the update operation is
-    # successful.
-    last_modified_date = datetime.datetime.now()
-    if (not(valid_date(last_modified_date))):
-        return False
-    product.last_modified_date = last_modified_date
-
-    db.session.commit()
-    return True
+    return update_product(product.id, quantity=quantity)
 
 
 def valid_title(title, description):
@@ -224,30 +323,8 @@ def valid_title(title, description):
       Returns:
         True if the product title is valid, otherwise False
     """
-    # R4-1: The title of the product has to be alphanumeric-only, and
-    # space allowed only if it is not as prefix and suffix.
-    # ^[a-zA-Z0-9]$| = any single alphanumeric OR
-    # ^[a-zA-Z0-9] = begins with an alphanumeric
-    # [a-zA-Z0-9\s]* = some number (or 0) alphanumerics or spaces
-    # [a-zA-Z0-9]$ = ends with an alphanumeric
-    if (not(bool(re.match("^[a-zA-Z0-9]$|"
-                          "^[a-zA-Z0-9][a-zA-Z0-9 ]*[a-zA-Z0-9]$",
-                          title)))):
-        return False
-
-    # R4-2: The title of the product is no longer than 80 characters.
-    if (len(title) > 80):
-        return False
-
-    # R4-4: Description has to be longer than the product's title.
-    if (len(description) <= len(title)):
-        return False
-
-    # R4-8: A user cannot create products that have the same title.
-    if (not(db.session.query(Product).filter_by(title=title).first() is None)):
-        return False
-
-    return True
+    # R4-1, R4-2, R4-4, R4-8
+    return TITLE_RULES(title=title, description=description)
 
 
 def valid_description(title, description):
@@ -260,17 +337,8 @@ def valid_description(title, description):
       Returns:
         True if the product description is valid, otherwise False
     """
-    # R4-3: The description of the product can be arbitrary
-    # characters, with a minimum length of 20 characters and a
-    # maximum of 2000 characters.
-    if (len(description) < 20 or len(description) > 2000):
-        return False
-
-    # R4-4: Description has to be longer than the product's title.
-    if (len(description) <= len(title)):
-        return False
-
-    return True
+    # R4-3, R4-4
+    return DESCRIPTION_RULES(title=title, description=description)
 
 
 def valid_price(price):
@@ -283,10 +351,7 @@ def valid_price(price):
         True if the product price is valid, otherwise False
     """
     # R4-5: Price has to be of range [10, 10000].
-    if (price < 1000 or price > 1000000):
-        return False
-
-    return True
+    return R4_5.check({"price": price})
 
 
 def valid_date(date):
@@ -298,12 +363,169 @@ def valid_date(date):
       Returns:
         True if the date and time are valid, otherwise False
     """
-    early_bound = datetime.datetime(2021, 1, 2)
-    late_bound = datetime.datetime(2025, 1, 2)
-
     # R4-6: last_modified_date must be after 2021-01-02 and before
     # 2025-01-02.
-    if (early_bound > date or late_bound < date):
-        return False
+    return R4_6.check({"date": date})
 
-    return True
+
+def import_products(stream, owner_email, file_format=None,
+                    chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Creates products from a CSV or JSON Lines file. Rows are read lazily
+    and handled a chunk at a time, so memory use does not grow with the
+    size of the file.
+    CSV files need a header row naming the columns title, description,
+    price and quantity (quantity is optional and defaults to 1); JSON
+    Lines files hold one object per line with the same keys. Prices are
+    in dollars, as on the product creation page.
+      Parameters:
+        stream (iterable):      lines of text, e.g. an open file
+        owner_email (string):   owner of every imported product
+        file_format (string):   "csv" or "jsonl", guessed from the first
+                                line if None
+        chunk_size (int):       rows validated and inserted per commit
+      Returns:
+        A generator of ImportResult, one per row in file order
+    """
+    rows = _read_rows(stream, file_format)
+
+    # R4-7: owner_email cannot be empty. The owner of the
+    # corresponding product must exist in the database.
+    if (not (owner_email and find_user(owner_email))):
+        for number, row in rows:
+            yield ImportResult(number, (row or {}).get("title"), False,
+                               UNKNOWN_OWNER)
+        return
+
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if (not chunk):
+            return
+        for result in _import_chunk(chunk, owner_email):
+            yield result
+
+
+def _read_rows(stream, file_format):
+    """
+    Yields (row number, dict) pairs from a CSV or JSON Lines stream, with
+    None in place of rows that cannot be parsed
+    """
+    lines = iter(stream)
+    first = next(lines, None)
+    if (first is None):
+        return
+    lines = itertools.chain([first], lines)
+    if (file_format is None):
+        file_format = "jsonl" if first.lstrip().startswith("{") else "csv"
+
+    if (file_format == "jsonl"):
+        number = 0
+        for line in lines:
+            if (not line.strip()):
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else None
+    else:
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            # DictReader puts extra cells under None
+            yield number, None if None in row else row
+
+
+def _parse_row(row, owner_email, date):
+    """
+    Returns the column values of a product row, or None if the row does
+    not meet R4-1 to R4-6
+    """
+    if (any(row.get(field) is None
+            for field in ["title", "description", "price"])):
+        return None
+    try:
+        title = str(row["title"])
+        description = str(row["description"])
+        cents = decimal.Decimal(str(row["price"])) * 100
+        quantity = row.get("quantity")
+        quantity = 1 if quantity in (None, "") else int(str(quantity))
+    except (ValueError, decimal.InvalidOperation):
+        return None
+    # "inf" and "nan" parse as Decimals but are not prices
+    if (not cents.is_finite() or cents != cents.to_integral_value() or
+            quantity < 0):
+        return None
+    price = int(cents)
+    if (not PRODUCT_FORMAT_RULES(title=title, description=description,
+                                 price=price, date=date)):
+        return None
+    return {"title": title, "description": description, "price": price,
+            "last_modified_date": date, "owner_email": owner_email,
+            "quantity": quantity}
+
+
+def _import_chunk(chunk, owner_email):
+    """
+    Validates a chunk of rows, inserts the valid ones with one statement
+    and commits, returning an ImportResult per row
+    """
+    # R4-6: last_modified_date must be after 2021-01-02 and before
+    # 2025-01-02.
+    date = datetime.datetime.now()
+    parsed = [(number, row, None if row is None else
+               _parse_row(row, owner_email, date)) for number, row in chunk]
+
+    for _ in range(2):
+        # R4-8: titles in use, with one query for the possible matches
+        titles = {product["title"] for _, _, product in parsed if product}
+        maybe_used = [title for title in titles
+                      if product_titles.might_be_used(title)]
+        used = set()
+        if (maybe_used):
+            used = {title for title, in db.session.query(
+                Product.title).filter(Product.title.in_(maybe_used))}
+
+        results = []
+        products = []
+        for number, row, product in parsed:
+            if (row is None):
+                results.append(ImportResult(number, None, False,
+                                            UNREADABLE_ROW))
+            elif (product is None):
+                results.append(ImportResult(number, row.get("title"), False,
+                                            INVALID_PRODUCT))
+            elif (product["title"] in used):
+                results.append(ImportResult(number, product["title"], False,
+                                            TITLE_IN_USE))
+            else:
+                # later rows of the file with this title are duplicates
+                used.add(product["title"])
+                products.append(product)
+                results.append(ImportResult(number, product["title"], True,
+                                            IMPORTED))
+
+        if (products):
+            db.session.execute(Product.__table__.insert(), products)
+            index_products(Product.title.in_(
+                [product["title"] for product in products]))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another process took a title; the retry queries every title
+            db.session.rollback()
+            for title in titles:
+                product_titles.add(title)
+            continue
+        for product in products:
+            product_titles.add(product["title"])
+            product_suggestions.add(product["title"])
+        if (products):
+            for product_id, title in db.session.query(
+                    Product.id, Product.title).filter(Product.title.in_(
+                        [product["title"] for product in products])):
+                product_trigrams.add(product_id, title)
+        lookups.forget("product")
+        return results
+
+    return [result._replace(success=False, reason=TITLE_IN_USE)
+            if result.success else result for result in results]
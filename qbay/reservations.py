@@ -0,0 +1,128 @@
+"""
+File contains short-lived stock holds. Opening the checkout page holds
+stock for the buyer; orders by other buyers cannot take held units until
+the hold is consumed by the buyer's order or expires.
+
+Holds expire through a heap ordered by expiry time, so sweeping costs
+O(expired * log(holds)) rather than a scan of every hold.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from qbay import app
+
+
+class _Hold:
+    __slots__ = ("quantity", "expires", "seq")
+
+    def __init__(self, quantity, expires, seq):
+        self.quantity = quantity
+        self.expires = expires
+        self.seq = seq
+
+
+class ReservationBook:
+    """
+    In-process stock holds, one per (product, buyer)
+    """
+
+    def __init__(self, ttl=300, clock=time.monotonic):
+        """
+          Parameters:
+            ttl (float):        seconds a hold lasts
+            clock (function):   returns the current time in seconds
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self._holds = {}    # (product_id, buyer_id) -> _Hold
+        self._held = {}     # product_id -> units held by every buyer
+        self._heap = []     # (expires, seq, (product_id, buyer_id))
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._holds)
+
+    def reserve(self, product_id, buyer_id, quantity, stock):
+        """
+        Holds units of a product for a buyer, replacing the buyer's
+        previous hold on that product
+          Parameters:
+            product_id (int):   id of the product
+            buyer_id (int):     id of the buyer
+            quantity (int):     units to hold
+            stock (int):        current quantity of the product
+          Returns:
+            The number of units held, which is less than quantity if
+            other buyers hold the rest of the stock
+        """
+        with self._lock:
+            now = self.clock()
+            self._sweep(now)
+            key = (product_id, buyer_id)
+            self._drop(key)
+            others = self._held.get(product_id, 0)
+            quantity = max(min(quantity, stock - others), 0)
+            if quantity == 0:
+                return 0
+
+            seq = next(self._seq)
+            self._holds[key] = _Hold(quantity, now + self.ttl, seq)
+            self._held[product_id] = others + quantity
+            heapq.heappush(self._heap, (now + self.ttl, seq, key))
+            return quantity
+
+    def release(self, product_id, buyer_id):
+        """
+        Drops a buyer's hold on a product, e.g. when their order consumed it
+          Returns:
+            The number of units that were held
+        """
+        with self._lock:
+            hold = self._drop((product_id, buyer_id))
+            return hold.quantity if hold else 0
+
+    def held_by_others(self, product_id, buyer_id):
+        """
+        Returns the units of a product held by buyers other than buyer_id
+        """
+        with self._lock:
+            self._sweep(self.clock())
+            own = self._holds.get((product_id, buyer_id))
+            return (self._held.get(product_id, 0) -
+                    (own.quantity if own else 0))
+
+    def sweep(self):
+        """
+        Releases every expired hold
+          Returns:
+            The number of holds released
+        """
+        with self._lock:
+            return self._sweep(self.clock())
+
+    def _sweep(self, now):
+        released = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self._heap)
+            hold = self._holds.get(key)
+            # entries of replaced or released holds are skipped lazily
+            if hold is not None and hold.seq == seq:
+                self._drop(key)
+                released += 1
+        return released
+
+    def _drop(self, key):
+        hold = self._holds.pop(key, None)
+        if hold is not None:
+            remaining = self._held[key[0]] - hold.quantity
+            if remaining:
+                self._held[key[0]] = remaining
+            else:
+                del self._held[key[0]]
+        return hold
+
+
+stock_holds = ReservationBook(app.config['RESERVATION_TTL'])
@@ -0,0 +1,80 @@
+"""
+File contains functionality relating to seller sales reports.
+Reports are read from the SalesRollup table, which holds one row per
+seller, product and day.
+"""
+
+import datetime
+from qbay.models import Product, SalesRollup, Transaction, User
+from qbay import db
+
+
+def record_sales(lines, date):
+    """
+    Adds the lines of a placed order to the rollups of their day.
+    Called inside the order's database transaction; does not commit.
+      Parameters:
+        lines (list):       OrderLine for each product sold
+        date (datetime):    time of the order
+    """
+    day = date.date()
+    for line in lines:
+        # The order already holds the product row lock, so two orders
+        # of the same product cannot both insert the day's first row.
+        updated = db.session.query(SalesRollup).filter_by(
+            seller=line.seller_id, day=day, product_id=line.product_id
+        ).update({SalesRollup.units: SalesRollup.units + line.quantity,
+                  SalesRollup.revenue: (SalesRollup.revenue +
+                                        line.total_price)},
+                 synchronize_session=False)
+        if (updated == 0):
+            db.session.add(SalesRollup(seller=line.seller_id, day=day,
+                                       product_id=line.product_id,
+                                       units=line.quantity,
+                                       revenue=line.total_price))
+
+
+def rebuild_sales_rollups():
+    """
+    Recomputes every rollup from the Transaction table
+      Returns:
+        The number of rollup rows written
+    """
+    day = db.func.date(Transaction.date)
+    totals = db.session.query(
+        Transaction.seller, day, Transaction.product_id,
+        db.func.sum(Transaction.quantity),
+        db.func.sum(Transaction.total_price)
+    ).filter(Transaction.purchased.is_(True)).group_by(
+        Transaction.seller, day, Transaction.product_id)
+
+    db.session.query(SalesRollup).delete(synchronize_session=False)
+    db.session.execute(SalesRollup.__table__.insert().from_select(
+        ["seller", "day", "product_id", "units", "revenue"],
+        totals.statement))
+    db.session.commit()
+    return db.session.query(SalesRollup).count()
+
+
+def get_seller_sales(email, days=30):
+    """
+    Returns a seller's units sold and revenue per product per day
+      Parameters:
+        email (string):     seller email
+        days (int):         number of days to report, ending today
+      Returns:
+        A list of (day, product title, units, revenue) tuples,
+        newest day first
+    """
+    seller_id = db.session.query(User.id).filter_by(email=email).scalar()
+    if (seller_id is None):
+        return []
+
+    first_day = datetime.date.today() - datetime.timedelta(days=days - 1)
+    return db.session.query(
+        SalesRollup.day, Product.title, SalesRollup.units,
+        SalesRollup.revenue
+    ).outerjoin(Product, Product.id == SalesRollup.product_id).filter(
+        SalesRollup.seller == seller_id,
+        SalesRollup.day >= first_day
+    ).order_by(SalesRollup.day.desc(), Product.title).all()
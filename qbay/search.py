@@ -0,0 +1,180 @@
+"""
+File contains full-text search over product titles and descriptions.
+
+On SQLite the text is kept in the product_fts FTS5 table, keyed by
+product id. No triggers maintain it: create_product, update_product and
+import_products write it in the same transaction as the product rows
+(see index_products). On MySQL the search uses a FULLTEXT index on
+product(title, description), which the server maintains itself.
+
+Rebuild the SQLite index from the product table with
+    python -m qbay.cli rebuild-search-index
+"""
+
+import math
+import re
+from collections import namedtuple
+from sqlalchemy.dialects.mysql import match
+from qbay import app, db
+from qbay.models import Product
+from qbay.trigrams import product_trigrams
+
+FTS_TABLE = "product_fts"
+MYSQL_INDEX = "ft_product_text"
+
+# The FTS5 table, kept out of db.metadata so create_all never makes it
+# as an ordinary table
+product_fts = db.Table(FTS_TABLE, db.MetaData(),
+                       db.Column("rowid", db.Integer, primary_key=True),
+                       db.Column("title", db.String),
+                       db.Column("description", db.String))
+
+# bm25 weights of the title and description columns: a term in the
+# title ranks a product above the same term in its description
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# words of a search, matched as FTS5 strings so punctuation and
+# operators typed by the user are never parsed as query syntax
+TERM_PATTERN = re.compile(r"\w+")
+
+SearchPage = namedtuple("SearchPage", ["products", "page", "pages",
+                                       "total"])
+
+
+def _mysql():
+    return db.engine.dialect.name == "mysql"
+
+
+def create_search_index():
+    """
+    Creates the search index and fills it from the product table
+    """
+    if (_mysql()):
+        indexes = db.inspect(db.engine).get_indexes("product")
+        if (MYSQL_INDEX not in [index["name"] for index in indexes]):
+            db.session.execute(db.text(
+                "ALTER TABLE product ADD FULLTEXT INDEX {} "
+                "(title, description)".format(MYSQL_INDEX)))
+        return
+    db.session.execute(db.text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(title, "
+        "description, tokenize='unicode61 remove_diacritics 2')".format(
+            FTS_TABLE)))
+    rebuild_search_index()
+
+
+def rebuild_search_index():
+    """
+    Replaces the contents of the SQLite index with the product table
+      Returns:
+        The number of products indexed
+    """
+    if (_mysql()):
+        return 0
+    db.session.execute(product_fts.delete())
+    db.session.execute(product_fts.insert().from_select(
+        ["rowid", "title", "description"],
+        db.select(Product.id, Product.title, Product.description)))
+    db.session.commit()
+    return db.session.query(db.func.count(Product.id)).scalar()
+
+
+def index_products(condition):
+    """
+    Writes the current title and description of products to the index.
+    Called inside the transaction writing the products; does not commit.
+      Parameters:
+        condition:  SQL expression selecting the products, e.g.
+                    Product.id == product_id
+    """
+    if (_mysql()):
+        return
+    ids = db.select(Product.id).where(condition)
+    db.session.execute(product_fts.delete().where(
+        product_fts.c.rowid.in_(ids)))
+    db.session.execute(product_fts.insert().from_select(
+        ["rowid", "title", "description"],
+        db.select(Product.id, Product.title, Product.description).where(
+            condition)))
+
+
+def search_products(text, page=1, per_page=None, exclude_owner=None):
+    """
+    Returns one page of the products in stock matching a search, best
+    matches first. Every word of the search must appear in the title or
+    description. An empty search lists every product by title.
+      Parameters:
+        text (string):          the search
+        page (int):             page number, from 1
+        per_page (int):         products per page, SEARCH_PAGE_SIZE by
+                                default
+        exclude_owner (string): email of an owner whose products are left
+                                out (the shopper's own)
+      Returns:
+        A SearchPage(products, page, pages, total)
+    """
+    per_page = per_page or app.config['SEARCH_PAGE_SIZE']
+    terms = TERM_PATTERN.findall(text or "")
+
+    query = db.session.query(Product).filter(Product.quantity > 0)
+    if (exclude_owner):
+        query = query.filter(Product.owner_email != exclude_owner)
+    if (not terms):
+        query = query.order_by(Product.title)
+    elif (_mysql()):
+        # boolean mode, with every word required as on SQLite
+        relevance = match(Product.title, Product.description,
+                          against=" ".join("+" + term for term in terms)
+                          ).in_boolean_mode()
+        query = query.filter(relevance).order_by(relevance.desc(),
+                                                 Product.id)
+    else:
+        table = db.literal_column(FTS_TABLE)
+        phrases = " ".join('"{}"'.format(term) for term in terms)
+        query = query.join(
+            product_fts, product_fts.c.rowid == Product.id
+        ).filter(table.op("MATCH")(phrases)).order_by(
+            db.func.bm25(table, TITLE_WEIGHT, DESCRIPTION_WEIGHT),
+            Product.id)
+
+    total = query.order_by(None).count()
+    pages = max(math.ceil(total / per_page), 1)
+    page = min(max(page, 1), pages)
+    products = query.offset((page - 1) * per_page).limit(per_page).all()
+    return SearchPage(products, page, pages, total)
+
+
+def fuzzy_search_products(text, page=1, per_page=None, exclude_owner=None):
+    """
+    Returns one page of the products in stock whose titles are most
+    similar to a search, which may be misspelled (see qbay.trigrams).
+    At most FUZZY_SEARCH_RESULTS products are found.
+      Parameters:
+        text (string):          the search
+        page (int):             page number, from 1
+        per_page (int):         products per page, SEARCH_PAGE_SIZE by
+                                default
+        exclude_owner (string): email of an owner whose products are left
+                                out (the shopper's own)
+      Returns:
+        A SearchPage(products, page, pages, total)
+    """
+    per_page = per_page or app.config['SEARCH_PAGE_SIZE']
+    ranks = {product_id: rank for rank, (product_id, _) in enumerate(
+        product_trigrams.search(text or "",
+                                app.config['FUZZY_SEARCH_RESULTS']))}
+
+    products = []
+    if (ranks):
+        query = db.session.query(Product).filter(
+            Product.id.in_(list(ranks)), Product.quantity > 0)
+        if (exclude_owner):
+            query = query.filter(Product.owner_email != exclude_owner)
+        products = sorted(query, key=lambda product: ranks[product.id])
+
+    total = len(products)
+    pages = max(math.ceil(total / per_page), 1)
+    page = min(max(page, 1), pages)
+    return SearchPage(products[(page - 1) * per_page:page * per_page],
+                      page, pages, total)
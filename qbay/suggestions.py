@@ -0,0 +1,132 @@
+"""
+File contains search-as-you-type suggestions of product titles.
+
+Titles are kept in memory in one sorted list of (folded title, title)
+pairs, so the titles starting with a prefix are found with a binary
+search and read in order without touching the database. The list is
+built from the product table at startup (or on first use) and kept up
+to date by create_product, update_product and import_products. Products
+written by other processes appear after the next rebuild.
+"""
+
+import bisect
+import sys
+import threading
+from collections import namedtuple
+from qbay import app, db
+from qbay.models import Product
+
+SuggestionStats = namedtuple("SuggestionStats", ["titles", "bytes"])
+
+
+class TitleSuggestions:
+    """
+    Product titles in a sorted list, searched by prefix
+    """
+
+    def __init__(self, limit=10):
+        """
+          Parameters:
+            limit (int):    most titles a suggestion returns
+        """
+        self.limit = limit
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def suggest(self, prefix, limit=None):
+        """
+        Returns the titles starting with a prefix, ignoring case
+          Parameters:
+            prefix (string):    start of a title
+            limit (int):        most titles returned, capped at the
+                                default limit, which is also used if limit
+                                is None or below 1
+          Returns:
+            A list of titles in alphabetical order
+        """
+        key = prefix.lstrip().casefold()
+        if (not key):
+            return []
+        limit = (self.limit if not limit or limit < 1
+                 else min(limit, self.limit))
+        entries = self._loaded()
+        # add changes the list in place, so it is read under the lock
+        with self._lock:
+            # (key,) sorts before every (key, title) pair
+            start = bisect.bisect_left(entries, (key,))
+            matches = entries[start:start + limit]
+        titles = []
+        for folded, title in matches:
+            if (not folded.startswith(key)):
+                break
+            titles.append(title)
+        return titles
+
+    def add(self, title, old_title=None):
+        """
+        Records a title written to the database
+          Parameters:
+            title (string):     the new title
+            old_title (string): the title it replaces, if renamed
+        """
+        if (self._entries is None):
+            # the first build reads the change from the database
+            self._loaded()
+            return
+        entries = self._entries
+        with self._lock:
+            if (entries is not self._entries):
+                # rebuilt meanwhile; the rebuild read the change already
+                return
+            if (old_title is not None):
+                old = _entry(old_title)
+                position = bisect.bisect_left(entries, old)
+                if (position < len(entries) and entries[position] == old):
+                    del entries[position]
+            bisect.insort(entries, _entry(title))
+
+    def load(self, titles=None):
+        """
+        Builds the list, replacing any built before
+          Parameters:
+            titles (iterable):  the titles, read from the product table if
+                                None
+        """
+        if (titles is None):
+            titles = (title for title, in
+                      db.session.query(Product.title).yield_per(1000))
+        entries = sorted(_entry(title) for title in titles)
+        with self._lock:
+            self._entries = entries
+
+    def stats(self):
+        """
+        Returns the number of titles held and the memory they use
+        """
+        with self._lock:
+            entries = list(self._entries or [])
+        size = sys.getsizeof(entries)
+        for folded, title in entries:
+            size += sys.getsizeof((folded, title)) + sys.getsizeof(title)
+            if (folded is not title):
+                size += sys.getsizeof(folded)
+        return SuggestionStats(len(entries), size)
+
+    def _loaded(self):
+        """
+        Returns the list, building it from the product table if needed
+        """
+        entries = self._entries
+        if (entries is None):
+            self.load()
+            entries = self._entries
+        return entries
+
+
+def _entry(title):
+    # titles that are already folded share one string
+    folded = title.casefold()
+    return (title if folded == title else folded, title)
+
+
+product_suggestions = TitleSuggestions(app.config['SUGGESTION_LIMIT'])
@@ -0,0 +1,169 @@
+"""
+File contains the login throttle. Every login attempt takes a token from
+a bucket for the client's IP address and one for the email; attempts
+finding either bucket empty are rejected before any validation or
+database work, and take no tokens. Successful logins give their tokens
+back, so only failures count against the limits.
+
+Buckets are kept in bounded LRUs. A bucket given back to full is
+dropped, since it behaves the same as a new one; other buckets stay
+until they are evicted.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from qbay import app
+
+LoginThrottleStats = namedtuple("LoginThrottleStats",
+                                ["attempts", "rejected", "rejected_by_ip",
+                                 "rejected_by_email", "buckets",
+                                 "evictions"])
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class TokenBuckets:
+    """
+    Token buckets keyed by any hashable, at most max_keys of them
+    """
+
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        """
+          Parameters:
+            rate (float):       tokens added to a bucket per second
+            burst (int):        tokens a bucket holds when full
+            max_keys (int):     maximum number of buckets; the least
+                                recently used are dropped first
+            clock (function):   returns the current time in seconds
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self.evictions = 0
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key):
+        """
+        Takes a token from a bucket. Not thread safe; LoginThrottle
+        serializes calls.
+          Returns:
+            True if the bucket had a token, otherwise False
+        """
+        bucket = self._refilled(key)
+        if (bucket is None):
+            bucket = self._buckets[key] = _Bucket(self.burst, self.clock())
+            while (len(self._buckets) > self.max_keys):
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        if (bucket.tokens < 1):
+            return False
+        bucket.tokens -= 1
+        return True
+
+    def give_back(self, key):
+        """
+        Returns a token taken by take
+        """
+        bucket = self._refilled(key)
+        if (bucket is not None):
+            bucket.tokens += 1
+            if (bucket.tokens >= self.burst):
+                del self._buckets[key]
+
+    def _refilled(self, key):
+        """
+        Returns the bucket of a key topped up for the time passed, or None
+        if it has no bucket
+        """
+        bucket = self._buckets.get(key)
+        if (bucket is None):
+            return None
+        now = self.clock()
+        bucket.tokens = min(self.burst,
+                            bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        self._buckets.move_to_end(key)
+        return bucket
+
+
+class LoginThrottle:
+    """
+    Limits login attempts per client IP address and per email
+    """
+
+    def __init__(self, by_ip, by_email):
+        """
+          Parameters:
+            by_ip (TokenBuckets):       buckets keyed by IP address
+            by_email (TokenBuckets):    buckets keyed by email
+        """
+        self.by_ip = by_ip
+        self.by_email = by_email
+        self.attempts = 0
+        self.rejected_by_ip = 0
+        self.rejected_by_email = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def attempt(self, ip, email):
+        """
+        Records a login attempt
+          Parameters:
+            ip (string):        client IP address, None if unknown
+            email (string):     email the client is logging in as
+          Returns:
+            True if the attempt may proceed, False if it is over a limit
+        """
+        with self._lock:
+            self.attempts += 1
+            if (ip is not None and not self.by_ip.take(ip)):
+                self.rejected_by_ip += 1
+            elif (not self.by_email.take(email)):
+                # the attempt is not made, so the IP keeps its token
+                if (ip is not None):
+                    self.by_ip.give_back(ip)
+                self.rejected_by_email += 1
+            else:
+                return True
+            self.rejected += 1
+            return False
+
+    def succeeded(self, ip, email):
+        """
+        Gives back the tokens of an attempt that logged in
+        """
+        with self._lock:
+            if (ip is not None):
+                self.by_ip.give_back(ip)
+            self.by_email.give_back(email)
+
+    def stats(self):
+        """
+        Returns the attempt and rejection counts and the number of
+        buckets kept
+        """
+        with self._lock:
+            return LoginThrottleStats(
+                self.attempts, self.rejected, self.rejected_by_ip,
+                self.rejected_by_email,
+                len(self.by_ip) + len(self.by_email),
+                self.by_ip.evictions + self.by_email.evictions)
+
+
+login_throttle = LoginThrottle(
+    TokenBuckets(app.config['LOGIN_IP_RATE'], app.config['LOGIN_IP_BURST'],
+                 app.config['LOGIN_THROTTLE_MAX_KEYS']),
+    TokenBuckets(app.config['LOGIN_EMAIL_RATE'],
+                 app.config['LOGIN_EMAIL_BURST'],
+                 app.config['LOGIN_THROTTLE_MAX_KEYS']))
@@ -0,0 +1,170 @@
+"""
+File contains an in-memory Bloom filter of product titles for R4-8.
+A title the filter has never seen is definitely unused, so creating or
+renaming a product only queries the database when the filter reports a
+possible match.
+
+The filter is built from the product table on first use and grows by
+rebuilding once it holds more titles than it was sized for. Titles are
+never removed (a Bloom filter cannot forget), so renamed titles only add
+false positives, which the database query resolves. Products written by
+other processes are not in this process's filter; the unique index on
+Product.title rejects any duplicate that slips through.
+"""
+
+import hashlib
+import math
+import threading
+from collections import namedtuple
+from qbay import app, db
+from qbay.models import Product
+
+TitleFilterStats = namedtuple("TitleFilterStats",
+                              ["titles", "capacity", "bits", "checks",
+                               "definitely_unused", "false_positives"])
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter of strings
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+          Parameters:
+            capacity (int):         number of items the filter is sized
+                                    for
+            error_rate (float):     false positive rate at capacity
+        """
+        self.capacity = max(capacity, 1)
+        self.bits = max(int(-self.capacity * math.log(error_rate) /
+                            math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.bits / self.capacity *
+                                    math.log(2))), 1)
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, item):
+        # double hashing: two 64 bit halves of one digest give every probe
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self._array[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+class TitleFilter:
+    """
+    The product titles in use, as a lazily built, growing Bloom filter
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        """
+          Parameters:
+            capacity (int):         titles the first filter is sized for
+            error_rate (float):     false positive rate at capacity
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.checks = 0
+        self.definitely_unused = 0
+        self.false_positives = 0
+        self._filter = None
+        self._lock = threading.Lock()
+
+    def is_used(self, title, query):
+        """
+        Checks whether a title is in use
+          Parameters:
+            title (string):     product title
+            query (function):   checks the database, returning True if
+                                the title is used
+          Returns:
+            True if the title is used, otherwise False
+        """
+        if (not self.might_be_used(title)):
+            return False
+        used = query()
+        if (not used):
+            self.false_positives += 1
+        return used
+
+    def might_be_used(self, title):
+        """
+        Checks a title against the filter only
+          Parameters:
+            title (string):     product title
+          Returns:
+            False if the title is definitely unused, True if it may be
+            used
+        """
+        self.checks += 1
+        if (title not in self._loaded()):
+            self.definitely_unused += 1
+            return False
+        return True
+
+    def add(self, title):
+        """
+        Records a title written to the database
+        """
+        bloom = self._loaded()
+        with self._lock:
+            if (bloom is not self._filter):
+                # rebuilt meanwhile; the rebuild read the title already
+                return
+            if (bloom.count < bloom.capacity):
+                bloom.add(title)
+                return
+            # over capacity: rebuild with room to grow (the rebuild reads
+            # the new title from the database); other writers now see the
+            # filter replaced and leave the capacity alone
+            self._filter = None
+            self.capacity = max(self.capacity, bloom.count) * 2
+        self._loaded()
+
+    def reset(self):
+        """
+        Drops the filter; the next check rebuilds it from the database
+        """
+        with self._lock:
+            self._filter = None
+
+    def stats(self):
+        """
+        Returns the size of the filter and how often it avoided a query
+        """
+        bloom = self._filter
+        return TitleFilterStats(
+            bloom.count if bloom else 0, bloom.capacity if bloom else 0,
+            bloom.bits if bloom else 0, self.checks, self.definitely_unused,
+            self.false_positives)
+
+    def _loaded(self):
+        """
+        Returns the filter, building it from the product table if needed
+        """
+        bloom = self._filter
+        if (bloom is not None):
+            return bloom
+        with self._lock:
+            if (self._filter is None):
+                total = db.session.query(db.func.count(Product.id)).scalar()
+                bloom = BloomFilter(max(self.capacity, total * 2),
+                                    self.error_rate)
+                for title, in db.session.query(Product.title).yield_per(
+                        1000):
+                    bloom.add(title)
+                self._filter = bloom
+            return self._filter
+
+
+product_titles = TitleFilter(app.config['PRODUCT_TITLE_FILTER_CAPACITY'])
@@ -4,10 +4,43 @@ product ordering
 """
 
 import datetime
-from qbay.models import Transaction
-from qbay.users import decrease_balance, get_user, get_userid, increase_balance
-from qbay.products import get_product, get_productid, update_product_quantity
+from collections import namedtuple
+from concurrent.futures import TimeoutError
+from qbay.models import CartItem, Product, Transaction, User
+from qbay.users import adjust_balances
+from qbay.sales import record_sales
+from qbay.reservations import stock_holds
+from qbay.flash_sale import (FlashSale, add_flash_sale, get_flash_sale,
+                             remove_flash_sale)
 from qbay import db
+from qbay import ledger
+
+
+# Reasons reported by place_order
+ORDER_PLACED = "placed"
+UNKNOWN_PRODUCT = "unknown product"
+UNKNOWN_USER = "unknown user"
+OWN_PRODUCT = "own product"
+INVALID_QUANTITY = "invalid quantity"
+INSUFFICIENT_BALANCE = "insufficient balance"
+INSUFFICIENT_STOCK = "insufficient stock"
+EMPTY_CART = "empty cart"
+# a flash-sale order still queued after FLASH_WAIT_SECONDS; it may
+# still be placed
+ORDER_PENDING = "pending"
+
+OrderResult = namedtuple("OrderResult", ["success", "reason",
+                                         "transaction_id", "total_price"])
+CartOrderResult = namedtuple("CartOrderResult", ["success", "reason",
+                                                 "transaction_ids",
+                                                 "total_price"])
+OrderLine = namedtuple("OrderLine", ["product_id", "seller_id", "quantity",
+                                     "total_price"])
+HistoryPage = namedtuple("HistoryPage", ["entries", "next_cursor"])
+
+HISTORY_PAGE_SIZE = 20
+FLASH_BATCH_SIZE = 50
+FLASH_WAIT_SECONDS = 30
 
 
 def order_product(title, requested_quantity, buyer_email, owner_email):
@@ -21,42 +54,454 @@ def order_product(title, requested_quantity, buyer_email, owner_email):
       Returns:
         True if the product was successfully ordered, otherwise False
     """
+    return place_order(title, requested_quantity, buyer_email,
+                       owner_email).success
 
-    product = get_product(title, owner_email)
-    buyer = get_user(buyer_email)
-    total_price = product.price * requested_quantity
+
+def place_order(title, requested_quantity, buyer_email, owner_email):
+    """
+    Order a product inside a single database transaction. The stock
+    decrement and the buyer debit are conditional UPDATEs, so concurrent
+    orders can never oversell a product or overdraw a balance.
+      Parameters:
+        title (string):             product title
+        requested_quantity (int):   quantity requested by the buyer
+        buyer_email (string):       email of buyer
+        owner_email (string) :      product owner email
+      Returns:
+        An OrderResult whose success field is True if the product was
+        ordered, otherwise False with the reason the order was refused
+    """
 
     # Requirement: A user cannot place an order for their own products.
     if (buyer_email == owner_email):
+        return _refuse(OWN_PRODUCT)
+
+    if (requested_quantity <= 0):
+        return _refuse(INVALID_QUANTITY)
+
+    sale = get_flash_sale(title, owner_email)
+    if (sale is not None):
+        return _place_flash_order(sale, requested_quantity, buyer_email)
+
+    product = db.session.query(Product.id, Product.price).filter_by(
+        title=title, owner_email=owner_email).first()
+    if (product is None):
+        return _refuse(UNKNOWN_PRODUCT)
+
+    user_ids = dict(db.session.query(User.email, User.id).filter(
+        User.email.in_([buyer_email, owner_email])).all())
+    if (buyer_email not in user_ids or owner_email not in user_ids):
+        return _refuse(UNKNOWN_USER)
+
+    total_price = product.price * requested_quantity
+    line = OrderLine(product.id, user_ids[owner_email], requested_quantity,
+                     total_price)
+    reason, transaction_ids = _apply_order(user_ids[buyer_email], [line])
+    if (reason != ORDER_PLACED):
+        return _refuse(reason, total_price)
+
+    db.session.commit()
+    stock_holds.release(product.id, user_ids[buyer_email])
+    return OrderResult(True, ORDER_PLACED, transaction_ids[0], total_price)
+
+
+def order_cart(buyer_email):
+    """
+    Order every product in a buyer's cart inside a single database
+    transaction. Either every line is purchased and the cart is emptied,
+    or nothing changes.
+      Parameters:
+        buyer_email (string):       email of buyer
+      Returns:
+        A CartOrderResult whose success field is True if the cart was
+        ordered, otherwise False with the reason the order was refused
+    """
+    buyer_id = db.session.query(User.id).filter_by(
+        email=buyer_email).scalar()
+    if (buyer_id is None):
+        return CartOrderResult(False, UNKNOWN_USER, [], None)
+
+    rows = db.session.query(CartItem.product_id, CartItem.quantity,
+                            Product.price, User.id).join(
+        Product, Product.id == CartItem.product_id).join(
+        User, User.email == Product.owner_email).filter(
+        CartItem.buyer == buyer_id).all()
+    if (not rows):
+        return CartOrderResult(False, EMPTY_CART, [], None)
+
+    lines = [OrderLine(product_id, seller_id, quantity, price * quantity)
+             for product_id, quantity, price, seller_id in rows]
+    total_price = sum(line.total_price for line in lines)
+
+    # Requirement: A user cannot place an order for their own products.
+    if (any(line.seller_id == buyer_id for line in lines)):
+        return CartOrderResult(False, OWN_PRODUCT, [], total_price)
+
+    reason, transaction_ids = _apply_order(buyer_id, lines)
+    if (reason != ORDER_PLACED):
+        return CartOrderResult(False, reason, [], total_price)
+
+    db.session.query(CartItem).filter(
+        CartItem.buyer == buyer_id,
+        CartItem.product_id.in_([line.product_id for line in lines])
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    for line in lines:
+        stock_holds.release(line.product_id, buyer_id)
+    return CartOrderResult(True, ORDER_PLACED, transaction_ids, total_price)
+
+
+def start_flash_sale(title, owner_email, batch_size=FLASH_BATCH_SIZE):
+    """
+    Puts a product in flash-sale mode: orders for it are queued and
+    applied in batches by a single drainer, and are refused without
+    touching the database once the product sells out.
+      Parameters:
+        title (string):         product title
+        owner_email (string):   product owner email
+        batch_size (int):       maximum orders applied per batch
+      Returns:
+        True if the flash sale started, otherwise False
+    """
+    row = db.session.query(Product.id, Product.price, Product.quantity,
+                           User.id).join(
+        User, User.email == Product.owner_email).filter(
+        Product.title == title, Product.owner_email == owner_email).first()
+    if (row is None or get_flash_sale(title, owner_email) is not None):
         return False
 
+    product_id, price, quantity, seller_id = row
+    return add_flash_sale(FlashSale(product_id, title, owner_email,
+                                    seller_id, price, quantity,
+                                    _apply_flash_batch, batch_size))
+
+
+def stop_flash_sale(title, owner_email):
+    """
+    Takes a product out of flash-sale mode once its queued orders are
+    applied
+      Parameters:
+        title (string):         product title
+        owner_email (string):   product owner email
+      Returns:
+        True if the product was in flash-sale mode, otherwise False
+    """
+    return remove_flash_sale(title, owner_email)
+
+
+def _place_flash_order(sale, requested_quantity, buyer_email):
+    """
+    Queues an order for a product in flash-sale mode and waits for the
+    drainer to apply it. An order not applied within FLASH_WAIT_SECONDS
+    is reported as ORDER_PENDING: it stays queued and may still be
+    placed, so the buyer should check their order history.
+    """
+    total_price = sale.price * requested_quantity
+    future = sale.admit(buyer_email, requested_quantity)
+    if (future is None):
+        return _refuse(INSUFFICIENT_STOCK, total_price)
+    try:
+        return future.result(timeout=FLASH_WAIT_SECONDS)
+    except TimeoutError:
+        return _refuse(ORDER_PENDING, total_price)
+
+
+def _apply_flash_batch(sale, requests):
+    """
+    Applies a batch of flash-sale orders in one database transaction:
+    each buyer is debited with a conditional UPDATE, then the product
+    stock and the seller balance are updated once for the whole batch.
+    If the database holds less stock than the batch needs, because
+    orders were placed around the sale, the batch is applied again with
+    only the requests that fit. Runs on the sale's drainer thread.
+      Parameters:
+        sale (FlashSale):   the sale the orders belong to
+        requests (list):    FlashRequest for each order
+      Returns:
+        An OrderResult for each request, and the stock left in the
+        database if the sale's count was wrong, otherwise None
+    """
+    try:
+        results = _apply_flash_requests(sale, requests)
+        if (results is not None):
+            return results, None
+
+        # the sale counted more stock than the database holds
+        stock = db.session.query(Product.quantity).filter_by(
+            id=sale.product_id).scalar() or 0
+        results = _apply_flash_requests(sale, requests, stock)
+        if (results is None):
+            # the stock changed again meanwhile; refuse the whole batch
+            results = [_refuse(INSUFFICIENT_STOCK,
+                               sale.price * request.quantity)
+                       for request in requests]
+        stock = db.session.query(Product.quantity).filter_by(
+            id=sale.product_id).scalar() or 0
+        db.session.commit()
+        return results, stock
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.remove()
+
+
+def _apply_flash_requests(sale, requests, stock=None):
+    """
+    Applies the flash-sale orders of a batch that fit in the stock and
+    commits
+      Parameters:
+        sale (FlashSale):   the sale the orders belong to
+        requests (list):    FlashRequest for each order
+        stock (int):        units the orders may take in total, or None
+                            to rely on the sale's count
+      Returns:
+        An OrderResult for each request, or None (after rolling back)
+        if the database held too little stock for the orders
+    """
+    buyer_ids = dict(db.session.query(User.email, User.id).filter(
+        User.email.in_({r.buyer_email for r in requests})).all())
+
+    results = []
+    placed = []
+    for request in requests:
+        buyer_id = buyer_ids.get(request.buyer_email)
+        total_price = sale.price * request.quantity
+        if (buyer_id is None):
+            results.append(_refuse(UNKNOWN_USER, total_price))
+        elif (buyer_id == sale.seller_id):
+            results.append(_refuse(OWN_PRODUCT, total_price))
+        elif (stock is not None and request.quantity > stock):
+            results.append(_refuse(INSUFFICIENT_STOCK, total_price))
+        elif (not _debit_buyer(buyer_id, total_price)):
+            results.append(_refuse(INSUFFICIENT_BALANCE, total_price))
+        else:
+            if (stock is not None):
+                stock -= request.quantity
+            results.append(None)
+            placed.append((len(results) - 1, buyer_id, request))
+    if (not placed):
+        db.session.rollback()
+        return results
+
+    current_date = datetime.datetime.now()
+    batch_line = OrderLine(
+        sale.product_id, sale.seller_id,
+        sum(request.quantity for _, _, request in placed),
+        sum(sale.price * request.quantity for _, _, request in placed))
+    if (not _take_stock([batch_line], current_date)):
+        db.session.rollback()
+        return None
+    _credit_sellers([batch_line])
+    record_sales([batch_line], current_date)
+
+    transactions = [Transaction(buyer=buyer_id,
+                                seller=sale.seller_id,
+                                product_id=sale.product_id,
+                                total_price=sale.price * request.quantity,
+                                date=current_date,
+                                quantity=request.quantity,
+                                purchased=True,
+                                delivered=True)
+                    for _, buyer_id, request in placed]
+    db.session.add_all(transactions)
+    db.session.flush()
+    for (index, _, request), transaction in zip(placed, transactions):
+        results[index] = OrderResult(True, ORDER_PLACED, transaction.id,
+                                     transaction.total_price)
+    db.session.commit()
+    return results
+
+
+def _refuse(reason, total_price=None):
+    """
+    Builds the OrderResult for an order that was not placed
+      Parameters:
+        reason (string):    why the order was refused
+        total_price (int):  total price of the order, if known
+    """
+    return OrderResult(False, reason, None, total_price)
+
+
+def _apply_order(buyer_id, lines):
+    """
+    Takes the stock, moves the money and records a Transaction for
+    every line of an order. Rolls back on failure; on success the
+    caller commits.
+      Parameters:
+        buyer_id (int):     id of the buyer
+        lines (list):       OrderLine for each product, one per product
+      Returns:
+        A (reason, transaction ids) pair, the reason being ORDER_PLACED
+        if the order can be committed
+    """
+    current_date = datetime.datetime.now()
+
+    # User shouldn't be able to request more than the number of instances
+    # of the product that currently exists and is not held by others
+    held = {line.product_id: stock_holds.held_by_others(line.product_id,
+                                                        buyer_id)
+            for line in lines}
+    if (not _take_stock(lines, current_date, held)):
+        db.session.rollback()
+        return INSUFFICIENT_STOCK, []
+
     # Requirement: A user cannot place an order that costs
     # more than their balance.
-    if (not check_balance(total_price, buyer.balance)):
-        return False
+    total_price = sum(line.total_price for line in lines)
+    if (not _debit_buyer(buyer_id, total_price)):
+        db.session.rollback()
+        return INSUFFICIENT_BALANCE, []
 
-    # User shouldn't be able to request more than the number of instances
-    # of the product that currently exists
-    if (not check_quantity(product.quantity, requested_quantity)):
-        return False
+    _credit_sellers(lines)
+    record_sales(lines, current_date)
 
-    # If requirements are passed, the order is placed and balances are updated.
-    update_user_balances(buyer_email, owner_email, total_price)
+    transactions = [Transaction(buyer=buyer_id,
+                                seller=line.seller_id,
+                                product_id=line.product_id,
+                                total_price=line.total_price,
+                                date=current_date,
+                                quantity=line.quantity,
+                                purchased=True,
+                                delivered=True) for line in lines]
+    db.session.add_all(transactions)
+    db.session.flush()
+    return ORDER_PLACED, [transaction.id for transaction in transactions]
 
-    # quantity is updated
-    new_quantity = product.quantity - requested_quantity
-    update_product_quantity(title, owner_email, new_quantity)
 
-    current_date = datetime.datetime.now()
-    db.session.add(Transaction(buyer=get_userid(buyer_email),
-                               seller=get_userid(owner_email),
-                               product_id=get_productid(title, owner_email),
-                               total_price=total_price,
-                               date=current_date,
-                               quantity=requested_quantity,
-                               purchased=True,
-                               delivered=True))
-    return True
+def _take_stock(lines, date, held=None):
+    """
+    Decrements the quantity of every product in an order with one
+    UPDATE, provided enough instances of each remain once the units
+    held for other buyers are set aside. Does not commit.
+      Parameters:
+        lines (list):       OrderLine for each product
+        date (datetime):    time of the order
+        held (dict):        units of each product id that must be left
+      Returns:
+        True if the stock of every product was taken, otherwise False
+    """
+    held = held or {}
+    requested = db.case({line.product_id: line.quantity for line in lines},
+                        value=Product.id)
+    needed = db.case({line.product_id: (line.quantity +
+                                        held.get(line.product_id, 0))
+                      for line in lines}, value=Product.id)
+    updated = db.session.query(Product).filter(
+        Product.id.in_([line.product_id for line in lines]),
+        Product.quantity >= needed
+    ).update({Product.quantity: Product.quantity - requested,
+              Product.last_modified_date: date},
+             synchronize_session=False)
+    return updated == len(lines)
+
+
+def _debit_buyer(buyer_id, total_price):
+    """
+    Removes the cost of an order from the buyer's balance if the
+    buyer can afford it. Does not commit.
+      Parameters:
+        buyer_id (int):     id of the buyer
+        total_price (int):  total cost of the order
+      Returns:
+        True if the balance was updated, otherwise False
+    """
+    return ledger.post(buyer_id, -total_price, floor=0)
+
+
+def _credit_sellers(lines):
+    """
+    Adds the revenue of an order to every seller's balance with one
+    ledger insert. Does not commit.
+      Parameters:
+        lines (list):       OrderLine for each product
+    """
+    credits = {}
+    for line in lines:
+        credits[line.seller_id] = (credits.get(line.seller_id, 0) +
+                                   line.total_price)
+    ledger.post_many(list(credits.items()))
+
+
+def get_order_history(email, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Returns one page of a user's purchases, newest first
+      Parameters:
+        email (string):     buyer email
+        cursor (string):    next_cursor of the previous page, None for the
+                            first page
+        limit (int):        maximum number of entries on the page
+      Returns:
+        A HistoryPage of (Transaction, product title) entries
+    """
+    return _history_page(Transaction.buyer, email, cursor, limit)
+
+
+def get_sales_history(email, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Returns one page of a user's sales, newest first
+      Parameters:
+        email (string):     seller email
+        cursor (string):    next_cursor of the previous page, None for the
+                            first page
+        limit (int):        maximum number of entries on the page
+      Returns:
+        A HistoryPage of (Transaction, product title) entries
+    """
+    return _history_page(Transaction.seller, email, cursor, limit)
+
+
+def _history_page(column, email, cursor, limit):
+    """
+    Reads a page of transactions with keyset pagination: the page starts
+    right after the (date, id) of the previous page's last entry, so it
+    is an index range read on (column, date) whatever the page number.
+      Parameters:
+        column (Column):    Transaction.buyer or Transaction.seller
+        email (string):     user email
+        cursor (string):    position of the previous page, or None; a
+                            cursor that cannot be read gives the first page
+        limit (int):        maximum number of entries on the page
+    """
+    user_id = db.session.query(User.id).filter_by(email=email).scalar()
+    if (user_id is None):
+        return HistoryPage([], None)
+
+    query = db.session.query(Transaction, Product.title).outerjoin(
+        Product, Product.id == Transaction.product_id).filter(
+        column == user_id)
+    position = _decode_cursor(cursor) if cursor else None
+    if (position is not None):
+        date, transaction_id = position
+        query = query.filter(db.tuple_(Transaction.date, Transaction.id) <
+                             db.tuple_(date, transaction_id))
+    entries = query.order_by(Transaction.date.desc(),
+                             Transaction.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if (len(entries) > limit):
+        entries = entries[:limit]
+        last = entries[-1][0]
+        next_cursor = _encode_cursor(last.date, last.id)
+    return HistoryPage(entries, next_cursor)
+
+
+def _encode_cursor(date, transaction_id):
+    return "{}_{}".format(date.isoformat(), transaction_id)
+
+
+def _decode_cursor(cursor):
+    """
+    Returns the (date, transaction id) of a cursor, or None if the cursor
+    was not made by _encode_cursor (e.g. edited in the URL)
+    """
+    date, _, transaction_id = cursor.rpartition("_")
+    try:
+        return (datetime.datetime.fromisoformat(date),
+                int(transaction_id))
+    except ValueError:
+        return None
 
 
 def check_balance(total_price, balance):
@@ -93,6 +538,9 @@ def update_user_balances(buyer_email, owner_email, total_price):
         buyer_email (string):       buyer email
         owner_email (string):       product owner email
         total_price (int):          total cost of the transaction
+      Returns:
+        True if both balances were updated, False if the buyer cannot
+        afford the total price
     """
-    decrease_balance(buyer_email, total_price)
-    increase_balance(owner_email, total_price)
+    return adjust_balances([(buyer_email, -total_price),
+                            (owner_email, total_price)])
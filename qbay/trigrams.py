@@ -0,0 +1,219 @@
+"""
+File contains an in-memory trigram index of product titles for
+typo-tolerant search.
+
+Every title is split into trigrams (three letter slices of its words,
+padded at the start and end of each word, as PostgreSQL's pg_trgm does).
+The index maps each trigram to a sorted array of the ids of the products
+whose titles contain it. A misspelled search still shares most of its
+trigrams with the title meant, so titles are ranked by the share of the
+search's trigrams they contain.
+
+A title must contain at least FUZZY_SEARCH_THRESHOLD of the search's
+trigrams, so it must appear in at least one of the search's rarest
+trigram lists. Only those lists are read to find candidates, and at most
+FUZZY_SEARCH_MAX_CANDIDATES are kept, which bounds the work of a search
+however many titles are indexed. The other trigrams are only counted for
+the candidates.
+
+The index is built from the product table at startup (or on first use)
+and kept up to date by create_product, update_product and
+import_products.
+"""
+
+import bisect
+import heapq
+import math
+import re
+import sys
+import threading
+from array import array
+from collections import Counter, namedtuple
+from qbay import app, db
+from qbay.models import Product
+
+TrigramStats = namedtuple("TrigramStats", ["titles", "trigrams",
+                                           "postings", "bytes"])
+
+# words of a title: letters and digits only
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+# a trigram list this many times longer than the candidates of a search
+# is checked by binary search per candidate rather than read whole
+LONG_LIST_RATIO = 32
+
+
+def trigrams(text):
+    """
+    Returns the set of trigrams of a text, ignoring case
+    """
+    grams = set()
+    for word in WORD_PATTERN.findall(text.casefold()):
+        padded = "  " + word + " "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Product titles indexed by trigram, searched by similarity
+    """
+
+    def __init__(self, threshold=0.3, max_candidates=2000):
+        """
+          Parameters:
+            threshold (float):      share of a search's trigrams a title
+                                    must contain to match
+            max_candidates (int):   most titles scored per search
+        """
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self._postings = None
+        self._sizes = None
+        self._lock = threading.Lock()
+
+    def search(self, text, limit=100):
+        """
+        Finds the titles most similar to a search
+          Parameters:
+            text (string):  the search, possibly misspelled
+            limit (int):    most product ids returned
+          Returns:
+            A list of (product id, similarity) pairs, most similar first.
+            Similarity is the share of the search's trigrams found in the
+            title; ties go to the title with fewer other trigrams.
+        """
+        wanted = trigrams(text)
+        if (not wanted):
+            return []
+        self._loaded()
+        with self._lock:
+            postings, sizes = self._postings, self._sizes
+            empty = array("l")
+            lists = sorted((postings.get(gram, empty) for gram in wanted),
+                           key=len)
+            needed = max(math.ceil(self.threshold * len(lists)), 1)
+
+            # a match holds `needed` trigrams, so at least one of the
+            # len - needed + 1 rarest
+            counts = Counter()
+            probed = 0
+            for ids in lists[:len(lists) - needed + 1]:
+                room = self.max_candidates - len(counts)
+                if (len(ids) > room):
+                    # too common to read whole: the newest products it
+                    # holds are candidates, and it is checked like the
+                    # lists not read
+                    for product_id in ids[len(ids) - max(room, 0):]:
+                        counts.setdefault(product_id, 0)
+                    break
+                counts.update(ids)
+                probed += 1
+            candidates = set(counts)
+            for ids in lists[probed:]:
+                if (len(ids) <= len(candidates) * LONG_LIST_RATIO):
+                    counts.update(candidates.intersection(ids))
+                    continue
+                # much longer than the candidates: look each one up
+                for product_id in candidates:
+                    position = bisect.bisect_left(ids, product_id)
+                    if (position < len(ids) and ids[position] == product_id):
+                        counts[product_id] += 1
+
+            matches = []
+            for product_id, shared in counts.items():
+                if (shared >= needed):
+                    union = len(wanted) + sizes[product_id] - shared
+                    matches.append((shared / len(wanted), shared / union,
+                                    product_id))
+        best = heapq.nlargest(limit, matches)
+        return [(product_id, similarity)
+                for similarity, _, product_id in best]
+
+    def add(self, product_id, title, old_title=None):
+        """
+        Records a product's title written to the database
+          Parameters:
+            product_id (int):   the product id
+            title (string):     the new title
+            old_title (string): the title it replaces, if renamed
+        """
+        self._loaded()
+        with self._lock:
+            if (old_title is not None):
+                for gram in trigrams(old_title):
+                    ids = self._postings.get(gram)
+                    if (ids is None):
+                        continue
+                    position = bisect.bisect_left(ids, product_id)
+                    if (position < len(ids) and ids[position] == product_id):
+                        del ids[position]
+                        if (not ids):
+                            del self._postings[gram]
+            self._insert(product_id, title)
+
+    def load(self, titles=None):
+        """
+        Builds the index, replacing any built before
+          Parameters:
+            titles (iterable):  (product id, title) pairs in id order, read
+                                from the product table if None
+        """
+        if (titles is None):
+            titles = db.session.query(Product.id, Product.title).order_by(
+                Product.id).yield_per(1000)
+        postings = {}
+        sizes = {}
+        for product_id, title in titles:
+            grams = trigrams(title)
+            for gram in grams:
+                postings.setdefault(gram, []).append(product_id)
+            sizes[product_id] = len(grams)
+        postings = {gram: array("l", ids) for gram, ids in postings.items()}
+        with self._lock:
+            self._postings = postings
+            self._sizes = sizes
+
+    def stats(self):
+        """
+        Returns the size of the index and the memory it uses
+        """
+        with self._lock:
+            postings = dict(self._postings or {})
+            sizes = dict(self._sizes or {})
+        size = sys.getsizeof(postings) + sys.getsizeof(sizes)
+        size += sum(sys.getsizeof(gram) + sys.getsizeof(ids)
+                    for gram, ids in postings.items())
+        # ids above the small int cache are objects of their own
+        size += len(sizes) * sys.getsizeof(2 ** 20)
+        return TrigramStats(len(sizes), len(postings),
+                            sum(len(ids) for ids in postings.values()), size)
+
+    def _insert(self, product_id, title):
+        """
+        Adds a title to the postings; the caller holds the lock
+        """
+        grams = trigrams(title)
+        for gram in grams:
+            ids = self._postings.get(gram)
+            if (ids is None):
+                self._postings[gram] = array("l", [product_id])
+            elif (ids[-1] < product_id):
+                # new products have the largest ids
+                ids.append(product_id)
+            else:
+                position = bisect.bisect_left(ids, product_id)
+                if (position == len(ids) or ids[position] != product_id):
+                    ids.insert(position, product_id)
+        self._sizes[product_id] = len(grams)
+
+    def _loaded(self):
+        """
+        Builds the index from the product table if needed
+        """
+        if (self._postings is None):
+            self.load()
+
+
+product_trigrams = TrigramIndex(app.config['FUZZY_SEARCH_THRESHOLD'],
+                                app.config['FUZZY_SEARCH_MAX_CANDIDATES'])
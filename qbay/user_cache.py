@@ -0,0 +1,141 @@
+"""
+File contains a per-process cache of recently authenticated users, so
+most page views skip the User query in controllers.authenticate.
+
+Each email has a version stamp that profile updates bump. A cached user
+is only served while its stamp is current, and a user loaded while an
+update was running is not cached, because the stamp it was loaded under
+has since moved on. The cache lives in one process; other processes
+only see an update once the cached entry expires.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from qbay import app
+
+UserCacheStats = namedtuple("UserCacheStats", ["size", "hits", "misses",
+                                               "evictions", "expirations",
+                                               "invalidations"])
+
+
+class _Entry:
+    __slots__ = ("user", "version", "expires")
+
+    def __init__(self, user, version, expires):
+        self.user = user
+        self.version = version
+        self.expires = expires
+
+
+class UserCache:
+    """
+    Bounded LRU of users keyed by email, with a TTL and version stamps
+    """
+
+    def __init__(self, max_size=1024, ttl=60, clock=time.monotonic):
+        """
+          Parameters:
+            max_size (int):     maximum number of cached users; the least
+                                recently used are evicted first
+            ttl (float):        seconds a user stays cached
+            clock (function):   returns the current time in seconds
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()   # email -> _Entry, oldest use first
+        # email -> (version, time bumped), oldest bump first. A stamp only
+        # matters to loads that started before the bump, so stamps are
+        # dropped once they are older than the TTL.
+        self._versions = OrderedDict()
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, email, load):
+        """
+        Returns a cached user, loading and caching it on a miss
+          Parameters:
+            email (string):     user email
+            load (function):    loads the user, returning None if there
+                                is no such user
+          Returns:
+            The user, or None if load returned None
+        """
+        with self._lock:
+            now = self.clock()
+            version = self._version(email)
+            entry = self._entries.get(email)
+            if (entry is not None and entry.version == version and
+                    entry.expires > now):
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return entry.user
+            if (entry is not None):
+                del self._entries[email]
+                self.expirations += 1
+            self.misses += 1
+
+        user = load()
+        if (user is None):
+            return None
+
+        with self._lock:
+            # a profile update ran while loading; the user may be stale
+            if (self._version(email) != version):
+                return user
+            self._entries[email] = _Entry(user, version,
+                                          self.clock() + self.ttl)
+            self._entries.move_to_end(email)
+            while (len(self._entries) > self.max_size):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return user
+
+    def bump(self, email):
+        """
+        Invalidates the cached user of an email after its profile changed
+          Parameters:
+            email (string):     user email
+        """
+        with self._lock:
+            now = self.clock()
+            self._versions.pop(email, None)
+            self._versions[email] = (next(self._counter), now)
+            while (self._versions):
+                oldest, (_, bumped) = next(iter(self._versions.items()))
+                if (bumped + self.ttl > now):
+                    break
+                del self._versions[oldest]
+            if (self._entries.pop(email, None) is not None):
+                self.invalidations += 1
+
+    def stats(self):
+        """
+        Returns the size of the cache and its hit, miss, eviction,
+        expiration and invalidation counts
+        """
+        with self._lock:
+            return UserCacheStats(len(self._entries), self.hits,
+                                  self.misses, self.evictions,
+                                  self.expirations, self.invalidations)
+
+    def _version(self, email):
+        """
+        Returns the current version stamp of an email
+        """
+        stamp = self._versions.get(email)
+        return 0 if stamp is None else stamp[0]
+
+
+authenticated_users = UserCache(app.config['AUTH_CACHE_SIZE'],
+                                app.config['AUTH_CACHE_TTL'])
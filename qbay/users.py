@@ -4,8 +4,146 @@ File contains functions for user login, register and many
 """
 
 import re
+from collections import namedtuple
+from sqlalchemy.exc import IntegrityError
 from qbay.models import User
 from qbay import db
+from qbay import ledger
+from qbay import lookups
+from qbay.user_cache import authenticated_users
+from qbay.throttle import login_throttle
+from qbay.passwords import hash_password, hash_passwords, verify_password
+from qbay.validation import DATABASE, PATTERN, Rule, Validator
+
+# reasons reported by register_many
+REGISTERED = "registered"
+INVALID_REGISTRATION = "invalid registration"
+EMAIL_IN_USE = "email in use"
+# the batch kept colliding with concurrent registrations; not inserted
+RETRY_EXHAUSTED = "retry exhausted"
+
+REGISTER_CHUNK_SIZE = 500
+
+RegistrationResult = namedtuple("RegistrationResult",
+                                ["email", "success", "reason"])
+
+# columns get_user_profile can load
+PROFILE_FIELDS = ("id", "email", "user_name", "shipping_address",
+                  "postal_code", "balance")
+
+
+class UserProfile:
+    """A read-only projection of some of a user's columns
+
+    Only the fields requested from get_user_profile are set; reading any
+    other field raises AttributeError.
+    """
+    __slots__ = PROFILE_FIELDS
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '<UserProfile %r>' % getattr(self, "email", None)
+
+
+# The email has to follow addr-spec defined in RFC 5322
+EMAIL_PATTERN = re.compile(
+    "(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\.[a-zA-Z0-9-.]+$)")
+SPECIAL_PATTERN = re.compile('[@_!#$%^&*()<>?||}{~:]')
+LOWER_PATTERN = re.compile("[a-z]")
+UPPER_PATTERN = re.compile("[A-Z]")
+NAME_PATTERN = re.compile("^[a-zA-Z0-9][a-zA-Z0-9 ]*[a-zA-Z0-9]{1,}$")
+
+# R1-1: Both email and password cannot be empty
+R1_1 = Rule("R1-1", lambda values: (len(values["email"]) > 0 and
+                                    len(values["password"]) > 0))
+
+# R1-2: A user is uniquely identified by their email address.
+# R1-7: If the email has been used, the operation failed.
+R1_7 = Rule("R1-7", lambda values: not find_user(values["email"]),
+            DATABASE)
+
+# R1-3: The email has to follow addr-spec defined in RFC 5322
+R1_3 = Rule("R1-3", lambda values: EMAIL_PATTERN.search(values["email"]),
+            PATTERN)
+
+# R1-4: Password has to meet the required complexity:
+#    minimum length 6,
+#    at least one upper case,
+#    at least one lower case,
+#    and at least one special character.
+R1_4_LENGTH = Rule("R1-4 length", lambda values: len(values["password"]) >= 6)
+R1_4 = Rule("R1-4", lambda values: (
+    SPECIAL_PATTERN.search(values["password"]) and
+    LOWER_PATTERN.search(values["password"]) and
+    UPPER_PATTERN.search(values["password"])), PATTERN)
+
+# R1-5: User name has to be non-empty,
+#    alphanumeric-only,
+#    and space allowed only if it is not as the prefix
+#    or suffix.
+R1_5 = Rule("R1-5", lambda values: NAME_PATTERN.search(values["user_name"]),
+            PATTERN)
+
+# R1-6: User name has to be longer than 2 characters
+#    and less than 20 characters.
+R1_6 = Rule("R1-6", lambda values: 2 <= len(values["user_name"]) < 20)
+
+# R2-2: login inputs meet the email/password requirements of R1-3, R1-4
+LOGIN_RULES = Validator(R1_4_LENGTH, R1_4, R1_3)
+REGISTRATION_FORMAT_RULES = Validator(R1_1, R1_3, R1_4_LENGTH, R1_4, R1_5,
+                                      R1_6)
+REGISTRATION_RULES = Validator(REGISTRATION_FORMAT_RULES, R1_7)
+
+
+def _valid_postal_code(code):
+    """
+    Alternating letters and numbers with one space in the middle
+    """
+    for x in range(0, len(code)):
+        if (x == 0 or x == 2 or x == 5):
+            if (not code[x].isalpha()):
+                return False
+        elif (x == 3 and code[x] != " "):
+            return False
+        elif (x == 1 or x == 4 or x == 6):
+            if (not code[x].isdecimal()):
+                return False
+    return True
+
+
+# R3-2: Shipping_address should be non-empty,
+# alphanumeric-only, and no special characters.
+R3_2_EMPTY = Rule("R3-2 empty",
+                  lambda values: len(values["shipping_address"]) > 0)
+R3_2 = Rule("R3-2", lambda values: all(
+    character.isalnum() or character == " "
+    for character in values["shipping_address"]), PATTERN)
+
+# R3-3: Postal code has to be a valid Canadian postal code.
+R3_3_LENGTH = Rule("R3-3 length",
+                   lambda values: len(values["postal_code"]) == 7)
+R3_3 = Rule("R3-3", lambda values: _valid_postal_code(values["postal_code"]),
+            PATTERN)
+
+# R3-4: User name follows the requirements above: longer than 2 and
+# shorter than 20 characters, alphanumeric with spaces allowed except as
+# the prefix or suffix.
+R3_4_LENGTH = Rule("R3-4 length",
+                   lambda values: 2 < len(values["user_name"]) < 20)
+R3_4 = Rule("R3-4", lambda values: (
+    values["user_name"][0] != " " and values["user_name"][-1] != " " and
+    all(character.isalnum() or character == " "
+        for character in values["user_name"])), PATTERN)
+
+# the validator of each field update_profile can change
+PROFILE_RULES = {
+    "user_name": Validator(R3_4_LENGTH, R3_4),
+    "shipping_address": Validator(R3_2_EMPTY, R3_2),
+    "postal_code": Validator(R3_3_LENGTH, R3_3),
+}
 
 
 def valid_login(email, password):
@@ -20,37 +158,38 @@ def valid_login(email, password):
     """
 
     # R2-2: check if the supplied inputs meet the email/password requirements
-    # validates password
-    req_email = re.compile(
-        "(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\.[a-zA-Z0-9-.]+$)")
-    if ((len(password) >= 6) and
-            re.search('[@_!#$%^&*()<>?||}{~:]', password) and
-            re.search("[a-z]", password) and
-            re.search("[A-Z]", password)):
-        # The email has to follow addr-spec defined in RFC 5322
-        if not(re.search(req_email, email)):
-            return False
-        return True
-    return False
+    return LOGIN_RULES(email=email, password=password)
 
 
-def login(email, password):
+def login(email, password, ip=None):
     """
     Check login information
       Parameters:
         email (string):    user email
         password (string): user password
+        ip (string):       client IP address, if known
       Returns:
         The user object if login succeeded otherwise None
     """
 
+    # reject clients over the login limits before any other work
+    if (not login_throttle.attempt(ip, email)):
+        return None
+
     # R2-1: User can log in using email address and the password
     # R2-2: check supplied inputs meet requirements before checking database
     if (valid_login(email, password)):
-        valid = db.session.query(User).filter_by(email=email,
-                                                 password=password).first()
+        valid = db.session.query(User).filter_by(email=email).first()
         if valid is None:
             return None
+        matches, needs_rehash = verify_password(password, valid.password)
+        if (not matches):
+            return None
+        if (needs_rehash):
+            # plain text or outdated hash: store a current hash
+            valid.password = hash_password(password)
+            db.session.commit()
+        login_throttle.succeeded(ip, email)
         return valid
     return None
 
@@ -63,22 +202,54 @@ def find_user(email):
       Returns:
         True if the email is being used in the database, False otherwise
     """
-    if (db.session.query(User).filter_by(email=email).first() is None):
-        return False
-    return True
+    return get_user(email) is not None
 
 
 def get_user(email):
     """
-    Returns an existing product
+    Returns an existing user, loaded at most once per request
       Parameters:
-        title (string):         product title
-        owner_email (string) : product owner email
+        email (string):         user email
       Returns:
-        A Product object if the product exists in the database,
+        A User object if the user exists in the database,
         otherwise None
     """
-    return db.session.query(User).filter_by(email=email).first()
+    return lookups.remember(
+        "user", email, "user",
+        lambda: db.session.query(User).filter_by(email=email).first())
+
+
+def get_user_profile(email, fields=PROFILE_FIELDS):
+    """
+    Loads the requested columns of a user with a single query
+      Parameters:
+        email (string):     user email
+        fields (tuple):     names from PROFILE_FIELDS to load
+      Returns:
+        A UserProfile with the requested fields set, or None if the user
+        does not exist
+    """
+    columns = []
+    for field in fields:
+        if (field not in PROFILE_FIELDS):
+            raise ValueError("unknown profile field: {}".format(field))
+        if (field != "balance"):
+            columns.append(getattr(User, field))
+    if ("balance" in fields):
+        # the balance is the snapshot plus the ledger tail, and settling
+        # it needs the user's id
+        columns.extend(ledger.row_balance())
+        columns.append(User.id)
+
+    row = db.session.query(*columns).filter(User.email == email).first()
+    if (row is None):
+        return None
+
+    values = dict(zip([field for field in fields if field != "balance"], row))
+    if ("balance" in fields):
+        current, tail_length, user_id = row[-3:]
+        values["balance"] = ledger.settle(user_id, current, tail_length)
+    return UserProfile(**values)
 
 
 def get_userid(email):
@@ -89,8 +260,9 @@ def get_userid(email):
       Returns:
         The id of the user
     """
-    return db.session.query(User).filter_by(
-        email=email).first().id
+    return lookups.remember(
+        "user", email, "id",
+        lambda: get_user_profile(email, ("id",)).id)
 
 
 def get_address(email):
@@ -102,8 +274,7 @@ def get_address(email):
         The shipping address of the user
     """
     # R1-8: Shipping address is empty at the time of registration.
-    return db.session.query(User).filter_by(
-        email=email).first().shipping_address
+    return get_user_profile(email, ("shipping_address",)).shipping_address
 
 
 def get_postal_code(email):
@@ -115,7 +286,7 @@ def get_postal_code(email):
         The postal code of the user
     """
     # R1-9: Postal code is empty at the time of registration.
-    return db.session.query(User).filter_by(email=email).first().postal_code
+    return get_user_profile(email, ("postal_code",)).postal_code
 
 
 def get_balance(email):
@@ -128,7 +299,10 @@ def get_balance(email):
     """
     # R1-10: Balance should be initialized as 100 at the time of registration.
     # (free $100 dollar signup bonus).
-    return db.session.query(User).filter_by(email=email).first().balance
+    profile = get_user_profile(email, ("balance",))
+    if (profile is None):
+        return None
+    return profile.balance
 
 
 def register(user_name, email, password):
@@ -142,71 +316,167 @@ def register(user_name, email, password):
         True if registration succeeded otherwise False
     """
 
-    # R1-1: Both email and password cannot be empty
-    if len(email) == 0 or len(password) == 0:
+    # R1-1 to R1-7, checked without the database unless the
+    # information is otherwise valid
+    if (not REGISTRATION_RULES(user_name=user_name, email=email,
+                               password=password)):
         return False
 
-    # R1-2: A user is uniquely identified by their email address.
-    if (not(db.session.query(User).filter_by(email=email).first() is None)):
-        return False
+    # create a new user
+    user = User(**_new_user(user_name, email, hash_password(password)))
 
-    # R1-3: The email has to follow addr-spec defined in RFC 5322
-    req_email = re.compile(
-        "(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\.[a-zA-Z0-9-.]+$)")
-    if not(re.search(req_email, email)):
-        return False
+    # add it to the current database session
+    db.session.add(user)
+    # actually save the user object
+    db.session.commit()
+    lookups.forget("user", email)
 
-    # R1-4: Password has to meet the required complexity:
-    #    minimum length 6,
-    #    at least one upper case,
-    #    at least one lower case,
-    #    and at least one special character.
-    if not ((len(password) >= 6) and
-            re.search('[@_!#$%^&*()<>?||}{~:]', password) and
-            re.search("[a-z]", password) and
-            re.search("[A-Z]", password)):
-        return False
+    return True
 
-    # R1-5: User name has to be non-empty,
-    #    alphanumeric-only,
-    #    and space allowed only if it is not as the prefix
-    #    or suffix.
 
-    req_name = re.compile(
-        "^[a-zA-Z0-9][a-zA-Z0-9 ]*[a-zA-Z0-9]{1,}$")
-    if not re.search(req_name, user_name):
-        return False
+def valid_registration(user_name, email, password):
+    """
+    Checks registration information meets requirements, without touching
+    the database
+      Parameters:
+        user_name (string):     user name
+        email (string):         user email
+        password (string):      user password
+      Returns:
+        True if the information is valid otherwise False
+    """
 
-    # R1-6: User name has to be longer than 2 characters
-    #    and less than 20 characters.
+    # R1-1, R1-3, R1-4, R1-5, R1-6
+    return REGISTRATION_FORMAT_RULES(user_name=user_name, email=email,
+                                     password=password)
 
-    if len(user_name) < 2 or len(user_name) >= 20:
-        return False
 
-    # R1-7: If the email has been used, the operation failed.
-    if (not(db.session.query(User).filter_by(email=email).first() is None)):
-        return False
+def _new_user(user_name, email, password_hash):
+    """
+    Returns the column values of a newly registered user
+    """
+    # R1-8, R1-9: Shipping address and postal code are empty at the time
+    # of registration. R1-10: Balance starts at 100.
+    return {"email": email,
+            "user_name": user_name,
+            "password": password_hash,
+            "shipping_address": "",
+            "postal_code": "",
+            "balance": 10000}
 
-    # create a new user
-    user = User(email=email,
-                user_name=user_name,
-                password=password,
-                shipping_address="",
-                postal_code="",
-                balance=10000,
-                order_history=[])
 
-    # add it to the current database session
-    db.session.add(user)
-    # actually save the user object
+def register_many(records, chunk_size=REGISTER_CHUNK_SIZE):
+    """
+    Registers many users in one transaction. Records are validated in
+    memory and existing emails are found with one query per chunk.
+    Passwords are hashed before the write transaction starts, so the
+    database is only locked while the rows are inserted.
+      Parameters:
+        records (iterable):     (user_name, email, password) tuples
+        chunk_size (int):       number of records checked and inserted
+                                per statement
+      Returns:
+        A list of RegistrationResult in the order of records. If the
+        insert fails twice on emails registered concurrently, nothing is
+        inserted and the records that passed the checks are reported as
+        RETRY_EXHAUSTED.
+    """
+    records = list(records)
+    hashes = {}
+    for _ in range(2):
+        results, accepted = _check_registrations(records, chunk_size)
+        # end the read transaction before hashing, which takes seconds
+        # for a large batch; a retry reuses the hashes already made
+        db.session.commit()
+        new = [(email, password) for _, email, password in accepted
+               if (email, password) not in hashes]
+        if (new):
+            hashes.update(zip(new, hash_passwords(
+                [password for _, password in new])))
+        try:
+            _insert_users(accepted, hashes, chunk_size)
+            return results
+        except IntegrityError:
+            # an email was registered concurrently; the retry sees it
+            db.session.rollback()
+    return [RegistrationResult(result.email, False, RETRY_EXHAUSTED)
+            if result.success else result for result in results]
+
+
+def _check_registrations(records, chunk_size):
+    """
+    Validates the records of register_many, finding emails in use with
+    one query per chunk
+      Returns:
+        The RegistrationResult of every record, and the accepted records
+    """
+    results = []
+    accepted = []
+    seen = set()
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        used = {email for email, in db.session.query(User.email).filter(
+            User.email.in_({email for _, email, _ in chunk}))}
+        for user_name, email, password in chunk:
+            if (not valid_registration(user_name, email, password)):
+                results.append(RegistrationResult(email, False,
+                                                  INVALID_REGISTRATION))
+            elif (email in used or email in seen):
+                # R1-2, R1-7: emails are unique, within the batch too
+                results.append(RegistrationResult(email, False,
+                                                  EMAIL_IN_USE))
+            else:
+                seen.add(email)
+                accepted.append((user_name, email, password))
+                results.append(RegistrationResult(email, True, REGISTERED))
+    return results, accepted
+
+
+def _insert_users(accepted, hashes, chunk_size):
+    """
+    Inserts the accepted records of register_many chunk by chunk and
+    commits once at the end
+    """
+    for start in range(0, len(accepted), chunk_size):
+        db.session.execute(User.__table__.insert(), [
+            _new_user(user_name, email, hashes[(email, password)])
+            for user_name, email, password in
+            accepted[start:start + chunk_size]])
     db.session.commit()
+    lookups.forget("user")
 
+
+def update_profile(email, **fields):
+    """
+    Updates any of a user's user_name, shipping_address and postal_code.
+    Every field is validated first, then all are written with one UPDATE.
+      Parameters:
+        email (string):     user email
+        fields (string):    new values, keyed by field name
+      Returns:
+        True if the profile was updated, False if a field is invalid or
+        the user does not exist
+    """
+    # R3-1: A user is only able to update their user name, shipping
+    # address, and postal code.
+    if (not fields):
+        return False
+    for field, value in fields.items():
+        if (field not in PROFILE_RULES or
+                not PROFILE_RULES[field](**{field: value})):
+            return False
+
+    updated = db.session.query(User).filter_by(email=email).update(fields)
+    if (updated == 0):
+        return False
+    db.session.commit()
+    authenticated_users.bump(email)
     return True
 
 
 def update_shipping_address(email, new_shipping_address):
     """
-    Register a new user
+    Updates a user's shipping address
       Parameters:
         email (string):                 user email
         new_shipping_address (string):  new shipping address
@@ -214,33 +484,14 @@ def update_shipping_address(email, new_shipping_address):
         True if new_shipping_address was sucessfully updated,
         otherwise False
     """
-
-    """
-    R3-2: Shipping_address should be non-empty,
-    alphanumeric-only, and no special characters.
-    """
-    # not empty
-    if len(new_shipping_address) > 0:
-        for x in range(0, len(new_shipping_address)):
-            # alpha numeric-only
-            if (not new_shipping_address[x].isalnum()):
-                # spaces are allowed
-                if (new_shipping_address[x] != " "):
-                    return False
-        person_update = db.session.query(User).filter_by(email=email).first()
-        if person_update is not None:
-            person_update.shipping_address = new_shipping_address
-            db.session.commit()
-            return True
-        else:
-            return False
-    else:
-        return False
+    # R3-2: Shipping_address should be non-empty,
+    # alphanumeric-only, and no special characters.
+    return update_profile(email, shipping_address=new_shipping_address)
 
 
 def update_postal_code(email, new_postal_code):
     """
-    Register a new user
+    Updates a user's postal code
       Parameters:
         email (string):             user email
         new_postal_code (string):   new postal code
@@ -248,34 +499,13 @@ def update_postal_code(email, new_postal_code):
         True if new_postal_code was sucessfully updated,
         otherwise False
     """
-
     # R3-3: Postal code has to be a valid Canadian postal code.
-    # not empty
-    if len(new_postal_code) == 7:
-        for x in range(0, len(new_postal_code)):
-            # alternate number and letter, one space in the middle
-            if (x == 0 or x == 2 or x == 5):
-                if (not new_postal_code[x].isalpha()):
-                    return False
-            elif (x == 3 and new_postal_code[x] != " "):
-                return False
-            elif (x == 1 or x == 4 or x == 6):
-                if (not new_postal_code[x].isdecimal()):
-                    return False
-        person_update = db.session.query(User).filter_by(email=email).first()
-        if person_update is not None:
-            person_update.postal_code = new_postal_code
-            db.session.commit()
-            return True
-        else:
-            return False
-    else:
-        return False
+    return update_profile(email, postal_code=new_postal_code)
 
 
 def update_user_name(email, new_user_name):
     """
-    Register a new user
+    Updates a user's user name
       Parameters:
         email (string):         user email
         new_user_name (string):  new username
@@ -283,33 +513,62 @@ def update_user_name(email, new_user_name):
         True if new_user_name was sucessfully updated,
         otherwise False
     """
-
     # R3-4: User name follows the requirements above.
-    # username greater than 2 and less than 20
-    if (len(new_user_name) > 2 and len(new_user_name) < 20):
-        for x in range(0, len(new_user_name)):
-            if (not new_user_name[x].isalnum()):
-                # prefix or suffix spaces are not allowed
-                if (new_user_name[x] == " " and
-                        (x == 0 or x == (len(new_user_name) - 1))):
-                    return False
-                # no special characters allowed
-                elif (new_user_name[x] != " "):
-                    return False
-        person_update = db.session.query(User).filter_by(email=email).first()
-        if person_update is not None:
-            person_update.user_name = new_user_name
-            db.session.commit()
-            return True
-        else:
-            return False
-    else:
-        return False
+    return update_profile(email, user_name=new_user_name)
 
 
 def decrease_balance(email, balance_loss):
-    get_user(email).balance = get_user(email).balance - balance_loss
+    """
+    Decreases the balance of a given user
+      Parameters:
+        email (string):         user email
+        balance_loss (int):     amount to remove from the balance
+    """
+    adjust_balance(email, -balance_loss, floor=None)
 
 
 def increase_balance(email, balance_gain):
-    get_user(email).balance = get_user(email).balance + balance_gain
+    """
+    Increases the balance of a given user
+      Parameters:
+        email (string):         user email
+        balance_gain (int):     amount to add to the balance
+    """
+    adjust_balance(email, balance_gain, floor=None)
+
+
+def adjust_balance(user, delta, floor=0):
+    """
+    Adds to or removes from a user's balance with a single conditional
+    statement
+      Parameters:
+        user (int or string):   id or email of the user
+        delta (int):            amount added to the balance (negative to
+                                remove)
+        floor (int):            lowest balance the adjustment may leave,
+                                None for no limit
+      Returns:
+        True if the balance was adjusted, otherwise False
+    """
+    if (not ledger.post(user, delta, floor)):
+        return False
+    db.session.commit()
+    return True
+
+
+def adjust_balances(adjustments, floor=0):
+    """
+    Applies many balance adjustments with one statement. Either every
+    adjustment is applied or none is.
+      Parameters:
+        adjustments (list):     (user id or email, delta) pairs
+        floor (int):            lowest balance any adjustment may leave,
+                                None for no limit
+      Returns:
+        True if every balance was adjusted, otherwise False
+    """
+    if (ledger.post_many(adjustments, floor) != len(adjustments)):
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return True
@@ -0,0 +1,115 @@
+"""
+File contains a small rule engine used to validate user and product
+information. Each requirement (R1-x, R4-x) is a Rule tagged with its
+cost, and a Validator runs its rules cheapest first, so invalid input is
+rejected before any rule that queries the database.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+# rule costs, a Validator runs cheaper rules first
+CHEAP = 0       # length and range checks
+PATTERN = 1     # precompiled regular expressions
+DATABASE = 2    # rules that query the database
+
+RuleStats = namedtuple("RuleStats", ["calls", "failures", "seconds"])
+
+# rule name -> [calls, failures, seconds]
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class Rule:
+    """A single requirement
+
+    Keyword arguments:
+    name -- the requirement it checks, e.g. "R1-3"
+    check -- function of the validated values (a dict) returning a truthy
+             value if the requirement is met
+    cost -- CHEAP, PATTERN or DATABASE
+    """
+
+    def __init__(self, name, check, cost=CHEAP):
+        self.name = name
+        self.check = check
+        self.cost = cost
+
+    def __repr__(self):
+        return '<Rule %r>' % self.name
+
+
+class Validator:
+    """Runs a set of rules cheapest first, stopping at the first failure
+
+    Keyword arguments:
+    rules -- Rule objects, or Validators whose rules are included
+    """
+
+    def __init__(self, *rules):
+        unique = []
+        for rule in rules:
+            for item in (rule.rules if isinstance(rule, Validator)
+                         else [rule]):
+                if (item not in unique):
+                    unique.append(item)
+        # sorted is stable, so rules of the same cost keep their order
+        self.rules = sorted(unique, key=lambda rule: rule.cost)
+
+    def failed_rule(self, **values):
+        """
+        Validates the given values
+          Returns:
+            The name of the first rule that failed, or None if every rule
+            passed
+        """
+        timings = []
+        failed = None
+        for rule in self.rules:
+            start = time.perf_counter()
+            passed = rule.check(values)
+            timings.append((rule.name, time.perf_counter() - start))
+            if (not passed):
+                failed = rule.name
+                break
+        _record(timings, failed)
+        return failed
+
+    def __call__(self, **values):
+        """
+        Returns True if every rule passes for the given values
+        """
+        return self.failed_rule(**values) is None
+
+
+def _record(timings, failed):
+    """
+    Adds the timings of one validation to the per-rule counters
+    """
+    with _stats_lock:
+        for name, seconds in timings:
+            counters = _stats.setdefault(name, [0, 0, 0.0])
+            counters[0] += 1
+            counters[2] += seconds
+        if (failed is not None):
+            _stats[failed][1] += 1
+
+
+def rule_stats():
+    """
+    Returns the timing counters of every rule run so far
+      Returns:
+        A dict of rule name -> RuleStats(calls, failures, seconds)
+    """
+    with _stats_lock:
+        return {name: RuleStats(*counters)
+                for name, counters in _stats.items()}
+
+
+def reset_rule_stats():
+    """
+    Clears the timing counters of every rule
+    """
+    with _stats_lock:
+        _stats.clear()
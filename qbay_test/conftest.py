@@ -13,8 +13,10 @@ This file defines what to do BEFORE running any test cases:
 def pytest_sessionstart():
     """
     Delete database file if existed. So testing can start fresh.
+    Then create the schema.
     """
-    pass
+    from qbay.migrations import migrate
+    migrate()
 
 
 def pytest_sessionfinish():
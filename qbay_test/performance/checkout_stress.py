@@ -0,0 +1,244 @@
+"""
+Concurrency stress benchmark for checkout.
+
+Seeds one seller, one product with a fixed stock and one buyer per
+worker, then fires orders for that product from many threads (or
+processes) at once. Reports throughput, latency percentiles and checks
+that stock was never oversold and that money was neither created nor
+destroyed.
+
+Run from the repository root:
+    python -m qbay_test.performance.checkout_stress --workers 16
+"""
+
+import argparse
+import datetime
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from qbay import app, db
+from qbay.migrations import migrate
+from qbay import controllers  # noqa: F401 (registers the routes)
+from qbay.models import Product, Transaction
+from qbay.transactions import place_order, start_flash_sale, stop_flash_sale
+from qbay.users import get_balance, increase_balance, register
+
+PASSWORD = "Stress123!"
+PRICE = 1000
+
+
+def seed(workers, stock, budget=PRICE):
+    """
+    Creates the seller, the contended product and one buyer per worker
+      Parameters:
+        workers (int):  number of buyers to create
+        stock (int):    starting quantity of the product
+        budget (int):   balance given to each buyer
+      Returns:
+        A dictionary with the seller email, buyer emails and product
+    """
+    run_id = uuid.uuid4().hex[:8]
+    seller = "seller{}@stress.test".format(run_id)
+    register("Stress Seller", seller, PASSWORD)
+    buyers = []
+    for i in range(workers):
+        buyer = "buyer{}x{}@stress.test".format(i, run_id)
+        register("Stress Buyer", buyer, PASSWORD)
+        increase_balance(buyer, max(budget - get_balance(buyer), 0))
+        buyers.append(buyer)
+
+    # Inserted directly so the benchmark does not depend on R4-6 dates
+    product = Product(title="Stress Product {}".format(run_id),
+                      description="A product used for checkout stress tests",
+                      price=PRICE, last_modified_date=datetime.datetime.now(),
+                      owner_email=seller, quantity=stock)
+    db.session.add(product)
+    db.session.commit()
+    return {"seller": seller, "buyers": buyers, "title": product.title,
+            "product_id": product.id, "stock": stock}
+
+
+def _order_engine(title, buyer, seller, quantity):
+    """
+    Places one order through the order engine
+      Returns:
+        True if the order was placed, otherwise False
+    """
+    return place_order(title, quantity, buyer, seller).success
+
+
+def _order_http(client, title, buyer, seller, quantity):
+    """
+    Places one order through the /shop and /checkout routes
+      Returns:
+        True if the order was placed, otherwise False
+    """
+    client.post("/shop", data={"product_title": title})
+    response = client.post("/checkout", data={"quantity": str(quantity)})
+    if response.status_code not in (200, 302):
+        raise RuntimeError("checkout returned {}".format(
+            response.status_code))
+    # a successful checkout redirects back to the shop
+    return response.status_code == 302
+
+
+def _worker(job):
+    """
+    Places a series of orders for one buyer
+      Parameters:
+        job (tuple): (title, buyer, seller, orders, quantity, via)
+      Returns:
+        A list of (outcome, latency in seconds) pairs where outcome is
+        "placed", "refused" or "error"
+    """
+    title, buyer, seller, orders, quantity, via = job
+    client = None
+    if via == "http":
+        client = app.test_client()
+        client.post("/login", data={"email": buyer, "password": PASSWORD})
+
+    samples = []
+    for _ in range(orders):
+        start = time.perf_counter()
+        try:
+            if via == "http":
+                placed = _order_http(client, title, buyer, seller, quantity)
+            else:
+                placed = _order_engine(title, buyer, seller, quantity)
+            outcome = "placed" if placed else "refused"
+        except Exception:
+            db.session.rollback()
+            outcome = "error"
+        samples.append((outcome, time.perf_counter() - start))
+    db.session.remove()
+    return samples
+
+
+def _reset_connections():
+    """
+    Gives a forked worker process its own database connections
+    """
+    db.session.remove()
+    db.engine.dispose()
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of a list of numbers
+      Parameters:
+        values (list):      the samples
+        fraction (float):   the percentile as a fraction, e.g. 0.95
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def run_checkout_stress(workers=8, orders_per_worker=10, stock=50,
+                        quantity=1, mode="thread", via="engine",
+                        flash=False):
+    """
+    Runs the checkout stress benchmark
+      Parameters:
+        workers (int):              concurrent buyers
+        orders_per_worker (int):    orders each buyer attempts
+        stock (int):                starting quantity of the product
+        quantity (int):             quantity requested per order
+        mode (string):              "thread" or "process" workers
+        via (string):               "engine" to call place_order directly,
+                                    "http" to go through /checkout
+        flash (bool):               run the product in flash-sale mode
+                                    (thread workers only)
+      Returns:
+        A dictionary with throughput, latency and invariant results
+    """
+    # every buyer can afford all of their orders, so only stock limits sales
+    fixture = seed(workers, stock,
+                   budget=PRICE * quantity * orders_per_worker)
+    accounts = fixture["buyers"] + [fixture["seller"]]
+    balance_before = sum(get_balance(email) for email in accounts)
+    if flash:
+        start_flash_sale(fixture["title"], fixture["seller"])
+    db.session.remove()
+
+    jobs = [(fixture["title"], buyer, fixture["seller"], orders_per_worker,
+             quantity, via) for buyer in fixture["buyers"]]
+    if mode == "process":
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_reset_connections,
+            mp_context=multiprocessing.get_context("fork"))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    start = time.perf_counter()
+    with executor:
+        results = list(executor.map(_worker, jobs))
+    elapsed = time.perf_counter() - start
+    if flash:
+        stop_flash_sale(fixture["title"], fixture["seller"])
+
+    samples = [sample for result in results for sample in result]
+    latencies = [latency for _, latency in samples]
+    placed = sum(1 for outcome, _ in samples if outcome == "placed")
+
+    sold = db.session.query(db.func.coalesce(
+        db.func.sum(Transaction.quantity), 0)).filter_by(
+        product_id=fixture["product_id"]).scalar()
+    remaining = db.session.query(Product.quantity).filter_by(
+        id=fixture["product_id"]).scalar()
+    balance_after = sum(get_balance(email) for email in accounts)
+
+    return {
+        "workers": workers,
+        "mode": mode,
+        "via": via,
+        "flash": flash,
+        "attempts": len(samples),
+        "placed": placed,
+        "refused": sum(1 for outcome, _ in samples if outcome == "refused"),
+        "errors": sum(1 for outcome, _ in samples if outcome == "error"),
+        "elapsed": elapsed,
+        "orders_per_sec": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "stock": stock,
+        "sold": sold,
+        "remaining": remaining,
+        "no_oversell": sold <= stock and remaining == stock - sold,
+        "sales_recorded": sold == placed * quantity,
+        "balance_conserved": balance_before == balance_after,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--orders", type=int, default=10,
+                        help="orders attempted by each worker")
+    parser.add_argument("--stock", type=int, default=50)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--mode", choices=["thread", "process"],
+                        default="thread")
+    parser.add_argument("--via", choices=["engine", "http"],
+                        default="engine")
+    parser.add_argument("--flash", action="store_true",
+                        help="run the product in flash-sale mode")
+    args = parser.parse_args()
+    migrate()
+
+    report = run_checkout_stress(args.workers, args.orders, args.stock,
+                                 args.quantity, args.mode, args.via,
+                                 args.flash)
+    for key, value in report.items():
+        if isinstance(value, float):
+            value = "{:.2f}".format(value)
+        print("{:<18} {}".format(key, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Fuzzy search benchmark for the trigram index of product titles.
+
+Builds a TrigramIndex of generated product titles, then searches for
+randomly chosen titles with a typo in every word. Reports the memory the
+index takes, search latency percentiles, and how often the title meant
+is among the first ten results, which shows how the index scales with
+the size of the catalog.
+
+Run from the repository root:
+    python -m qbay_test.performance.fuzzy_search_benchmark --titles 100000
+"""
+
+import argparse
+import random
+import string
+import time
+
+from qbay import app
+from qbay.trigrams import TrigramIndex
+from qbay_test.performance.checkout_stress import percentile
+from qbay_test.performance.suggest_benchmark import WORDS
+
+
+def _titles(count, rng):
+    """
+    Returns count generated product titles, each with a made up brand
+    """
+    return ["{} {} {}".format(rng.choice(WORDS), rng.choice(WORDS),
+                              "".join(rng.choice(string.ascii_lowercase)
+                                      for _ in range(rng.randint(5, 8))))
+            for _ in range(count)]
+
+
+def _misspell(title, rng):
+    """
+    Returns a title with one letter dropped, doubled or swapped in each
+    word
+    """
+    words = []
+    for word in title.split():
+        i = rng.randrange(len(word) - 1)
+        typo = rng.choice(["drop", "double", "swap"])
+        if (typo == "drop"):
+            word = word[:i] + word[i + 1:]
+        elif (typo == "double"):
+            word = word[:i] + word[i] + word[i:]
+        else:
+            word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+        words.append(word)
+    return " ".join(words)
+
+
+def run_fuzzy_search_benchmark(titles=100000, searches=500, seed=1):
+    """
+    Runs the fuzzy search benchmark
+      Parameters:
+        titles (int):   product titles indexed
+        searches (int): misspelled searches timed
+        seed (int):     seed for the generated titles and typos
+      Returns:
+        A dictionary of results
+    """
+    rng = random.Random(seed)
+    index = TrigramIndex(app.config['FUZZY_SEARCH_THRESHOLD'],
+                         app.config['FUZZY_SEARCH_MAX_CANDIDATES'])
+    generated = _titles(titles, rng)
+
+    start = time.perf_counter()
+    index.load(enumerate(generated, start=1))
+    build = time.perf_counter() - start
+    stats = index.stats()
+
+    latencies = []
+    found = 0
+    for product_id in rng.choices(range(1, titles + 1), k=searches):
+        search = _misspell(generated[product_id - 1], rng)
+        start = time.perf_counter()
+        results = index.search(search, app.config['FUZZY_SEARCH_RESULTS'])
+        latencies.append(time.perf_counter() - start)
+        found += product_id in [result for result, _ in results[:10]]
+
+    return {
+        "titles": stats.titles,
+        "megabytes": stats.bytes / 2 ** 20,
+        "build_ms": build * 1000,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "found_in_top_10": found / searches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--titles", type=int, nargs="+",
+                        default=[10000, 100000, 500000],
+                        help="catalog sizes to measure")
+    parser.add_argument("--searches", type=int, default=500,
+                        help="searches timed per catalog size")
+    args = parser.parse_args()
+
+    print("{:>8} {:>8} {:>9} {:>8} {:>8} {:>8} {:>10}".format(
+        "titles", "MiB", "build_ms", "p50_ms", "p99_ms", "max_ms",
+        "top_10"))
+    for titles in args.titles:
+        report = run_fuzzy_search_benchmark(titles, args.searches)
+        print("{titles:>8} {megabytes:>8.1f} {build_ms:>9.1f} "
+              "{p50_ms:>8.2f} {p99_ms:>8.2f} {max_ms:>8.2f} "
+              "{found_in_top_10:>10.2f}".format(**report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Login throughput benchmark for password hashing costs.
+
+For each PBKDF2 iteration count, registers one user per worker with that
+cost and has every worker log in repeatedly from its own thread.
+Reports logins per second and latency percentiles, which shows what a
+cost setting does to login capacity with the configured hashing pool.
+
+Run from the repository root:
+    python -m qbay_test.performance.login_benchmark --costs 100000 260000
+"""
+
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from qbay import app, db
+from qbay.migrations import migrate
+from qbay.users import login, register
+from qbay_test.performance.checkout_stress import percentile
+
+PASSWORD = "Bench123!"
+
+
+def _worker(job):
+    """
+    Logs one user in repeatedly, returning (succeeded, seconds) samples
+    """
+    email, logins = job
+    samples = []
+    try:
+        for _ in range(logins):
+            start = time.perf_counter()
+            user = login(email, PASSWORD)
+            samples.append((user is not None, time.perf_counter() - start))
+    finally:
+        db.session.remove()
+    return samples
+
+
+def run_login_benchmark(costs=(100000, 260000), workers=4, logins=5):
+    """
+    Runs the login benchmark
+      Parameters:
+        costs (list):       PBKDF2 iteration counts to measure
+        workers (int):      concurrent threads logging in
+        logins (int):       logins each thread performs per cost
+      Returns:
+        A list with one dictionary of results per cost
+    """
+    configured = app.config['PASSWORD_HASH_ITERATIONS']
+    reports = []
+    try:
+        for cost in costs:
+            # users are hashed at this cost, so logins do not rehash
+            app.config['PASSWORD_HASH_ITERATIONS'] = cost
+            run_id = uuid.uuid4().hex[:8]
+            emails = ["login{}x{}@bench.test".format(i, run_id)
+                      for i in range(workers)]
+            for email in emails:
+                register("Bench User", email, PASSWORD)
+            db.session.remove()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(
+                    _worker, [(email, logins) for email in emails]))
+            elapsed = time.perf_counter() - start
+
+            samples = [sample for result in results for sample in result]
+            latencies = [latency for _, latency in samples]
+            reports.append({
+                "cost": cost,
+                "workers": workers,
+                "logins": len(samples),
+                "failed": sum(1 for ok, _ in samples if not ok),
+                "elapsed": elapsed,
+                "logins_per_sec": len(samples) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+            })
+    finally:
+        app.config['PASSWORD_HASH_ITERATIONS'] = configured
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--costs", type=int, nargs="+",
+                        default=[10000, 100000, 260000, 600000],
+                        help="PBKDF2 iteration counts to measure")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--logins", type=int, default=10,
+                        help="logins performed by each worker per cost")
+    args = parser.parse_args()
+    migrate()
+
+    reports = run_login_benchmark(args.costs, args.workers, args.logins)
+    print("{:>8} {:>8} {:>8} {:>14} {:>10} {:>10}".format(
+        "cost", "logins", "failed", "logins_per_sec", "p50_ms", "p95_ms"))
+    for report in reports:
+        print("{cost:>8} {logins:>8} {failed:>8} {logins_per_sec:>14.1f} "
+              "{p50_ms:>10.1f} {p95_ms:>10.1f}".format(**report))
+
+
+if __name__ == "__main__":
+    main()
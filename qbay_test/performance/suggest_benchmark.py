@@ -0,0 +1,112 @@
+"""
+Title suggestion benchmark for the search-as-you-type endpoint.
+
+Fills a TitleSuggestions with generated product titles, then times
+suggestions for random prefixes both on the structure itself and
+through the /api/products/suggest view. Reports the memory the titles
+take and latency percentiles, which shows how the in-memory list scales
+with the size of the catalog.
+
+Run from the repository root:
+    python -m qbay_test.performance.suggest_benchmark --titles 100000
+"""
+
+import argparse
+import random
+import time
+
+from qbay import app
+from qbay.suggestions import TitleSuggestions
+from qbay_test.performance.checkout_stress import percentile
+
+WORDS = ["Oak", "Walnut", "Maple", "Pine", "Lamp", "Desk", "Chair",
+         "Table", "Stool", "Shelf", "Cabinet", "Mirror", "Vintage",
+         "Modern", "Rustic", "Large", "Small", "Folding", "Corner", "Red"]
+
+
+def _titles(count, rng):
+    """
+    Returns count distinct generated product titles
+    """
+    return ["{} {} {} {}".format(rng.choice(WORDS), rng.choice(WORDS),
+                                 rng.choice(WORDS), number)
+            for number in range(count)]
+
+
+def run_suggest_benchmark(titles=100000, lookups=2000, seed=1):
+    """
+    Runs the suggestion benchmark
+      Parameters:
+        titles (int):   product titles held
+        lookups (int):  suggestions timed on each path
+        seed (int):     seed for the generated titles and prefixes
+      Returns:
+        A dictionary of results
+    """
+    from qbay import controllers
+
+    rng = random.Random(seed)
+    suggestions = TitleSuggestions(app.config['SUGGESTION_LIMIT'])
+    generated = _titles(titles, rng)
+
+    start = time.perf_counter()
+    suggestions.load(generated)
+    build = time.perf_counter() - start
+    stats = suggestions.stats()
+
+    prefixes = [title[:rng.randint(1, 12)] for title in
+                rng.choices(generated, k=lookups)]
+    direct = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        suggestions.suggest(prefix)
+        direct.append(time.perf_counter() - start)
+
+    # time the view alone, as the server runs it, over the generated
+    # titles
+    endpoint = []
+    original = controllers.product_suggestions
+    controllers.product_suggestions = suggestions
+    try:
+        for prefix in prefixes:
+            with app.test_request_context('/api/products/suggest',
+                                          query_string={"prefix": prefix}):
+                start = time.perf_counter()
+                controllers.suggest_api_get()
+                endpoint.append(time.perf_counter() - start)
+    finally:
+        controllers.product_suggestions = original
+
+    return {
+        "titles": stats.titles,
+        "megabytes": stats.bytes / 2 ** 20,
+        "build_ms": build * 1000,
+        "direct_p50_us": percentile(direct, 0.50) * 1e6,
+        "direct_p99_us": percentile(direct, 0.99) * 1e6,
+        "endpoint_p50_us": percentile(endpoint, 0.50) * 1e6,
+        "endpoint_p99_us": percentile(endpoint, 0.99) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--titles", type=int, nargs="+",
+                        default=[10000, 100000, 1000000],
+                        help="catalog sizes to measure")
+    parser.add_argument("--lookups", type=int, default=2000,
+                        help="suggestions timed per catalog size")
+    args = parser.parse_args()
+
+    print("{:>8} {:>8} {:>9} {:>10} {:>10} {:>12} {:>12}".format(
+        "titles", "MiB", "build_ms", "p50_us", "p99_us", "view_p50_us",
+        "view_p99_us"))
+    for titles in args.titles:
+        report = run_suggest_benchmark(titles, args.lookups)
+        print("{titles:>8} {megabytes:>8.1f} {build_ms:>9.1f} "
+              "{direct_p50_us:>10.1f} {direct_p99_us:>10.1f} "
+              "{endpoint_p50_us:>12.1f} {endpoint_p99_us:>12.1f}".format(
+                  **report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Regression gate for concurrent checkout
+"""
+
+from qbay_test.performance.checkout_stress import run_checkout_stress
+
+
+def test_concurrent_orders_never_oversell():
+    """
+    More orders than stock are fired concurrently; exactly the stock is
+    sold and balances are conserved.
+    """
+    report = run_checkout_stress(workers=8, orders_per_worker=5, stock=20)
+
+    assert report["errors"] == 0
+    assert report["placed"] == 20
+    assert report["refused"] == 20
+    assert report["no_oversell"] is True
+    assert report["sales_recorded"] is True
+    assert report["balance_conserved"] is True
+
+
+def test_concurrent_checkout_route():
+    """
+    The same invariants hold when orders go through /checkout.
+    """
+    report = run_checkout_stress(workers=4, orders_per_worker=3, stock=6,
+                                 via="http")
+
+    assert report["errors"] == 0
+    assert report["placed"] == 6
+    assert report["no_oversell"] is True
+    assert report["balance_conserved"] is True
+
+
+def test_flash_sale_never_oversells():
+    """
+    The invariants hold when the product is in flash-sale mode.
+    """
+    report = run_checkout_stress(workers=8, orders_per_worker=5, stock=20,
+                                 flash=True)
+
+    assert report["errors"] == 0
+    assert report["placed"] == 20
+    assert report["no_oversell"] is True
+    assert report["sales_recorded"] is True
+    assert report["balance_conserved"] is True
@@ -0,0 +1,18 @@
+"""
+Smoke test for the fuzzy search benchmark
+"""
+
+from qbay_test.performance.fuzzy_search_benchmark import (
+    run_fuzzy_search_benchmark)
+
+
+def test_fuzzy_search_benchmark_finds_misspelled_titles():
+    """
+    A small benchmark run indexes every title and finds most misspelled
+    ones.
+    """
+    report = run_fuzzy_search_benchmark(titles=1000, searches=50)
+
+    assert report["titles"] == 1000
+    assert report["megabytes"] > 0
+    assert report["found_in_top_10"] >= 0.9
@@ -0,0 +1,16 @@
+"""
+Smoke test for the login benchmark
+"""
+
+from qbay_test.performance.login_benchmark import run_login_benchmark
+
+
+def test_login_benchmark_reports_each_cost():
+    """
+    Every login of a small benchmark run succeeds at each cost.
+    """
+    reports = run_login_benchmark(costs=(1000, 2000), workers=2, logins=2)
+
+    assert [report["cost"] for report in reports] == [1000, 2000]
+    assert all(report["failed"] == 0 for report in reports)
+    assert all(report["logins"] == 4 for report in reports)
@@ -0,0 +1,17 @@
+"""
+Smoke test for the suggestion benchmark
+"""
+
+from qbay_test.performance.suggest_benchmark import run_suggest_benchmark
+
+
+def test_suggest_benchmark_reports_memory_and_latency():
+    """
+    A small benchmark run holds every title and times every lookup.
+    """
+    report = run_suggest_benchmark(titles=1000, lookups=50)
+
+    assert report["titles"] == 1000
+    assert report["megabytes"] > 0
+    assert report["direct_p50_us"] > 0
+    assert report["endpoint_p50_us"] > 0
@@ -0,0 +1,80 @@
+"""
+Testing file for cart.py
+"""
+
+from qbay.cart import add_to_cart, get_cart, remove_from_cart
+from qbay.transactions import (order_cart, EMPTY_CART, INSUFFICIENT_BALANCE,
+                               INSUFFICIENT_STOCK)
+from qbay.users import get_balance, register, decrease_balance
+from qbay.products import create_product, get_product
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+seller = "cart_seller@queensu.ca"
+other_seller = "cart_seller2@queensu.ca"
+buyer = "cart_buyer@queensu.ca"
+
+
+def test_cart_lines():
+    """
+    Testing that products can be added to and removed from the cart.
+    """
+    register("Cart Seller", seller, "CartSell1!")
+    register("Cart Buyer", buyer, "CartBuy1!")
+    create_product("Cart Mug", valid_description, 1000, seller, quantity=5)
+    mug = get_product("Cart Mug", seller)
+
+    assert add_to_cart(buyer, mug.id) is True
+    assert add_to_cart(buyer, mug.id, 2) is True
+    assert add_to_cart(buyer, mug.id, 0) is False
+    assert add_to_cart(buyer, 123456789) is False
+    # Requirement: A user cannot place an order for their own products.
+    assert add_to_cart(seller, mug.id) is False
+
+    assert [(p.title, q) for p, q in get_cart(buyer)] == [("Cart Mug", 3)]
+    assert remove_from_cart(buyer, mug.id) is True
+    assert remove_from_cart(buyer, mug.id) is False
+    assert get_cart(buyer) == []
+
+
+def test_order_cart():
+    """
+    Testing that a cart with products from several sellers is purchased
+    as a whole, or not at all.
+    """
+    register("Other Seller", other_seller, "CartSell2!")
+    create_product("Cart Plate", valid_description, 2000, seller, quantity=2)
+    create_product("Cart Bowl", valid_description, 1500, other_seller,
+                   quantity=4)
+    plate = get_product("Cart Plate", seller)
+    bowl = get_product("Cart Bowl", other_seller)
+
+    assert order_cart(buyer).reason == EMPTY_CART
+
+    add_to_cart(buyer, plate.id, 3)
+    add_to_cart(buyer, bowl.id, 2)
+    result = order_cart(buyer)
+    assert result.success is False
+    assert result.reason == INSUFFICIENT_STOCK
+    assert get_product("Cart Bowl", other_seller).quantity == 4
+
+    remove_from_cart(buyer, plate.id)
+    add_to_cart(buyer, plate.id, 2)
+    decrease_balance(buyer, get_balance(buyer) - 6999)
+    assert order_cart(buyer).reason == INSUFFICIENT_BALANCE
+    assert get_balance(buyer) == 6999
+
+    buyer_balance = get_balance(buyer) + 1
+    decrease_balance(buyer, -1)
+    seller_balance = get_balance(seller)
+    other_balance = get_balance(other_seller)
+    result = order_cart(buyer)
+    assert result.success is True
+    assert result.total_price == 7000
+    assert len(result.transaction_ids) == 2
+    assert get_balance(buyer) == buyer_balance - 7000
+    assert get_balance(seller) == seller_balance + 4000
+    assert get_balance(other_seller) == other_balance + 3000
+    assert get_product("Cart Plate", seller).quantity == 0
+    assert get_product("Cart Bowl", other_seller).quantity == 2
+    assert get_cart(buyer) == []
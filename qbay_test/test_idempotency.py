@@ -0,0 +1,97 @@
+"""
+Testing file for idempotency.py
+"""
+
+from qbay import app, db
+from qbay.idempotency import IdempotencyStore
+from qbay.models import Product, Transaction
+from qbay.products import create_product, get_product
+from qbay.users import register
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+seller = "replay_seller@queensu.ca"
+buyer = "replay_buyer@queensu.ca"
+password = "Repl@y123"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_store_replays_and_expires():
+    """
+    Testing that a finished key is replayed until its TTL runs out.
+    """
+    clock = FakeClock()
+    store = IdempotencyStore(ttl=10, clock=clock)
+
+    assert store.begin("a") is None
+    store.finish("a", "first")
+    assert store.wait(store.begin("a")) == "first"
+
+    clock.now = 11
+    assert store.begin("a") is None
+    assert len(store) == 1
+
+
+def test_store_bounds_and_abandon():
+    """
+    Testing that the oldest keys are dropped past max_keys and that an
+    abandoned key runs again.
+    """
+    store = IdempotencyStore(max_keys=2)
+    for key in ("a", "b", "c"):
+        assert store.begin(key) is None
+    assert len(store) == 2
+    assert store.begin("a") is None
+
+    store.abandon("b")
+    assert store.begin("b") is None
+
+
+def test_checkout_replay():
+    """
+    Testing that replaying a checkout with the same key places only one
+    order.
+    """
+    register("Replay Seller", seller, password)
+    register("Replay Buyer", buyer, password)
+    create_product("Replay Kettle", valid_description, 1000, seller,
+                   quantity=5)
+    product_id = get_product("Replay Kettle", seller).id
+
+    client = app.test_client()
+    client.post("/login", data={"email": buyer, "password": password})
+    client.post("/shop", data={"product_title": "Replay Kettle"})
+    form = {"quantity": "1", "idempotency_key": "checkout-key"}
+    first = client.post("/checkout", data=form)
+    second = client.post("/checkout", data=form)
+    other = client.post("/checkout", headers={"Idempotency-Key": "other"},
+                        data={"quantity": "1"})
+
+    assert first.status_code == second.status_code == 302
+    assert other.status_code == 302
+    assert db.session.query(Transaction).filter_by(
+        product_id=product_id).count() == 2
+
+
+def test_product_creation_replay():
+    """
+    Testing that replaying a product creation returns the first response
+    instead of failing on the duplicate title.
+    """
+    client = app.test_client()
+    client.post("/login", data={"email": seller, "password": password})
+    form = {"product-name": "Replay Teapot", "description": valid_description,
+            "price": "20", "quantity": "1", "idempotency_key": "create-key"}
+    first = client.post("/product-creation", data=form)
+    second = client.post("/product-creation", data=form)
+
+    assert first.status_code == second.status_code == 302
+    assert db.session.query(Product).filter_by(
+        title="Replay Teapot").count() == 1
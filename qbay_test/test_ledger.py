@@ -0,0 +1,109 @@
+"""
+Testing file for ledger.py
+"""
+
+from qbay import app, db
+from qbay import ledger
+from qbay.models import LedgerEntry, User
+from qbay.users import (get_balance, get_user_profile, get_userid,
+                        increase_balance, register)
+
+# Define any required variables for testing
+owner = "ledger_owner@queensu.ca"
+
+
+def test_movements_are_appended():
+    """
+    Testing that balance movements insert ledger entries and leave the
+    User row untouched.
+    """
+    register("Ledger Owner", owner, "L3dger!!")
+    user_id = get_userid(owner)
+
+    increase_balance(owner, 500)
+    assert ledger.post(user_id, -10600, floor=0) is False
+    assert ledger.post(user_id, -10500, floor=0) is True
+    db.session.commit()
+
+    assert get_balance(owner) == 0
+    assert db.session.query(User.balance).filter_by(
+        id=user_id).scalar() == 10000
+    assert db.session.query(LedgerEntry).filter_by(
+        user_id=user_id).count() == 2
+
+
+def test_compaction():
+    """
+    Testing that compaction folds the tail into the snapshot without
+    changing the balance, and that long tails found by reads are
+    compacted after the read, not during it.
+    """
+    user_id = get_userid(owner)
+    assert ledger.compact(user_id) == 2
+    assert ledger.compact(user_id) == 0
+    assert get_balance(owner) == 0
+    assert db.session.query(User.balance).filter_by(
+        id=user_id).scalar() == 0
+
+    threshold = app.config['LEDGER_SNAPSHOT_EVERY']
+    ledger.post_many([(user_id, 1)] * threshold)
+    db.session.commit()
+
+    # the read leaves the caller's transaction alone
+    ledger.post(user_id, 1000)
+    assert get_balance(owner) == threshold + 1000
+    db.session.rollback()
+    assert get_balance(owner) == threshold
+    assert db.session.query(User.balance).filter_by(
+        id=user_id).scalar() == 0
+
+    assert ledger.compact_due() == threshold
+    assert ledger.compact_due() == 0
+    assert get_balance(owner) == threshold
+    assert db.session.query(User.balance).filter_by(
+        id=user_id).scalar() == threshold
+
+    increase_balance(owner, 5)
+    assert ledger.compact_all() >= 1
+    assert get_balance(owner) == threshold + 5
+
+
+def test_balances_read_each_users_own_snapshot():
+    """
+    Testing that balances computed per User row (profiles and floor
+    checks) use that user's snapshot when several users have one.
+    """
+    other = "ledger_other@queensu.ca"
+    register("Ledger Other", other, "L3dger!!")
+    other_id = get_userid(other)
+    increase_balance(other, 7)
+    assert ledger.compact(other_id) == 1
+    increase_balance(other, 11)
+
+    assert get_user_profile(other, ("balance",)).balance == 10018
+    assert ledger.post(other, -10019, floor=0) is False
+    assert ledger.post(other, -10018, floor=0) is True
+    db.session.commit()
+    assert get_balance(other) == 0
+
+
+def test_requests_compact_long_tails():
+    """
+    Testing that a long tail read while serving a request is compacted
+    once the request is done.
+    """
+    from qbay import controllers  # noqa: F401 (registers the routes)
+
+    user_id = get_userid(owner)
+    balance = get_balance(owner)
+    threshold = app.config['LEDGER_SNAPSHOT_EVERY']
+    ledger.post_many([(user_id, 1)] * threshold)
+    db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = owner
+    assert client.get('/shop').status_code == 200
+    assert db.session.query(User.balance).filter_by(
+        id=user_id).scalar() == balance + threshold
+    assert get_balance(owner) == balance + threshold
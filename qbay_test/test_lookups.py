@@ -0,0 +1,49 @@
+"""
+Testing file for lookups.py
+"""
+
+from qbay import app
+from qbay.lookups import lookup_stats
+from qbay.products import create_product, get_product, update_product_title
+from qbay.users import find_user, get_user, get_userid, register
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+owner = "lookups_owner@queensu.ca"
+
+
+def test_repeated_lookups_hit_the_cache():
+    """
+    Testing that lookups within a request are loaded once, and that
+    nothing is cached outside a request.
+    """
+    register("Lookups Owner", owner, "L00kups!")
+    create_product("Lookups Lamp", valid_description, 2000, owner)
+    assert lookup_stats() == (0, 0)
+
+    with app.test_request_context():
+        user = get_user(owner)
+        assert find_user(owner) is True
+        assert get_user(owner) is user
+        assert get_userid(owner) == user.id
+        product = get_product("Lookups Lamp", owner)
+        assert get_product("Lookups Lamp", owner) is product
+        assert lookup_stats() == (3, 3)
+
+    with app.test_request_context():
+        assert lookup_stats() == (0, 0)
+
+
+def test_writes_invalidate_lookups():
+    """
+    Testing that writes within a request drop the lookups they change.
+    """
+    with app.test_request_context():
+        assert find_user("lookups_new@queensu.ca") is False
+        register("Lookups New", "lookups_new@queensu.ca", "L00kups!")
+        assert find_user("lookups_new@queensu.ca") is True
+
+        assert get_product("Lookups Desk", owner) is None
+        assert update_product_title("Lookups Lamp", owner, "Lookups Desk")
+        assert get_product("Lookups Lamp", owner) is None
+        assert get_product("Lookups Desk", owner) is not None
@@ -0,0 +1,117 @@
+"""
+Testing file for migrations.py
+"""
+
+import datetime
+import pytest
+from sqlalchemy import event
+from qbay import app, db
+from qbay.migrations import (MIGRATIONS, MigrationError, current_version,
+                             migrate)
+from qbay.models import Product
+from qbay.products import create_product, get_product, valid_title
+from qbay.transactions import (get_order_history, get_sales_history,
+                               place_order)
+from qbay.users import get_balance, get_user, get_userid, login, register
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+seller = "migrations_seller@queensu.ca"
+buyer = "migrations_buyer@queensu.ca"
+password = "M1grate!"
+
+# scans that read a bounded part of a table or index
+BOUNDED_SCANS = {
+    # the unfiltered shop page reads the title index in order and stops
+    # once it has a page of products in stock (LIMIT)
+    "SCAN product USING INDEX uq_product_title",
+    # a MATCH on the search index (M2) reads only the postings of the
+    # words searched for
+    "SCAN product_fts VIRTUAL TABLE INDEX 0:M2",
+}
+
+
+def test_migrations_apply_once():
+    """
+    Testing that the test session migrated the database to the latest
+    version and that migrating again does nothing.
+    """
+    assert current_version() == MIGRATIONS[-1][0]
+    assert migrate() == []
+
+
+def test_hot_queries_use_indexes():
+    """
+    Testing that every hot query in users, products, transactions or the
+    controllers reads its tables through an index search, or one of the
+    bounded scans.
+    """
+    from qbay import controllers  # noqa: F401 (registers the routes)
+
+    register("Migrations Seller", seller, password)
+    register("Migrations Buyer", buyer, password)
+    create_product("Migrations Lamp", valid_description, 2000, seller, 5)
+
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, many):
+        if (statement.lstrip().upper().startswith("SELECT")):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", listener)
+    get_user(buyer)
+    get_userid(buyer)
+    get_balance(buyer)
+    login(buyer, password)
+    get_product("Migrations Lamp", seller)
+    valid_title("Migrations Desk", valid_description)
+    place_order("Migrations Lamp", 1, buyer, seller)
+    get_order_history(buyer)
+    get_sales_history(seller)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = buyer
+    client.get('/')
+    client.get('/shop')
+    client.get('/shop?q=lamp')
+    client.get('/shop?q=lmap&mode=fuzzy')
+    event.remove(db.engine, "before_cursor_execute", listener)
+
+    assert statements
+    with db.engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = [row[-1] for row in connection.exec_driver_sql(
+                "EXPLAIN QUERY PLAN " + statement, parameters)]
+            # every table must be read by an index SEARCH; a SCAN reads
+            # every row, or every entry of an index, unless it is one of
+            # the bounded scans listed
+            scans = [step for step in plan if step.startswith("SCAN") and
+                     step not in BOUNDED_SCANS]
+            assert scans == [], statement
+
+
+def test_unique_titles_migration_stops_on_duplicates():
+    """
+    Testing that the unique title migration names the duplicate titles
+    instead of failing partway through, and applies once they are gone.
+    """
+    unique_titles = dict((version, apply)
+                         for version, _, apply in MIGRATIONS)[5]
+    create_product("Migrations Twin", valid_description, 2000, seller)
+    db.session.execute(db.text("DROP INDEX uq_product_title"))
+    db.session.add(Product(title="Migrations Twin",
+                           description=valid_description, price=2000,
+                           last_modified_date=datetime.datetime.now(),
+                           owner_email=buyer, quantity=1))
+    db.session.commit()
+
+    with pytest.raises(MigrationError, match="'Migrations Twin'"):
+        unique_titles()
+
+    db.session.query(Product).filter_by(title="Migrations Twin",
+                                        owner_email=buyer).delete()
+    db.session.commit()
+    unique_titles()
+    indexes = db.inspect(db.engine).get_indexes("product")
+    assert any(index["name"] == "uq_product_title" and index["unique"]
+               for index in indexes)
@@ -0,0 +1,54 @@
+"""
+Testing file for passwords.py
+"""
+
+from qbay import app, db
+from qbay.models import User
+from qbay.passwords import hash_password, hash_passwords, verify_password
+from qbay.users import login, register
+
+
+def test_hash_and_verify():
+    """
+    Testing that hashes are salted, fit User.password and verify.
+    """
+    first = hash_password("Passw0rd!")
+    assert first != hash_password("Passw0rd!")
+    assert len(first) < 80
+    assert verify_password("Passw0rd!", first) == (True, False)
+    assert verify_password("passw0rd!", first) == (False, False)
+
+    cheap = hash_passwords(["Passw0rd!", "0ther!!A"], iterations=1000)
+    assert cheap[0].startswith("pbkdf2$1000$")
+    assert verify_password("0ther!!A", cheap[1]) == (True, True)
+
+
+def test_plain_text_rows_are_upgraded_on_login():
+    """
+    Testing that users stored before hashing can log in, and that their
+    password is hashed when they do.
+    """
+    db.session.add(User(email="plain@queensu.ca", user_name="Plain User",
+                        password="Pl4in!!", shipping_address="",
+                        postal_code="", balance=10000))
+    db.session.commit()
+    assert verify_password("Pl4in!!", "Pl4in!!") == (True, True)
+
+    assert login("plain@queensu.ca", "Pl4in!!") is not None
+    stored = db.session.query(User.password).filter_by(
+        email="plain@queensu.ca").scalar()
+    assert stored.startswith("pbkdf2${}$".format(
+        app.config['PASSWORD_HASH_ITERATIONS']))
+    assert login("plain@queensu.ca", "Pl4in!!") is not None
+    assert login("plain@queensu.ca", "Wr0ng!!") is None
+
+
+def test_register_stores_hash():
+    """
+    Testing that registration never stores the password itself.
+    """
+    register("Hashed User", "hashed@queensu.ca", "H4shed!!")
+    stored = db.session.query(User.password).filter_by(
+        email="hashed@queensu.ca").scalar()
+    assert stored != "H4shed!!"
+    assert login("hashed@queensu.ca", "H4shed!!") is not None
@@ -4,9 +4,13 @@ Testing file for products.py
 
 import datetime
 from qbay.users import find_user, register
-from qbay.products import (create_product, get_product,
+from sqlalchemy import event
+from qbay import db
+from qbay.products import (create_product, get_product, update_product,
                            update_product_description, update_product_price,
                            update_product_quantity, update_product_title)
+from qbay.products import (import_products, IMPORTED, INVALID_PRODUCT,
+                           TITLE_IN_USE, UNKNOWN_OWNER, UNREADABLE_ROW)
 # Define any required variables for testing
 valid_description = ("Lorem ipsum dolor sit amet, consectetur "
                      "adipiscing elit. Sed accumsan imperdiet "
@@ -219,3 +223,89 @@ def test_r5_4_product():
 
     assert update_product_quantity("R5", valid_email, -1) is False
     assert update_product_quantity("R5", valid_email, 0) is True
+
+
+def test_update_product():
+    """
+    Testing that update_product validates every change together and
+    writes them with one UPDATE and one commit.
+    """
+    assert create_product("Bulk Update", valid_description,
+                          valid_price, valid_email) is True
+    product_id = get_product("Bulk Update", valid_email).id
+
+    # one invalid change rejects them all
+    assert update_product(product_id, title="Bulk Renamed",
+                          price=valid_price - 100) is False
+    assert update_product(product_id, title="Bulk Renamed",
+                          owner_email="other@queensu.ca") is False
+    assert update_product(product_id, quantity=-1) is False
+    assert update_product(product_id) is False
+    assert update_product(-1, quantity=1) is False
+    assert get_product("Bulk Renamed", valid_email) is None
+
+    # R4-4 is checked against the new title and description together
+    assert update_product(product_id, title="A longer title than this",
+                          description="A short description") is False
+
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, many):
+        statements.append(statement.split()[0].upper())
+
+    event.listen(db.engine, "before_cursor_execute", listener)
+    assert update_product(product_id, title="Bulk Renamed",
+                          description=valid_description + " Updated.",
+                          price=valid_price + 500, quantity=7) is True
+    event.remove(db.engine, "before_cursor_execute", listener)
+    assert statements.count("UPDATE") == 1
+
+    product = get_product("Bulk Renamed", valid_email)
+    assert (product.price, product.quantity) == (valid_price + 500, 7)
+    assert product.description.endswith("Updated.")
+    assert get_product("Bulk Update", valid_email) is None
+
+    # keeping the current title is not a duplicate (R4-8)
+    assert update_product(product_id, title="Bulk Renamed",
+                          quantity=3) is True
+
+
+def test_import_products():
+    """
+    Testing that CSV and JSON Lines imports create the valid rows and
+    report every row.
+    """
+    owner = "importer@queensu.ca"
+    register("Importer", owner, "Imp0rt!!")
+    csv_lines = [
+        "title,description,price,quantity\n",
+        "Import Lamp,\"{}\",12.50,3\n".format(valid_description),
+        "Import Desk,too short,20,1\n",
+        "Import Lamp,\"{}\",15,1\n".format(valid_description),
+        "Import Chair,\"{}\",30,1,extra\n".format(valid_description),
+        "Import Sofa,\"{}\",40,\n".format(valid_description),
+        "Import Bench,\"{}\",inf,1\n".format(valid_description),
+        "Import Stool,\"{}\",NaN,1\n".format(valid_description),
+    ]
+    results = list(import_products(iter(csv_lines), owner, chunk_size=2))
+    assert [(result.row, result.reason) for result in results] == [
+        (1, IMPORTED), (2, INVALID_PRODUCT), (3, TITLE_IN_USE),
+        (4, UNREADABLE_ROW), (5, IMPORTED), (6, INVALID_PRODUCT),
+        (7, INVALID_PRODUCT)]
+    lamp = get_product("Import Lamp", owner)
+    assert (lamp.price, lamp.quantity) == (1250, 3)
+    assert get_product("Import Sofa", owner).quantity == 1
+
+    jsonl_lines = [
+        '{{"title": "Import Bed", "description": "{}", "price": 99}}\n'
+        .format(valid_description),
+        "not json\n",
+        '{{"title": "Import Sofa", "description": "{}", "price": 50}}\n'
+        .format(valid_description),
+    ]
+    results = list(import_products(jsonl_lines, owner))
+    assert [result.reason for result in results] == [
+        IMPORTED, UNREADABLE_ROW, TITLE_IN_USE]
+
+    results = list(import_products(jsonl_lines, "nobody@queensu.ca"))
+    assert [result.reason for result in results] == [UNKNOWN_OWNER] * 3
@@ -0,0 +1,75 @@
+"""
+Testing file for reservations.py
+"""
+
+from qbay.reservations import ReservationBook, stock_holds
+from qbay.transactions import place_order, INSUFFICIENT_STOCK
+from qbay.users import get_user, register
+from qbay.products import create_product, get_product
+from qbay_test.test_idempotency import FakeClock
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+seller = "hold_seller@queensu.ca"
+first_buyer = "hold_buyer1@queensu.ca"
+second_buyer = "hold_buyer2@queensu.ca"
+
+
+def test_holds_limit_stock():
+    """
+    Testing that holds never exceed the stock and that a buyer's own
+    hold does not count against them.
+    """
+    book = ReservationBook(ttl=60, clock=FakeClock())
+
+    assert book.reserve(1, 100, 2, stock=3) == 2
+    assert book.reserve(1, 200, 2, stock=3) == 1
+    assert book.reserve(1, 300, 1, stock=3) == 0
+    assert book.held_by_others(1, 100) == 1
+    assert book.held_by_others(1, 300) == 3
+
+    # a new hold replaces the buyer's previous one
+    assert book.reserve(1, 100, 1, stock=3) == 1
+    assert book.held_by_others(1, 300) == 2
+    assert book.release(1, 200) == 1
+    assert book.held_by_others(1, 300) == 1
+
+
+def test_holds_expire():
+    """
+    Testing that only expired holds are released by a sweep.
+    """
+    clock = FakeClock()
+    book = ReservationBook(ttl=60, clock=clock)
+    book.reserve(1, 100, 1, stock=5)
+    clock.now = 30
+    book.reserve(1, 200, 1, stock=5)
+    book.reserve(1, 100, 1, stock=5)
+
+    clock.now = 61
+    assert book.sweep() == 0
+    clock.now = 91
+    assert book.sweep() == 2
+    assert len(book) == 0
+    assert book.held_by_others(1, 300) == 0
+
+
+def test_orders_respect_holds():
+    """
+    Testing that stock held for one buyer cannot be bought by another,
+    and that the holder's order consumes the hold.
+    """
+    register("Hold Seller", seller, "H0ldSell!")
+    register("Hold Buyer", first_buyer, "H0ldBuy!")
+    register("Hold Buyer", second_buyer, "H0ldBuy!")
+    create_product("Hold Lantern", valid_description, 1000, seller,
+                   quantity=1)
+    product = get_product("Hold Lantern", seller)
+    holder = get_user(first_buyer).id
+
+    assert stock_holds.reserve(product.id, holder, 1, product.quantity) == 1
+    result = place_order("Hold Lantern", 1, second_buyer, seller)
+    assert result.reason == INSUFFICIENT_STOCK
+
+    assert place_order("Hold Lantern", 1, first_buyer, seller).success
+    assert stock_holds.held_by_others(product.id, None) == 0
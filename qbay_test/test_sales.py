@@ -0,0 +1,47 @@
+"""
+Testing file for sales.py
+"""
+
+from qbay.sales import get_seller_sales, rebuild_sales_rollups
+from qbay.transactions import order_product
+from qbay.users import register
+from qbay.products import create_product
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+seller = "rollup_seller@queensu.ca"
+buyer = "rollup_buyer@queensu.ca"
+
+
+def test_rollups_follow_orders():
+    """
+    Testing that every placed order is added to the seller's rollups.
+    """
+    register("Rollup Seller", seller, "R0llup!!")
+    register("Rollup Buyer", buyer, "R0llup!!")
+    create_product("Rollup Lamp", valid_description, 1000, seller,
+                   quantity=5)
+    create_product("Rollup Desk", valid_description, 2500, seller,
+                   quantity=5)
+
+    assert get_seller_sales(seller) == []
+    order_product("Rollup Lamp", 2, buyer, seller)
+    order_product("Rollup Lamp", 1, buyer, seller)
+    order_product("Rollup Desk", 1, buyer, seller)
+    # refused orders are not counted
+    order_product("Rollup Desk", 10, buyer, seller)
+
+    sales = {row.title: (row.units, row.revenue)
+             for row in get_seller_sales(seller)}
+    assert sales == {"Rollup Lamp": (3, 3000), "Rollup Desk": (1, 2500)}
+    assert get_seller_sales(buyer) == []
+
+
+def test_rebuild_rollups():
+    """
+    Testing that rebuilding the rollups from the transactions gives the
+    same report.
+    """
+    before = get_seller_sales(seller)
+    assert rebuild_sales_rollups() > 0
+    assert get_seller_sales(seller) == before
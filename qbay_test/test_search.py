@@ -0,0 +1,116 @@
+"""
+Testing file for search.py
+"""
+
+from qbay import app
+from qbay.products import create_product, import_products, update_product
+from qbay.products import get_product
+from qbay.search import (fuzzy_search_products, rebuild_search_index,
+                         search_products)
+from qbay.users import register
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+seller = "search_seller@queensu.ca"
+shopper = "search_shopper@queensu.ca"
+password = "S3arch!!"
+
+
+def _titles(page):
+    return [product.title for product in page.products]
+
+
+def test_search_products():
+    """
+    Testing that searches match titles and descriptions, rank title
+    matches first and stay in sync with product changes.
+    """
+    register("Search Seller", seller, password)
+    create_product("Zebrawood Lamp", valid_description, 2000, seller, 5)
+    create_product("Plain Desk", "A desk with a zebrawood top and drawers",
+                   3000, seller, 5)
+    create_product("Zebrawood Stool", valid_description, 2000, seller, 0)
+
+    # title matches rank above description matches; sold out products
+    # are left out
+    assert _titles(search_products("zebrawood")) == ["Zebrawood Lamp",
+                                                     "Plain Desk"]
+    # every word must match, in any case, and operators are plain words
+    assert _titles(search_products("ZEBRAWOOD drawers")) == ["Plain Desk"]
+    assert _titles(search_products('zebrawood* -"lamp:')) == [
+        "Zebrawood Lamp"]
+    assert search_products("zebrawood nonexistentword").total == 0
+    assert _titles(search_products("zebrawood", exclude_owner=seller)) == []
+
+    # updates and imports are searchable at once
+    lamp = get_product("Zebrawood Lamp", seller)
+    assert update_product(lamp.id, title="Walnut Lamp") is True
+    assert _titles(search_products("zebrawood")) == ["Plain Desk"]
+    assert _titles(search_products("walnut")) == ["Walnut Lamp"]
+    assert update_product(lamp.id, quantity=0) is True
+    assert search_products("walnut").total == 0
+    list(import_products(iter([
+        "title,description,price\n",
+        "Imported Walnut Chair,A sturdy chair of solid wood,40\n"]), seller))
+    assert _titles(search_products("walnut")) == ["Imported Walnut Chair"]
+
+    # a rebuild gives the same results
+    rebuild_search_index()
+    assert _titles(search_products("walnut")) == ["Imported Walnut Chair"]
+
+
+def test_search_pages():
+    """
+    Testing that search results are split into pages.
+    """
+    for number in range(5):
+        create_product("Paged Mango {}".format(number), valid_description,
+                       2000, seller, 1)
+
+    first = search_products("mango", page=1, per_page=2)
+    assert (first.page, first.pages, first.total) == (1, 3, 5)
+    last = search_products("mango", page=3, per_page=2)
+    assert len(last.products) == 1
+    seen = set(_titles(first) + _titles(last) +
+               _titles(search_products("mango", page=2, per_page=2)))
+    assert len(seen) == 5
+    # out of range pages are clamped
+    assert search_products("mango", page=9, per_page=2).page == 3
+    assert search_products("mango", page=0, per_page=2).page == 1
+
+
+def test_shop_search():
+    """
+    Testing the search box of the shop page.
+    """
+    from qbay import controllers  # noqa: F401 (registers the routes)
+
+    register("Search Shopper", shopper, password)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = shopper
+    page = client.get('/shop?q=mango&page=2').get_data(as_text=True)
+    assert "Paged Mango" in page
+    assert "Page 2 of 1" not in page
+    page = client.get('/shop?q=nonexistentword').get_data(as_text=True)
+    assert "No products match your search." in page
+
+
+def test_fuzzy_shop_search():
+    """
+    Testing that the fuzzy mode of the shop page finds misspelled titles
+    that the full-text search misses.
+    """
+    create_product("Tamarind Bookcase", valid_description, 2000, seller, 3)
+    assert search_products("tamarnd bookcse").total == 0
+    results = fuzzy_search_products("tamarnd bookcse")
+    assert _titles(results)[0] == "Tamarind Bookcase"
+    assert fuzzy_search_products("tamarnd", exclude_owner=seller).total == 0
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = shopper
+    page = client.get('/shop?q=tamarnd&mode=fuzzy').get_data(as_text=True)
+    assert "Tamarind Bookcase" in page
+    page = client.get('/shop?q=tamarnd').get_data(as_text=True)
+    assert "No products match your search." in page
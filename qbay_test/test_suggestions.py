@@ -0,0 +1,123 @@
+"""
+Testing file for suggestions.py
+"""
+
+import threading
+from sqlalchemy import event
+from qbay import app, db
+from qbay.cli import main
+from qbay.products import (create_product, get_product, import_products,
+                           update_product)
+from qbay.suggestions import TitleSuggestions, product_suggestions
+from qbay.users import register
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+seller = "suggest_seller@queensu.ca"
+
+
+def test_suggest_prefixes():
+    """
+    Testing that suggestions match title prefixes, ignoring case, in
+    alphabetical order and up to the limit.
+    """
+    suggestions = TitleSuggestions(limit=3)
+    suggestions.load(["Quince Jam", "quince Pie", "Quinoa", "Rhubarb"])
+    suggestions.add("QUINCE Tart")
+    suggestions.add("Quinces")
+
+    assert suggestions.suggest("quince") == ["Quince Jam", "quince Pie",
+                                             "QUINCE Tart"]
+    assert suggestions.suggest("QUINCE T") == ["QUINCE Tart"]
+    assert suggestions.suggest("quin", limit=2) == ["Quince Jam",
+                                                    "quince Pie"]
+    assert suggestions.suggest("quin", limit=50) == ["Quince Jam",
+                                                     "quince Pie",
+                                                     "QUINCE Tart"]
+    # limits below 1 fall back to the default, never past it
+    capped = TitleSuggestions(limit=2)
+    capped.load(["aa{}".format(n) for n in range(5)] +
+                ["zz{}".format(n) for n in range(5)])
+    assert capped.suggest("aa", limit=-3) == ["aa0", "aa1"]
+    assert capped.suggest("aa", limit=0) == ["aa0", "aa1"]
+    assert suggestions.suggest("rhubarbs") == []
+    assert suggestions.suggest("zzz") == []
+    assert suggestions.suggest("") == []
+
+    suggestions.add("Quince Marmalade", old_title="Quince Jam")
+    assert suggestions.suggest("quince m") == ["Quince Marmalade"]
+    assert suggestions.suggest("quince j") == []
+
+    stats = suggestions.stats()
+    assert stats.titles == 6
+    assert stats.bytes > 0
+
+
+def test_suggestions_follow_products():
+    """
+    Testing that created, renamed and imported products are suggested
+    at once, and that the endpoint does not query the database.
+    """
+    from qbay import controllers  # noqa: F401 (registers the routes)
+
+    register("Suggest Seller", seller, "Sugg3st!!")
+    create_product("Kumquat Lamp", valid_description, 2000, seller)
+    assert product_suggestions.suggest("kumquat") == ["Kumquat Lamp"]
+
+    product = get_product("Kumquat Lamp", seller)
+    assert update_product(product.id, title="Kumquat Desk") is True
+    list(import_products(iter([
+        "title,description,price\n",
+        "Kumquat Stool,A sturdy stool of solid wood,40\n"]), seller))
+    assert product_suggestions.suggest("kumquat") == ["Kumquat Desk",
+                                                      "Kumquat Stool"]
+
+    # a title added before the first build is listed once
+    fresh = TitleSuggestions()
+    fresh.add("Kumquat Desk", old_title="Kumquat Lamp")
+    assert fresh.suggest("kumquat d") == ["Kumquat Desk"]
+
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, many):
+        statements.append(statement)
+
+    client = app.test_client()
+    event.listen(db.engine, "before_cursor_execute", listener)
+    response = client.get('/api/products/suggest?prefix=Kumquat%20D')
+    event.remove(db.engine, "before_cursor_execute", listener)
+    assert response.get_json() == ["Kumquat Desk"]
+    response = client.get('/api/products/suggest?prefix=K&limit=-100')
+    assert len(response.get_json()) <= app.config['SUGGESTION_LIMIT']
+    assert statements == []
+
+
+def test_suggest_while_adding():
+    """
+    Testing that suggestions read while titles are added are in order
+    and match the prefix.
+    """
+    suggestions = TitleSuggestions(limit=5)
+    suggestions.load(["Medlar {:04}".format(n) for n in range(0, 4000, 2)])
+    adder = threading.Thread(target=lambda: [
+        suggestions.add("Medlar {:04}".format(n))
+        for n in range(1, 4000, 2)])
+    adder.start()
+    while adder.is_alive():
+        titles = suggestions.suggest("medlar 1")
+        assert titles == sorted(titles)
+        assert all(title.startswith("Medlar 1") for title in titles)
+    adder.join()
+    assert suggestions.stats().titles == 4000
+
+
+def test_search_stats_command(capsys):
+    """
+    Testing that the search-stats command reports the size of the
+    in-memory title indexes.
+    """
+    main(["search-stats"])
+    output = capsys.readouterr().out
+    assert "Suggestions: {} titles".format(
+        product_suggestions.stats().titles) in output
+    assert "Fuzzy search: " in output
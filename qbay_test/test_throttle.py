@@ -0,0 +1,76 @@
+"""
+Testing file for throttle.py
+"""
+
+from sqlalchemy import event
+from qbay import db
+from qbay.throttle import LoginThrottle, TokenBuckets, login_throttle
+from qbay.users import login, register
+from qbay_test.test_idempotency import FakeClock
+
+
+def test_buckets_refill_and_evict():
+    """
+    Testing that buckets run dry, refill over time and are bounded.
+    """
+    clock = FakeClock()
+    buckets = TokenBuckets(rate=1, burst=2, max_keys=2, clock=clock)
+    assert buckets.take("a") and buckets.take("a")
+    assert buckets.take("a") is False
+    clock.now = 1
+    assert buckets.take("a") is True
+    assert buckets.take("a") is False
+
+    buckets.take("b")
+    buckets.take("c")
+    assert len(buckets) == 2 and buckets.evictions == 1
+
+    # a bucket given back to full is dropped
+    clock.now = 10
+    buckets.give_back("c")
+    assert len(buckets) == 1
+
+
+def test_throttle_limits_ip_and_email():
+    """
+    Testing that attempts are limited per IP address and per email, and
+    that successful attempts do not count.
+    """
+    clock = FakeClock()
+    throttle = LoginThrottle(TokenBuckets(0, 3, clock=clock),
+                             TokenBuckets(0, 2, clock=clock))
+    assert throttle.attempt("1.1.1.1", "a@queensu.ca")
+    throttle.succeeded("1.1.1.1", "a@queensu.ca")
+    assert throttle.attempt("1.1.1.1", "a@queensu.ca")
+    assert throttle.attempt("1.1.1.1", "a@queensu.ca")
+    assert throttle.attempt("2.2.2.2", "a@queensu.ca") is False
+    assert throttle.attempt("1.1.1.1", "b@queensu.ca")
+    assert throttle.attempt("1.1.1.1", "c@queensu.ca") is False
+
+    # rejected attempts take no tokens from the other bucket
+    assert throttle.attempt("3.3.3.3", "c@queensu.ca")
+    assert throttle.attempt("3.3.3.3", "c@queensu.ca")
+    assert throttle.attempt("3.3.3.3", "a@queensu.ca") is False
+    assert throttle.attempt("3.3.3.3", "d@queensu.ca")
+
+    stats = throttle.stats()
+    assert (stats.attempts, stats.rejected) == (10, 3)
+    assert (stats.rejected_by_ip, stats.rejected_by_email) == (1, 2)
+
+
+def test_throttled_login_skips_database():
+    """
+    Testing that logins over the limit are rejected without querying
+    the database.
+    """
+    email = "throttled@queensu.ca"
+    register("Throttled User", email, "Thr0ttle!")
+    while login_throttle.attempt("10.0.0.1", email):
+        pass
+
+    statements = []
+    listener = (lambda *args: statements.append(args[2]))
+    event.listen(db.engine, "before_cursor_execute", listener)
+    assert login(email, "Thr0ttle!", "10.0.0.2") is None
+    event.remove(db.engine, "before_cursor_execute", listener)
+    assert statements == []
@@ -0,0 +1,83 @@
+"""
+Testing file for titles.py
+"""
+
+import datetime
+from sqlalchemy import event
+from qbay import db
+from qbay.models import Product
+from qbay.products import create_product, update_product_title
+from qbay.titles import BloomFilter, TitleFilter, product_titles
+from qbay.users import register
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+owner = "titles_owner@queensu.ca"
+
+
+def test_bloom_filter():
+    """
+    Testing that added items are always found and the false positive
+    rate stays near the configured rate.
+    """
+    bloom = BloomFilter(1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add("title {}".format(i))
+    assert all("title {}".format(i) in bloom for i in range(1000))
+    false_positives = sum("other {}".format(i) in bloom
+                          for i in range(10000))
+    assert false_positives < 300
+
+
+def test_unused_titles_skip_database():
+    """
+    Testing that R4-8 checks of unused titles do not query the database
+    and that used titles are still rejected.
+    """
+    register("Titles Owner", owner, "T1tles!!")
+    assert create_product("Titles Lamp", valid_description, 2000, owner)
+    assert create_product("Titles Lamp", valid_description, 2000,
+                          owner) is False
+
+    statements = []
+    listener = (lambda *args: statements.append(args[2]))
+    event.listen(db.engine, "before_cursor_execute", listener)
+    assert product_titles.is_used("Titles Never Used", None) is False
+    event.remove(db.engine, "before_cursor_execute", listener)
+    assert statements == []
+
+    assert update_product_title("Titles Lamp", owner, "Titles Desk")
+    assert create_product("Titles Desk", valid_description, 2000,
+                          owner) is False
+    # the old title is a false positive the query resolves
+    assert create_product("Titles Lamp", valid_description, 2000, owner)
+
+
+def test_filter_grows_and_unique_index_backs_it_up():
+    """
+    Testing that the filter rebuilds past its capacity, and that a title
+    written by another process is rejected by the unique index.
+    """
+    titles = TitleFilter(capacity=1)
+    titles.add("Titles Lamp")
+    titles.add("Titles Desk")
+    assert titles.stats().capacity >= 4
+    assert titles.is_used("Titles Desk", lambda: True) is True
+
+    # inserted behind the filter's back, as another process would
+    db.session.add(Product(title="Titles Chair",
+                           description=valid_description, price=2000,
+                           last_modified_date=datetime.datetime.now(),
+                           owner_email=owner, quantity=1))
+    db.session.commit()
+    product_titles.reset()
+    product_titles.is_used("Titles Warmup", lambda: False)
+    db.session.add(Product(title="Titles Sofa",
+                           description=valid_description, price=2000,
+                           last_modified_date=datetime.datetime.now(),
+                           owner_email=owner, quantity=1))
+    db.session.commit()
+    assert create_product("Titles Sofa", valid_description, 2000,
+                          owner) is False
+    assert create_product("Titles Chair", valid_description, 2000,
+                          owner) is False
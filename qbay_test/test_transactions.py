@@ -3,10 +3,21 @@ Testing file for products.py
 """
 
 # Import the required functions for testing
-from qbay.transactions import order_product
+import threading
+from sqlalchemy import event
+from qbay import transactions
+from qbay.flash_sale import get_flash_sale
+from qbay.models import Product, Transaction
+from qbay.transactions import (order_product, place_order,
+                               get_order_history, get_sales_history,
+                               start_flash_sale, stop_flash_sale,
+                               INSUFFICIENT_BALANCE, INSUFFICIENT_STOCK,
+                               INVALID_QUANTITY, ORDER_PENDING, OWN_PRODUCT,
+                               UNKNOWN_PRODUCT)
 from qbay.users import (get_balance, register, increase_balance,
                         decrease_balance)
-from qbay.products import create_product
+from qbay.products import create_product, get_product, update_product
+from qbay import db
 from qbay_test.test_products import valid_description
 
 # Define any required variables for testing
@@ -87,3 +98,193 @@ def test_r6_3_transaction():
     # Give $10 then try to buy again
     increase_balance(buyer, 1000)
     assert order_product(product6, 1, buyer, seller) is True
+
+
+def test_place_order_result():
+    """
+    Testing that place_order reports why an order was refused and
+    records the transaction of a placed order.
+    """
+    create_product("Seven Layer Cake", valid_description, 1000, seller,
+                   quantity=2)
+
+    result = place_order("Seven Layer Cake", 3, buyer, seller)
+    assert result.success is False
+    assert result.reason == INSUFFICIENT_STOCK
+
+    result = place_order("Seven Layer Cake", 0, buyer, seller)
+    assert result.reason == INVALID_QUANTITY
+
+    result = place_order("No Such Cake", 1, buyer, seller)
+    assert result.reason == UNKNOWN_PRODUCT
+
+    decrease_balance(buyer, get_balance(buyer))
+    result = place_order("Seven Layer Cake", 1, buyer, seller)
+    assert result.reason == INSUFFICIENT_BALANCE
+    assert get_product("Seven Layer Cake", seller).quantity == 2
+
+    increase_balance(buyer, 2000)
+    seller_balance = get_balance(seller)
+    result = place_order("Seven Layer Cake", 2, buyer, seller)
+    assert result.success is True
+    assert result.total_price == 2000
+    assert get_balance(buyer) == 0
+    assert get_balance(seller) == seller_balance + 2000
+    assert get_product("Seven Layer Cake", seller).quantity == 0
+
+    transaction = db.session.query(Transaction).filter_by(
+        id=result.transaction_id).first()
+    assert transaction.quantity == 2
+    assert transaction.total_price == 2000
+
+
+def test_order_history_pages():
+    """
+    Testing that order history is returned newest first, one page at a
+    time, without repeating or skipping transactions.
+    """
+    history_buyer = "history_buyer@queensu.ca"
+    register("History Buyer", history_buyer, "Hist0ry!")
+    create_product("History Mug", valid_description, 1000, seller,
+                   quantity=10)
+    for _ in range(5):
+        assert order_product("History Mug", 1, history_buyer, seller) is True
+
+    seen = []
+    page = get_order_history(history_buyer, limit=2)
+    seen += [transaction.id for transaction, _ in page.entries]
+    while page.next_cursor is not None:
+        page = get_order_history(history_buyer, page.next_cursor, limit=2)
+        seen += [transaction.id for transaction, _ in page.entries]
+    assert len(seen) == 5
+    assert seen == sorted(seen, reverse=True)
+    assert page.entries[0][1] == "History Mug"
+
+    sales = get_sales_history(seller, limit=100).entries
+    assert seen[0] in [transaction.id for transaction, _ in sales]
+    assert get_order_history("nobody@queensu.ca").entries == []
+
+    # cursors that were not made by a previous page give the first page
+    first = get_order_history(history_buyer, limit=2)
+    for cursor in ["garbage", "_", "2024-13-01T00:00:00_1",
+                   "2024-06-01T00:00:00_x", "2024-06-01T00:00:00_"]:
+        assert get_order_history(history_buyer, cursor,
+                                 limit=2) == first
+
+    from qbay import app, controllers  # noqa: F401 (registers the routes)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = history_buyer
+    for view in ["purchases", "sales"]:
+        response = client.get('/order-history?view={}&cursor=garbage'.format(
+            view))
+        assert response.status_code == 200
+
+
+def test_flash_sale_orders():
+    """
+    Testing that orders for a product in flash-sale mode are applied by
+    the drainer and refused without database access once sold out.
+    """
+    flash_buyer = "flash_buyer@queensu.ca"
+    register("Flash Buyer", flash_buyer, "Fl@sh123")
+    create_product("Flash Phone", valid_description, 1000, seller,
+                   quantity=3)
+
+    assert start_flash_sale("Flash Phone", seller, batch_size=10) is True
+    assert start_flash_sale("Flash Phone", seller) is False
+    assert place_order("Flash Phone", 1, seller, seller).reason == OWN_PRODUCT
+
+    threads = [threading.Thread(target=order_product,
+                                args=("Flash Phone", 1, flash_buyer, seller))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    statements = []
+    listener = (lambda *args: statements.append(args[2]))
+    event.listen(db.engine, "before_cursor_execute", listener)
+    result = place_order("Flash Phone", 1, flash_buyer, seller)
+    event.remove(db.engine, "before_cursor_execute", listener)
+    assert result.reason == INSUFFICIENT_STOCK
+    assert statements == []
+
+    assert stop_flash_sale("Flash Phone", seller) is True
+    assert stop_flash_sale("Flash Phone", seller) is False
+    assert get_product("Flash Phone", seller).quantity == 0
+    assert len(get_order_history(flash_buyer).entries) == 3
+
+
+def test_flash_sale_resyncs_stock():
+    """
+    Testing that a flash sale counting more stock than the database holds
+    places the orders that fit and keeps selling what is left.
+    """
+    flash_buyer = "flash_resync@queensu.ca"
+    register("Flash Resync", flash_buyer, "Fl@sh123")
+    create_product("Flash Tablet", valid_description, 1000, seller,
+                   quantity=3)
+    assert start_flash_sale("Flash Tablet", seller) is True
+
+    # an order placed around the sale takes two units
+    db.session.query(Product).filter_by(title="Flash Tablet").update(
+        {Product.quantity: 1})
+    db.session.commit()
+
+    assert place_order("Flash Tablet", 2, flash_buyer,
+                       seller).reason == INSUFFICIENT_STOCK
+    assert get_flash_sale("Flash Tablet", seller).remaining == 1
+    assert place_order("Flash Tablet", 1, flash_buyer, seller).success
+    assert place_order("Flash Tablet", 1, flash_buyer,
+                       seller).reason == INSUFFICIENT_STOCK
+
+    assert stop_flash_sale("Flash Tablet", seller) is True
+    assert get_product("Flash Tablet", seller).quantity == 0
+    assert len(get_order_history(flash_buyer).entries) == 1
+
+
+def test_flash_sale_pending_order(monkeypatch):
+    """
+    Testing that an order the drainer has not applied in time is reported
+    as pending and is still placed.
+    """
+    flash_buyer = "flash_pending@queensu.ca"
+    register("Flash Pending", flash_buyer, "Fl@sh123")
+    create_product("Flash Watch", valid_description, 1000, seller,
+                   quantity=2)
+    assert start_flash_sale("Flash Watch", seller) is True
+
+    release = threading.Event()
+    sale = get_flash_sale("Flash Watch", seller)
+    apply_batch = sale.apply_batch
+    sale.apply_batch = (lambda *args: release.wait() and apply_batch(*args))
+    monkeypatch.setattr(transactions, "FLASH_WAIT_SECONDS", 0.01)
+
+    result = place_order("Flash Watch", 1, flash_buyer, seller)
+    assert (result.success, result.reason) == (False, ORDER_PENDING)
+    release.set()
+    assert stop_flash_sale("Flash Watch", seller) is True
+    assert get_product("Flash Watch", seller).quantity == 1
+    assert len(get_order_history(flash_buyer).entries) == 1
+
+
+def test_flash_sale_keeps_title_and_price():
+    """
+    Testing that a product in flash-sale mode cannot be renamed or
+    repriced, so its orders keep going through the sale.
+    """
+    create_product("Flash Camera", valid_description, 1000, seller,
+                   quantity=2)
+    camera = get_product("Flash Camera", seller)
+    assert start_flash_sale("Flash Camera", seller) is True
+
+    assert update_product(camera.id, title="Flash Camera Two") is False
+    assert update_product(camera.id, price=2000) is False
+    assert update_product(camera.id, title="Flash Camera",
+                          description=valid_description + " Sale") is True
+    assert get_flash_sale("Flash Camera", seller) is not None
+
+    assert stop_flash_sale("Flash Camera", seller) is True
+    assert update_product(camera.id, title="Flash Camera Two") is True
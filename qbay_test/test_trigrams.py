@@ -0,0 +1,81 @@
+"""
+Testing file for trigrams.py
+"""
+
+from qbay.products import (create_product, get_product, import_products,
+                           update_product)
+from qbay.trigrams import TrigramIndex, product_trigrams, trigrams
+from qbay.users import register
+from qbay_test.test_products import valid_description
+
+# Define any required variables for testing
+seller = "trigram_seller@queensu.ca"
+
+
+def test_trigrams():
+    """
+    Testing that words are split into padded trigrams, ignoring case and
+    punctuation.
+    """
+    assert trigrams("Oak") == {"  o", " oa", "oak", "ak "}
+    assert trigrams("OAK, oak!") == trigrams("oak")
+    assert trigrams("a b") == {"  a", " a ", "  b", " b "}
+    assert trigrams("  ") == set()
+
+
+def test_search_ranks_misspellings():
+    """
+    Testing that misspelled searches find the titles meant, closest
+    first, and that unrelated titles do not match.
+    """
+    index = TrigramIndex(threshold=0.3)
+    index.load([(1, "Walnut Coffee Table"), (2, "Walnut Desk"),
+                (3, "Oak Chair"), (4, "Garden Hose"), (5, "Walnut")])
+
+    assert [product_id for product_id, _ in index.search("walnutt")] == [
+        5, 2, 1]
+    assert index.search("wallnut desk")[0][0] == 2
+    assert index.search("oak chiar")[0][0] == 3
+    assert index.search("xylophone") == []
+    assert index.search("") == []
+    assert len(index.search("walnut", limit=2)) == 2
+
+    similarity = dict(index.search("garden hose"))[4]
+    assert similarity == 1.0
+
+    # renames move a product between postings
+    index.add(4, "Garden Rake", old_title="Garden Hose")
+    assert 4 not in dict(index.search("hose"))
+    assert 4 in dict(index.search("rake"))
+    assert index.stats().titles == 5
+
+
+def test_search_bounds_candidates():
+    """
+    Testing that a search scores at most max_candidates titles.
+    """
+    index = TrigramIndex(threshold=0.3, max_candidates=10)
+    index.load((number, "Chair {}".format(number))
+               for number in range(1, 1001))
+    assert len(index.search("chair", limit=1000)) <= 10
+
+
+def test_index_follows_products():
+    """
+    Testing that created, renamed and imported products are in the index
+    at once.
+    """
+    register("Trigram Seller", seller, "Tr1gram!!")
+    create_product("Persimmon Lamp", valid_description, 2000, seller)
+    lamp = get_product("Persimmon Lamp", seller)
+    assert lamp.id in dict(product_trigrams.search("persimon"))
+
+    assert update_product(lamp.id, title="Apricot Lamp") is True
+    assert lamp.id not in dict(product_trigrams.search("persimon"))
+    assert lamp.id in dict(product_trigrams.search("apricott"))
+
+    list(import_products(iter([
+        "title,description,price\n",
+        "Persimmon Stool,A sturdy stool of solid wood,40\n"]), seller))
+    stool = get_product("Persimmon Stool", seller)
+    assert product_trigrams.search("persimon")[0][0] == stool.id
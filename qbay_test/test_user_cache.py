@@ -0,0 +1,69 @@
+"""
+Testing file for user_cache.py
+"""
+
+from qbay.user_cache import UserCache, authenticated_users
+from qbay.users import register, update_user_name
+from qbay_test.test_idempotency import FakeClock
+
+
+def test_cache_hits_evicts_and_expires():
+    """
+    Testing that users are served from the cache until they are evicted
+    or expire.
+    """
+    clock = FakeClock()
+    cache = UserCache(max_size=2, ttl=60, clock=clock)
+    loads = []
+
+    def loader(email):
+        return lambda: loads.append(email) or email.upper()
+
+    assert cache.get("a", loader("a")) == "A"
+    assert cache.get("a", loader("a")) == "A"
+    assert cache.get("b", loader("b")) == "B"
+    assert cache.get("a", loader("a")) == "A"
+    # "b" is the least recently used
+    assert cache.get("c", loader("c")) == "C"
+    assert cache.get("b", loader("b")) == "B"
+    assert loads == ["a", "b", "c", "b"]
+
+    clock.now = 61
+    assert cache.get("b", loader("b")) == "B"
+    stats = cache.stats()
+    assert (stats.hits, stats.misses) == (2, 5)
+    assert (stats.evictions, stats.expirations) == (2, 1)
+    assert cache.get("missing", lambda: None) is None
+    assert len(cache) == 2
+
+
+def test_bump_invalidates():
+    """
+    Testing that bumping an email drops its cached user, and that a user
+    loaded while the email was bumped is not cached.
+    """
+    cache = UserCache(max_size=10, ttl=60, clock=FakeClock())
+    cache.get("a", lambda: "old")
+    cache.bump("a")
+    assert cache.get("a", lambda: "new") == "new"
+    assert cache.stats().invalidations == 1
+
+    def stale_load():
+        cache.bump("a")
+        return "stale"
+
+    cache.bump("a")
+    assert cache.get("a", stale_load) == "stale"
+    assert cache.get("a", lambda: "fresh") == "fresh"
+    assert cache.get("a", lambda: "unused") == "fresh"
+
+
+def test_profile_updates_bump():
+    """
+    Testing that profile updates invalidate the authenticated user cache.
+    """
+    email = "user_cache@queensu.ca"
+    register("Cache User", email, "C4che!!")
+    authenticated_users.get(email, lambda: "cached")
+    assert update_user_name(email, "Cache Renamed") is True
+    assert authenticated_users.get(email, lambda: "reloaded") == "reloaded"
@@ -2,9 +2,15 @@
 Testing file for users.py
 """
 
+from qbay import db
+from qbay.models import User
 from qbay.users import login, register
 from qbay.users import get_address, get_postal_code, get_balance, \
     update_user_name, update_shipping_address, update_postal_code
+from qbay.users import adjust_balance, adjust_balances, get_userid
+from qbay.users import (EMAIL_IN_USE, INVALID_REGISTRATION,
+                        RETRY_EXHAUSTED, register_many)
+from qbay.users import get_user_profile, update_profile
 
 # Define any required variables for testing
 valid_email = "test2@queensu.ca"
@@ -276,3 +282,148 @@ def test_r3_4_update_username():
 
     # alphanumeric only
     assert update_user_name("spam@gmail.com", "TesterMan!") is False
+
+
+def test_adjust_balance():
+    """
+    Testing that balance adjustments apply atomically and never leave a
+    balance below the floor.
+    """
+    register("Adjust Buyer", "adjust_buyer@queensu.ca", valid_password)
+    register("Adjust Seller", "adjust_seller@queensu.ca", valid_password)
+
+    assert adjust_balance("adjust_buyer@queensu.ca", -10001) is False
+    assert adjust_balance("adjust_buyer@queensu.ca", -100) is True
+    assert adjust_balance(get_userid("adjust_buyer@queensu.ca"), 50) is True
+    assert adjust_balance("missing@queensu.ca", 50) is False
+    assert get_balance("adjust_buyer@queensu.ca") == 9950
+
+    # all or nothing
+    assert adjust_balances([("adjust_buyer@queensu.ca", -9951),
+                            ("adjust_seller@queensu.ca", 9951)]) is False
+    assert get_balance("adjust_seller@queensu.ca") == 10000
+    assert adjust_balances([("adjust_buyer@queensu.ca", -9950),
+                            ("adjust_seller@queensu.ca", 9950)]) is True
+    assert get_balance("adjust_buyer@queensu.ca") == 0
+    assert get_balance("adjust_seller@queensu.ca") == 19950
+
+
+def test_register_many():
+    """
+    Testing that bulk registration reports a result per record and skips
+    invalid records and emails already in use.
+    """
+    results = register_many([
+        ("Bulk One", "bulk1@queensu.ca", valid_password),
+        ("Bulk Two", "bulk2@queensu.ca", "weak"),
+        ("Bulk Three", valid_email, valid_password),
+        ("Bulk Four", "bulk1@queensu.ca", valid_password),
+        ("Bulk Five", "bulk5@queensu.ca", valid_password),
+    ], chunk_size=2)
+
+    assert [result.success for result in results] == [
+        True, False, False, False, True]
+    assert results[1].reason == INVALID_REGISTRATION
+    assert results[2].reason == EMAIL_IN_USE
+    assert results[3].reason == EMAIL_IN_USE
+    assert login("bulk5@queensu.ca", valid_password) is not None
+    assert get_balance("bulk1@queensu.ca") == 10000
+    assert get_address("bulk1@queensu.ca") == ""
+
+
+def test_register_many_hashes_outside_transaction(monkeypatch):
+    """
+    Testing that bulk registration hashes before writing, and that its
+    retry after a concurrent registration does not hash again.
+    """
+    from qbay import users
+    hashed = []
+
+    def hash_passwords(passwords):
+        # no write transaction may be open while hashing
+        assert not db.session().in_transaction()
+        hashed.extend(passwords)
+        if (len(hashed) == 2):
+            # another process registers one of the emails meanwhile
+            db.session.execute(User.__table__.insert(), [users._new_user(
+                "Bulk Racer", "bulkrace1@queensu.ca", "x")])
+            db.session.commit()
+        return ["hash-" + password for password in passwords]
+
+    monkeypatch.setattr(users, "hash_passwords", hash_passwords)
+    results = register_many([
+        ("Bulk Race One", "bulkrace1@queensu.ca", valid_password),
+        ("Bulk Race Two", "bulkrace2@queensu.ca", valid_password + "2"),
+    ])
+    assert [result.success for result in results] == [False, True]
+    assert results[0].reason == EMAIL_IN_USE
+    assert hashed == [valid_password, valid_password + "2"]
+
+
+def test_register_many_retry_exhausted(monkeypatch):
+    """
+    Testing that a batch whose insert fails twice reports only the
+    records it tried to insert as failed by the retry, and keeps the
+    reasons of the others.
+    """
+    from sqlalchemy.exc import IntegrityError
+    from qbay import users
+    inserts = []
+
+    def insert_users(accepted, hashes, chunk_size):
+        inserts.append(accepted)
+        raise IntegrityError("INSERT INTO user", {}, None)
+
+    monkeypatch.setattr(users, "_insert_users", insert_users)
+    results = register_many([
+        ("Bulk Retry", "bulkretry@queensu.ca", valid_password),
+        ("Bulk Retry", "not an email", valid_password),
+        ("Bulk Retry", "bulkrace2@queensu.ca", valid_password),
+    ])
+    assert len(inserts) == 2
+    assert [(result.success, result.reason) for result in results] == [
+        (False, RETRY_EXHAUSTED), (False, INVALID_REGISTRATION),
+        (False, EMAIL_IN_USE)]
+    assert db.session.query(User).filter_by(
+        email="bulkretry@queensu.ca").count() == 0
+
+
+def test_get_user_profile():
+    """
+    Testing that profiles load only the requested fields.
+    """
+    profile = get_user_profile("adjust_seller@queensu.ca",
+                               ("user_name", "balance"))
+    assert profile.user_name == "Adjust Seller"
+    assert profile.balance == get_balance("adjust_seller@queensu.ca")
+    assert not hasattr(profile, "postal_code")
+
+    profile = get_user_profile("adjust_seller@queensu.ca")
+    assert profile.id == get_userid("adjust_seller@queensu.ca")
+    assert profile.shipping_address == "" and profile.postal_code == ""
+    assert get_user_profile("missing@queensu.ca") is None
+    assert get_balance("missing@queensu.ca") is None
+
+
+def test_update_profile():
+    """
+    Testing that profile updates validate every field before writing any.
+    """
+    email = "adjust_buyer@queensu.ca"
+    assert update_profile(email, user_name="Profile Name",
+                          shipping_address="1 Main Street",
+                          postal_code="K7L 3N6") is True
+    profile = get_user_profile(email)
+    assert (profile.user_name, profile.shipping_address,
+            profile.postal_code) == ("Profile Name", "1 Main Street",
+                                     "K7L 3N6")
+
+    # one invalid field rejects the whole update
+    assert update_profile(email, user_name="Other Name",
+                          postal_code="K7L3N6") is False
+    assert get_user_profile(email, ("user_name",)).user_name == \
+        "Profile Name"
+
+    assert update_profile(email) is False
+    assert update_profile(email, balance=0) is False
+    assert update_profile("missing@queensu.ca", user_name="Nobody") is False
@@ -0,0 +1,51 @@
+"""
+Testing file for validation.py
+"""
+
+from sqlalchemy import event
+from qbay import db
+from qbay.products import create_product
+from qbay.users import register
+from qbay.validation import (CHEAP, DATABASE, PATTERN, Rule, Validator,
+                             reset_rule_stats, rule_stats)
+
+
+def test_rules_run_cheapest_first():
+    """
+    Testing that rules run in order of cost and stop at the first failure.
+    """
+    calls = []
+
+    def rule(name, cost, passes=True):
+        return Rule(name, lambda values: calls.append(name) or passes, cost)
+
+    validator = Validator(rule("database", DATABASE),
+                          rule("pattern", PATTERN, passes=False),
+                          rule("cheap", CHEAP))
+    assert validator.failed_rule() == "pattern"
+    assert calls == ["cheap", "pattern"]
+
+    reset_rule_stats()
+    assert validator() is False
+    stats = rule_stats()
+    assert stats["pattern"].calls == 1 and stats["pattern"].failures == 1
+    assert stats["cheap"].failures == 0
+    assert "database" not in stats
+
+
+def test_invalid_input_skips_database():
+    """
+    Testing that invalid registrations and products are rejected without
+    querying the database.
+    """
+    statements = []
+    listener = (lambda *args: statements.append(args[2]))
+    event.listen(db.engine, "before_cursor_execute", listener)
+    assert register("Bot", "not-an-email", "Passw0rd!") is False
+    assert register("Bot User", "bot@queensu.ca", "password") is False
+    assert create_product("Bot Product", "short", 2000,
+                          "bot@queensu.ca") is False
+    assert create_product("Bot Product", "long enough description", 1,
+                          "bot@queensu.ca") is False
+    event.remove(db.engine, "before_cursor_execute", listener)
+    assert statements == []